@@ -1,6 +1,15 @@
 # agents/router_gpt2.py
-# Minimal deterministic router with RDP simplification.
-from math import hypot
+# Deterministic grid router: rooms are rasterised into a cost grid (walls are
+# expensive to cross, open space outside rooms mildly so), each leg is routed
+# with A* and the result is simplified with RDP.
+from heapq import heappop, heappush
+from math import ceil, floor, hypot, inf, sqrt
+
+WALL_COST = 10.0     # per cell of wall crossed: worth a short detour, never a hard block
+OUTSIDE_COST = 2.0   # unmapped space (voids, outside any room polygon)
+MAX_GRID_CELLS = 200 # cells along the longer side when no cell size is given
+DIAG = sqrt(2)
+NEAR_NEIGHBOURS = 10 # insertion candidates per node for Or-opt moves
 
 def _rdp(points, epsilon=2.0):
     if len(points) < 3:
@@ -25,18 +34,343 @@ def _rdp(points, epsilon=2.0):
         return [points[0], points[-1]]
 
 def naive_path(a, b):
-    # Straight line for now; placeholder for A*.
+    # Straight line; used when there is no floor plan to route around.
     return [a, b]
 
-def route_circuit(source_port, target_ports, wire="14/2"):
+def _supercover(x0, y0, x1, y1):
+    # Every cell a segment touches (grid units), 4-connected so that a
+    # rasterised wall cannot be slipped through diagonally.
+    cx, cy = floor(x0), floor(y0)
+    ex, ey = floor(x1), floor(y1)
+    dx, dy = x1 - x0, y1 - y0
+    sx = 1 if dx > 0 else -1
+    sy = 1 if dy > 0 else -1
+    tdx = abs(1 / dx) if dx else inf
+    tdy = abs(1 / dy) if dy else inf
+    tx = ((cx + 1 - x0) if dx > 0 else (x0 - cx)) * tdx if dx else inf
+    ty = ((cy + 1 - y0) if dy > 0 else (y0 - cy)) * tdy if dy else inf
+    cells = [(cx, cy)]
+    # Exactly |dx| + |dy| unit steps; once one axis is done only the other moves,
+    # so rounding at cell corners can never overshoot the end cell
+    for _ in range(abs(ex - cx) + abs(ey - cy)):
+        if cy == ey or (cx != ex and tx < ty):
+            cx += sx; tx += tdx
+        else:
+            cy += sy; ty += tdy
+        cells.append((cx, cy))
+    return cells
+
+class RoutingGrid:
+    # Flat cost grid over the plan. Cell i is (i % width, i // width); the
+    # outer ring is blocked (cost inf) so A* needs no bounds checks.
+    def __init__(self, x0, y0, cell, width, height, default_cost=1.0):
+        self.x0, self.y0, self.cell = x0, y0, cell
+        self.width, self.height = width, height
+        self.cost = [default_cost] * (width * height)
+        for x in range(width):
+            self.cost[x] = self.cost[(height - 1) * width + x] = inf
+        for y in range(height):
+            self.cost[y * width] = self.cost[y * width + width - 1] = inf
+        w = width
+        self.steps = [(1, 1.0), (-1, 1.0), (w, 1.0), (-w, 1.0),
+                      (w + 1, DIAG), (w - 1, DIAG), (-w + 1, DIAG), (-w - 1, DIAG)]
+
+    def to_grid(self, x, y):
+        # Plan coordinates -> fractional grid coordinates
+        return (x - self.x0) / self.cell, (y - self.y0) / self.cell
+
+    def index(self, x, y):
+        gx, gy = self.to_grid(x, y)
+        gx = min(max(int(gx), 1), self.width - 2)
+        gy = min(max(int(gy), 1), self.height - 2)
+        return gy * self.width + gx
+
+    def center(self, i):
+        return (self.x0 + (i % self.width + 0.5) * self.cell,
+                self.y0 + (i // self.width + 0.5) * self.cell)
+
+    def set_cost(self, i, c):
+        if self.cost[i] != inf:
+            self.cost[i] = c
+
+    def fill_polygon(self, points, c):
+        # Even-odd scanline fill of cell centres
+        n = len(points)
+        for gy in range(1, self.height - 1):
+            yc = gy + 0.5
+            xs = []
+            for k in range(n):
+                (ax, ay), (bx, by) = points[k], points[(k + 1) % n]
+                if (ay <= yc) != (by <= yc):
+                    xs.append(ax + (yc - ay) * (bx - ax) / (by - ay))
+            xs.sort()
+            row = gy * self.width
+            for left, right in zip(xs[::2], xs[1::2]):
+                for gx in range(max(ceil(left - 0.5), 1), min(floor(right - 0.5), self.width - 2) + 1):
+                    self.set_cost(row + gx, c)
+
+    def draw_segment(self, a, b, c):
+        for gx, gy in _supercover(a[0], a[1], b[0], b[1]):
+            if 0 <= gx < self.width and 0 <= gy < self.height:
+                self.set_cost(gy * self.width + gx, max(self.cost[gy * self.width + gx], c))
+
+    def clear_line(self, i, j, budget):
+        # True if the straight run between cells i and j costs at most `budget`
+        # above open floor (so it crosses no more walls than the route it replaces)
+        w = self.width
+        spent = 0.0
+        for gx, gy in _supercover(i % w + 0.5, i // w + 0.5, j % w + 0.5, j // w + 0.5):
+            spent += self.cost[gy * w + gx] - 1.0
+            if spent > budget + 1e-9:
+                return False
+        return True
+
+    def walls_on(self, points, wall_cost=WALL_COST):
+        # Wall cells a plan-unit polyline runs through (for reporting/benchmarks)
+        hit = set()
+        for a, b in zip(points, points[1:]):
+            for gx, gy in _supercover(*self.to_grid(*a), *self.to_grid(*b)):
+                i = gy * self.width + gx
+                if 0 <= gx < self.width and 0 <= gy < self.height and wall_cost <= self.cost[i] < inf:
+                    hit.add(i)
+        return len(hit)
+
+def build_grid(floorplan, cell=None, wall_cost=WALL_COST, outside_cost=OUTSIDE_COST):
+    # Rasterise FLOORPLAN_SCHEMA rooms: interiors cost 1, room outlines are walls.
+    rooms = [[(p["x"], p["y"]) for p in r.get("polygon") or []] for r in floorplan.get("rooms") or []]
+    rooms = [r for r in rooms if len(r) >= 3]
+    pts = [p for r in rooms for p in r]
+    pts += [(p["point"]["x"], p["point"]["y"]) for p in floorplan.get("panels") or [] if p.get("point")]
+    pts += [(s["port"]["x"], s["port"]["y"]) for s in floorplan.get("symbols") or [] if s.get("port")]
+    if not pts:
+        raise ValueError("floorplan has no geometry to route over")
+    min_x = min(p[0] for p in pts); max_x = max(p[0] for p in pts)
+    min_y = min(p[1] for p in pts); max_y = max(p[1] for p in pts)
+    if cell is None:
+        cell = max(max_x - min_x, max_y - min_y, 1.0) / MAX_GRID_CELLS
+    pad = 2 * cell  # room to route round the outside and the blocked ring
+    width = int((max_x - min_x) / cell) + 5
+    height = int((max_y - min_y) / cell) + 5
+    grid = RoutingGrid(min_x - pad, min_y - pad, cell, width, height,
+                       default_cost=outside_cost if rooms else 1.0)
+    for room in rooms:
+        grid.fill_polygon([grid.to_grid(x, y) for x, y in room], 1.0)
+    for room in rooms:
+        gpts = [grid.to_grid(x, y) for x, y in room]
+        for a, b in zip(gpts, gpts[1:] + gpts[:1]):
+            grid.draw_segment(a, b, wall_cost)
+    return grid
+
+def astar(grid, start, goal):
+    # A* over cell indices with an octile heuristic (admissible: no cell costs < 1).
+    # Returns the list of cell indices from start to goal, or None.
+    cost, w, steps = grid.cost, grid.width, grid.steps
+    g = [inf] * len(cost)
+    came = [-1] * len(cost)
+    closed = bytearray(len(cost))
+    gx, gy = goal % w, goal // w
+    extra = DIAG - 2
+    g[start] = 0.0
+    heap = [(0.0, start)]
+    while heap:
+        _, cur = heappop(heap)
+        if cur == goal:
+            break
+        if closed[cur]:
+            continue
+        closed[cur] = 1
+        base = g[cur]
+        for off, dist in steps:
+            nxt = cur + off
+            ng = base + dist * cost[nxt]
+            if ng < g[nxt] and not closed[nxt]:
+                g[nxt] = ng
+                came[nxt] = cur
+                dx = abs(nxt % w - gx); dy = abs(nxt // w - gy)
+                heappush(heap, (ng + dx + dy + extra * (dx if dx < dy else dy), nxt))
+    else:
+        return None
+    cells = [goal]
+    while cells[-1] != start:
+        cells.append(came[cells[-1]])
+    cells.reverse()
+    return cells
+
+def grid_path(grid, a, b, epsilon=None):
+    # Route a -> b (plan units) and return simplified plan-unit points.
+    start, goal = grid.index(*a), grid.index(*b)
+    cells = astar(grid, start, goal) if start != goal else [start]
+    if cells is None:
+        return naive_path(a, b)
+    # Positions (in `cells`) where the direction changes, plus both ends
+    turns = [0] + [k for k in range(1, len(cells) - 1)
+                   if cells[k] - cells[k - 1] != cells[k + 1] - cells[k]] + [len(cells) - 1]
+    # String-pull away the 8-connected staircase: a shortcut between turns is
+    # taken only if it pays no more wall/outside cost than the cells it replaces
+    extra, total = [0.0], 0.0
+    for i in cells:
+        total += grid.cost[i] - 1.0
+        extra.append(total)
+    kept, k = [0], 0
+    while k < len(turns) - 1:
+        j = len(turns) - 1
+        while j > k + 1 and not grid.clear_line(cells[turns[k]], cells[turns[j]],
+                                                extra[turns[j] + 1] - extra[turns[k]]):
+            j -= 1
+        kept.append(j)
+        k = j
+    pts = [a] + [grid.center(cells[turns[k]]) for k in kept[1:-1]] + [b]
+    return _rdp(pts, epsilon=grid.cell / 2 if epsilon is None else epsilon)
+
+def path_length(path):
+    return sum(hypot(q["x"] - p["x"], q["y"] - p["y"]) for p, q in zip(path, path[1:]))
+
+def _distances(points):
+    return [[hypot(bx - ax, by - ay) for bx, by in points] for ax, ay in points]
+
+def _or_opt(dist, seq, near):
+    # Move runs of 1-3 nodes (either way round) next to one of their near
+    # neighbours when that is cheaper; True if anything moved
+    moved = False
+    pos = {node: k for k, node in enumerate(seq)}
+    for size in (1, 2, 3):
+        for i in range(1, len(seq) - size + 1):
+            run = seq[i:i + size]
+            s0, s1 = run[0], run[-1]
+            p = seq[i - 1]
+            nx = seq[i + size] if i + size < len(seq) else None
+            gain = dist[p][s0] + (dist[s1][nx] - dist[p][nx] if nx is not None else 0.0)
+            # Candidate slots are indices into seq without the run: insert after slot a
+            m = len(seq) - size
+            best = None
+            for u in near[s0] + near[s1]:
+                k = pos[u]
+                if i <= k < i + size:
+                    continue
+                ru = k if k < i else k - size
+                for a in (ru - 1, ru):
+                    if a < 0 or a == i - 1:
+                        continue
+                    u_ = seq[a] if a < i else seq[a + size]
+                    v_ = None if a + 1 >= m else (seq[a + 1] if a + 1 < i else seq[a + 1 + size])
+                    closing = dist[u_][v_] if v_ is not None else 0.0
+                    fwd = dist[u_][s0] + (dist[s1][v_] if v_ is not None else 0.0) - closing
+                    rev = dist[u_][s1] + (dist[s0][v_] if v_ is not None else 0.0) - closing
+                    if min(fwd, rev) < gain - 1e-9 and (best is None or min(fwd, rev) < best[0]):
+                        best = (min(fwd, rev), a, fwd <= rev)
+            if best is not None:
+                _, a, forward = best
+                rest = seq[:i] + seq[i + size:]
+                seq[:] = rest[:a + 1] + (run if forward else run[::-1]) + rest[a + 1:]
+                pos = {node: k for k, node in enumerate(seq)}
+                moved = True
+    return moved
+
+def order_targets(dist, nodes, start=0, max_passes=20):
+    # Open path start -> every node in `nodes`: nearest neighbour, then 2-opt
+    # and Or-opt moves until neither helps. `dist` is a full matrix over node
+    # ids; the start stays fixed, the end is free.
+    left = set(nodes)
+    seq = [start]
+    while left:
+        row = dist[seq[-1]]
+        nxt = min(left, key=row.__getitem__)
+        left.remove(nxt)
+        seq.append(nxt)
+    n = len(seq) - 1
+    near = {a: sorted((b for b in seq if b != a), key=dist[a].__getitem__)[:NEAR_NEIGHBOURS] for a in seq}
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n):
+            a, b = seq[i - 1], seq[i]
+            da, dab = dist[a], dist[a][b]
+            for j in range(i + 1, n + 1):
+                # Reverse seq[i..j]: edges (a,b) and (c,d) become (a,c) and (b,d)
+                c = seq[j]
+                if j < n:
+                    d = seq[j + 1]
+                    delta = da[c] + dist[b][d] - dab - dist[c][d]
+                else:
+                    delta = da[c] - dab
+                if delta < -1e-9:
+                    seq[i:j + 1] = seq[i:j + 1][::-1]
+                    b, dab = seq[i], da[seq[i]]
+                    improved = True
+        if not improved and not _or_opt(dist, seq, near):
+            break
+    return seq[1:]
+
+def _split_tour(dist, tour, loads, max_load, start=0):
+    # Cut an ordered tour into consecutive circuits of at most max_load with the
+    # least total cable (each circuit pays its own home run from `start`).
+    # DP over cut points; a single over-limit target gets a circuit to itself.
+    n = len(tour)
+    best = [0.0] + [inf] * n
+    cut = [0] * (n + 1)
+    for j in range(1, n + 1):
+        load, chain = 0.0, 0.0
+        for i in range(j, 0, -1):
+            load += loads[tour[i - 1]]
+            if load > max_load and i < j:
+                break
+            if i < j:
+                chain += dist[tour[i - 1]][tour[i]]
+            cost = best[i - 1] + dist[start][tour[i - 1]] + chain
+            if cost < best[j]:
+                best[j], cut[j] = cost, i - 1
+    groups, j = [], n
+    while j > 0:
+        groups.append(tour[cut[j]:j])
+        j = cut[j]
+    return groups[::-1]
+
+def target_load(target):
+    # A target's share of max_load: its "load", or one point
+    return float(target.get("load", 1))
+
+def plan_circuits(source_port, target_ports, max_load=None, optimize=True):
+    # Group and order targets: lists of indices into target_ports, one per
+    # circuit. Each target's "load" (default 1, i.e. a point count) counts
+    # against max_load; None means a single circuit.
+    pts = [(source_port["x"], source_port["y"])] + [(t["x"], t["y"]) for t in target_ports]
+    nodes = list(range(1, len(pts)))
+    if not optimize:
+        tour = nodes
+        dist = _distances(pts) if max_load else None
+    else:
+        dist = _distances(pts)
+        tour = order_targets(dist, nodes)
+    if not max_load:
+        return [[i - 1 for i in tour]] if tour else []
+    loads = [0.0] + [target_load(t) for t in target_ports]
+    groups = _split_tour(dist, tour, loads, max_load)
+    if optimize:
+        groups = [order_targets(dist, g) for g in groups]
+    return [[i - 1 for i in g] for g in groups]
+
+def route_circuit(source_port, target_ports, wire="14/2", floorplan=None, grid=None,
+                  max_load=None, optimize=True):
+    # Plan circuits (see plan_circuits) and route each as a home run from the
+    # source followed by a daisy chain. With a floorplan (or a prebuilt grid)
+    # each leg goes round walls; without one legs are straight lines.
+    # Lengths are in plan units.
+    if grid is None and floorplan is not None and floorplan.get("rooms"):
+        grid = build_grid(floorplan)
     circuits = []
-    cur_src = source_port
-    for i, tgt in enumerate(target_ports, start=1):
-        raw = naive_path((cur_src["x"],cur_src["y"]), (tgt["x"],tgt["y"]))
-        simp = _rdp(raw, epsilon=1.0)
-        path = [{"x":x, "y":y} for x,y in simp]
-        circuits.append({"id": f"ckt_{i}", "wire": wire, "path": path})
-        cur_src = tgt
+    for n, group in enumerate(plan_circuits(source_port, target_ports, max_load, optimize), start=1):
+        path, legs = [], []
+        cur_src = source_port
+        for k in group:
+            tgt = target_ports[k]
+            a, b = (cur_src["x"], cur_src["y"]), (tgt["x"], tgt["y"])
+            simp = grid_path(grid, a, b) if grid is not None else _rdp(naive_path(a, b), epsilon=1.0)
+            leg = [{"x":x, "y":y} for x,y in simp]
+            legs.append(round(path_length(leg), 2))
+            path.extend(leg if not path else leg[1:])
+            cur_src = tgt
+        circuits.append({"id": f"ckt_{n}", "wire": wire, "targets": [target_ports[k] for k in group],
+                         "load": sum(target_load(target_ports[k]) for k in group),
+                         "path": path, "legs": legs, "length": round(sum(legs), 2)})
     return circuits
 
 def to_svg(markup, width=1200, height=800):
@@ -1,11 +1,16 @@
-from flask import Flask, render_template, request, jsonify, send_file, session, redirect, url_for
+from flask import Flask, Request, Response, render_template, request, jsonify, send_file, session, redirect, url_for
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
 import json
 import copy
+import csv
+import re
+import sqlite3
+from contextlib import closing, contextmanager, suppress
 from datetime import datetime
-from typing import Dict, List, Optional
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, NamedTuple, Optional
 import numpy as np
 import uuid
 from pypdf import PdfReader, PdfWriter
@@ -20,7 +25,23 @@ import fitz  # PyMuPDF
 import io
 import traceback
 import base64
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+import multiprocessing
+from collections import OrderedDict, deque
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+try:
+    import fcntl
+except ImportError:  # Windows: JSON file locks then only cover this process
+    fcntl = None
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from requests_oauthlib import OAuth2Session
 from oauthlib.oauth2 import BackendApplicationClient
 
@@ -42,18 +63,22 @@ app.config['DATA_FOLDER'] = 'data'
 app.config['LEARNING_FOLDER'] = 'learning_data'
 app.config['SIMPRO_CONFIG_FOLDER'] = 'simpro_config'
 app.config['CRM_DATA_FOLDER'] = 'crm_data'
+app.config['CACHE_FOLDER'] = 'cache'
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
 
 for folder in [app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER'], 
                app.config['DATA_FOLDER'], app.config['LEARNING_FOLDER'],
-               app.config['SIMPRO_CONFIG_FOLDER'], app.config['CRM_DATA_FOLDER']]:
+               app.config['SIMPRO_CONFIG_FOLDER'], app.config['CRM_DATA_FOLDER'],
+               app.config['CACHE_FOLDER']]:
     os.makedirs(folder, exist_ok=True)
 
 DATA_FILE = os.path.join(app.config['DATA_FOLDER'], 'automation_data.json')
 LEARNING_INDEX_FILE = os.path.join(app.config['LEARNING_FOLDER'], 'learning_index.json')
+LEARNING_DB_FILE = os.path.join(app.config['LEARNING_FOLDER'], 'learning.sqlite3')
+JOBS_DB_FILE = os.path.join(app.config['DATA_FOLDER'], 'jobs.sqlite3')
 SIMPRO_CONFIG_FILE = os.path.join(app.config['SIMPRO_CONFIG_FOLDER'], 'simpro_config.json')
 
-# CRM Data Files
+# CRM data: SQLite store, plus the legacy JSON files it imports once
 CUSTOMERS_FILE = os.path.join(app.config['CRM_DATA_FOLDER'], 'customers.json')
 PROJECTS_FILE = os.path.join(app.config['CRM_DATA_FOLDER'], 'projects.json')
 COMMUNICATIONS_FILE = os.path.join(app.config['CRM_DATA_FOLDER'], 'communications.json')
@@ -62,6 +87,78 @@ TECHNICIANS_FILE = os.path.join(app.config['CRM_DATA_FOLDER'], 'technicians.json
 INVENTORY_FILE = os.path.join(app.config['CRM_DATA_FOLDER'], 'inventory.json')
 SUPPLIERS_FILE = os.path.join(app.config['CRM_DATA_FOLDER'], 'suppliers.json')
 INTEGRATIONS_FILE = os.path.join(app.config['CRM_DATA_FOLDER'], 'integrations.json')
+CRM_DB_FILE = os.path.join(app.config['CRM_DATA_FOLDER'], 'crm.sqlite3')
+
+# Floor plan analysis cache
+ANALYSIS_CACHE_FOLDER = os.path.join(app.config['CACHE_FOLDER'], 'analysis')
+ANALYSIS_CACHE_MAX_BYTES = int(os.environ.get('ANALYSIS_CACHE_MAX_MB', '200')) * 1024 * 1024
+ANALYSIS_PROMPT_VERSION = 1  # Bump whenever the vision prompt or response parsing changes
+RENDER_ZOOM = 2.0  # PDF -> image zoom used for vision analysis and the editor
+os.makedirs(ANALYSIS_CACHE_FOLDER, exist_ok=True)
+
+# Rendered floor plan images
+RENDER_CACHE_FOLDER = os.path.join(app.config['CACHE_FOLDER'], 'renders')
+IMAGE_CACHE_MAX_AGE = int(os.environ.get('IMAGE_CACHE_MAX_AGE', '86400'))
+os.makedirs(RENDER_CACHE_FOLDER, exist_ok=True)
+
+# Tile pyramid for the editor: zoom level z renders at TILE_BASE_SCALE * 2**z
+# pixels per PDF point, so z=3 matches RENDER_ZOOM (the editor's coordinate space)
+TILE_CACHE_FOLDER = os.path.join(app.config['CACHE_FOLDER'], 'tiles')
+TILE_SIZE = 256
+TILE_BASE_SCALE = 0.25
+TILE_MIN_ZOOM = 0
+TILE_MAX_ZOOM = int(os.environ.get('TILE_MAX_ZOOM', '5'))
+os.makedirs(TILE_CACHE_FOLDER, exist_ok=True)
+
+# Multi-page plan sets: pages are rasterised in a process pool and the vision
+# model is called for several pages at once
+ANALYSIS_MAX_CONCURRENCY = int(os.environ.get('ANALYSIS_MAX_CONCURRENCY', '4'))
+
+# 'rules' places symbols from the placement_rules table in automation_data.json
+# and only asks the model about unknown room types; 'ai' always asks the model
+PLACEMENT_MODE = os.environ.get('PLACEMENT_MODE', 'rules')
+
+# 'pymupdf' annotates in place with an incremental save; 'overlay' is the old
+# reportlab + pypdf merge, kept for comparison (see bench_annotation.py)
+ANNOTATION_BACKEND = os.environ.get('ANNOTATION_BACKEND', 'pymupdf')
+RENDER_PROCESSES = int(os.environ.get('RENDER_PROCESSES', str(min(4, os.cpu_count() or 1))))
+PAGE_MEMO_SIZE = int(os.environ.get('PAGE_MEMO_SIZE', '4096'))
+
+# Shared model client: one keep-alive connection pool per process. Point
+# ANTHROPIC_BASE_URL at a local stub server to exercise the pipeline offline.
+MODEL_NAME = os.environ.get('ANTHROPIC_MODEL', 'claude-sonnet-4-20250514')
+MODEL_TIMEOUT = float(os.environ.get('ANTHROPIC_TIMEOUT', '120'))
+MODEL_CONNECT_TIMEOUT = float(os.environ.get('ANTHROPIC_CONNECT_TIMEOUT', '10'))
+MODEL_MAX_RETRIES = int(os.environ.get('ANTHROPIC_MAX_RETRIES', '3'))
+MODEL_MAX_CONNECTIONS = int(os.environ.get('ANTHROPIC_MAX_CONNECTIONS', '20'))
+
+# Simpro API: one pooled keep-alive session per process, retrying 429/5xx with
+# exponential backoff; the access token is refreshed this long before expiry
+SIMPRO_TIMEOUT = float(os.environ.get('SIMPRO_TIMEOUT', '30'))
+SIMPRO_CONNECT_TIMEOUT = float(os.environ.get('SIMPRO_CONNECT_TIMEOUT', '10'))
+SIMPRO_MAX_RETRIES = int(os.environ.get('SIMPRO_MAX_RETRIES', '4'))
+SIMPRO_BACKOFF = float(os.environ.get('SIMPRO_BACKOFF', '0.5'))
+SIMPRO_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# POSTs are not retried automatically since they are not idempotent
+SIMPRO_RETRY_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+SIMPRO_POOL_SIZE = int(os.environ.get('SIMPRO_POOL_SIZE', '10'))
+SIMPRO_TOKEN_MARGIN = int(os.environ.get('SIMPRO_TOKEN_MARGIN', '300'))
+# Request budget for the whole deployment (Simpro allows about 10/s per
+# tenant) and how many pages a full-collection pull fetches at once. Each
+# worker process gets an equal share: gunicorn starts WEB_CONCURRENCY workers.
+SIMPRO_RATE_LIMIT = float(os.environ.get('SIMPRO_RATE_LIMIT', '8'))
+SIMPRO_WORKER_PROCESSES = max(1, int(os.environ.get('WEB_CONCURRENCY', '1')))
+SIMPRO_FETCH_CONCURRENCY = int(os.environ.get('SIMPRO_FETCH_CONCURRENCY', '6'))
+# Setup cost center that pushed quote lines are filed under (Simpro ID); a
+# batch push can also name one per request
+SIMPRO_QUOTE_COST_CENTER = os.environ.get('SIMPRO_QUOTE_COST_CENTER')
+
+# Local mirror of Simpro lists: served while younger than SIMPRO_MIRROR_TTL,
+# then refreshed in the background (changes only, plus a daily full pass)
+SIMPRO_MIRROR_DB = os.path.join(app.config['SIMPRO_CONFIG_FOLDER'], 'simpro_mirror.sqlite3')
+SIMPRO_MIRROR_TTL = int(os.environ.get('SIMPRO_MIRROR_TTL', '900'))
+SIMPRO_FULL_SYNC_INTERVAL = int(os.environ.get('SIMPRO_FULL_SYNC_INTERVAL', '86400'))
+SIMPRO_SYNC_PAGE_SIZE = 250
 
 DEFAULT_DATA = {
     "automation_types": {
@@ -96,6 +193,41 @@ DEFAULT_DATA = {
             "labor_hours": {"basic": 3.5, "premium": 5.0, "deluxe": 7.0}
         }
     },
+    "placement_rules": {
+        "room_types": {
+            "master_bedroom": {"lighting": 3, "audio": 1},
+            "bedroom": {"lighting": 2},
+            "living_room": {"lighting": 4, "audio": 1},
+            "kitchen": {"lighting": 4},
+            "dining_room": {"lighting": 2},
+            "bathroom": {"lighting": 2},
+            "hallway": {"lighting": 1},
+            "office": {"lighting": 3},
+            "media_room": {"lighting": 2, "audio": 1},
+            "laundry": {"lighting": 1},
+            "garage": {"lighting": 1},
+            "walk_in_closet": {"lighting": 1},
+            "generic": {"lighting": 1}
+        },
+        "aliases": {
+            "lounge": "living_room",
+            "family_room": "living_room",
+            "living": "living_room",
+            "ensuite": "bathroom",
+            "powder_room": "bathroom",
+            "toilet": "bathroom",
+            "wc": "bathroom",
+            "corridor": "hallway",
+            "entry": "hallway",
+            "study": "office",
+            "theatre": "media_room",
+            "wir": "walk_in_closet",
+            "dining": "dining_room"
+        },
+        "per_window": {"shading": 1},
+        "per_door": {"security_access": 1},
+        "per_floor": {"climate": 1}
+    },
     "labor_rate": 75.0,
     "markup_percentage": 20.0,
     "company_info": {
@@ -106,39 +238,236 @@ DEFAULT_DATA = {
     }
 }
 
+# ============================================================================
+# JSON STORAGE
+# ============================================================================
+
+# JSON files are replaced atomically (temp file + fsync + rename), so readers
+# never see a half-written file, and writers serialise on a sidecar .lock
+# file, so read-modify-write cycles in different workers don't lose updates.
+
+_json_thread_locks = {}
+_json_thread_locks_guard = threading.Lock()
+
+
+def _ensure_parent_folder(path: str) -> None:
+    """Ensure the directory for a JSON file exists."""
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+
+@contextmanager
+def json_file_lock(path: str):
+    """Exclusive lock on a JSON file across processes and threads (not re-entrant)."""
+    _ensure_parent_folder(path)
+    if fcntl is None:
+        with _json_thread_locks_guard:
+            lock = _json_thread_locks.setdefault(os.path.abspath(path), threading.Lock())
+        with lock:
+            yield
+        return
+
+    # flock belongs to the open file, so each holder opens its own handle
+    with open(f'{path}.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def write_json_atomic(path: str, data, indent=2) -> None:
+    """Write JSON to a temp file in the same folder, fsync it and rename it over `path`."""
+    _ensure_parent_folder(path)
+    folder = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        with suppress(FileNotFoundError):
+            shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+
+    # Make the rename itself durable
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def load_json_file(path: str, default):
+    """Safely load JSON data from disk.
+
+    Falls back to the provided default when the file is missing or invalid.
+    """
+    _ensure_parent_folder(path)
+
+    if not os.path.exists(path):
+        return copy.deepcopy(default)
+
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError) as exc:
+        print(f"⚠️  Failed to load JSON file {path}: {exc}")
+        return copy.deepcopy(default)
+
+
+def save_json_file(path: str, data) -> None:
+    """Atomically replace a JSON file, serialised with other writers."""
+    with json_file_lock(path):
+        write_json_atomic(path, data)
+
+
+def _load_json_for_update(path: str, default):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return copy.deepcopy(default)
+    except json.JSONDecodeError as exc:
+        # Keep the unreadable file for inspection rather than overwriting it
+        aside = f'{path}.corrupt-{int(time.time())}'
+        os.replace(path, aside)
+        print(f"⚠️  {path} was unreadable ({exc}); moved to {aside}, starting from defaults")
+        return copy.deepcopy(default)
+
+
+@contextmanager
+def json_transaction(path: str, default):
+    """Read-modify-write a JSON file under its lock.
+
+    Mutate the yielded object in place; it is written back atomically when
+    the block exits cleanly and discarded if it raises.
+    """
+    with json_file_lock(path):
+        data = _load_json_for_update(path, default)
+        yield data
+        write_json_atomic(path, data)
+
 # ============================================================================
 # DATA MANAGEMENT FUNCTIONS
 # ============================================================================
 
+class AutomationConfig(NamedTuple):
+    """automation_data.json as parsed once, plus per-tier lookup tables.
+
+    Shared by every request in the process: treat `data` as read-only and
+    deep-copy it before editing (see /api/update-pricing).
+    """
+    data: Dict
+    unit_cost: Dict[str, Dict[str, float]]    # tier -> automation type -> price
+    labor_hours: Dict[str, Dict[str, float]]  # tier -> automation type -> hours
+    type_names: Dict[str, str]
+    labor_rate: float
+    markup_rate: float                        # markup_percentage / 100
+
+
+_config_entry = None  # (file key, AutomationConfig), swapped as one reference
+_config_lock = threading.Lock()
+
+
+def build_automation_config(data) -> AutomationConfig:
+    unit_cost, labor_hours = {}, {}
+    for auto_type, type_data in data['automation_types'].items():
+        for tier, price in type_data.get('base_cost_per_unit', {}).items():
+            unit_cost.setdefault(tier, {})[auto_type] = float(price)
+        for tier, hours in type_data.get('labor_hours', {}).items():
+            labor_hours.setdefault(tier, {})[auto_type] = float(hours)
+    return AutomationConfig(
+        data=data,
+        unit_cost=unit_cost,
+        labor_hours=labor_hours,
+        type_names={auto_type: type_data['name'] for auto_type, type_data in data['automation_types'].items()},
+        labor_rate=float(data['labor_rate']),
+        markup_rate=float(data['markup_percentage']) / 100
+    )
+
+
+def _data_file_key():
+    try:
+        stat = os.stat(DATA_FILE)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def get_automation_config() -> AutomationConfig:
+    """Return the cached config, re-reading the file only when its mtime/size change"""
+    global _config_entry
+    key = _data_file_key()
+    entry = _config_entry
+    if entry is not None and entry[0] == key:
+        return entry[1]
+
+    with _config_lock:
+        if _config_entry is None or _config_entry[0] != key:
+            if key is None:
+                data = copy.deepcopy(DEFAULT_DATA)
+            else:
+                with open(DATA_FILE, 'r') as f:
+                    data = json.load(f)
+            _config_entry = (key, build_automation_config(data))
+        return _config_entry[1]
+
+
+def pricing_tables(automation_data) -> AutomationConfig:
+    """Lookup tables for `automation_data`, reusing the cached ones when possible"""
+    config = get_automation_config()
+    if automation_data is config.data:
+        return config
+    return build_automation_config(automation_data)
+
+
 def load_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    return copy.deepcopy(DEFAULT_DATA)
+    """Shared, cached automation data - do not mutate the returned dict"""
+    return get_automation_config().data
+
+def _publish_automation_config(data) -> None:
+    """Swap just-written data into the cache rather than waiting for the next stat.
+
+    Call with the data file lock held so the recorded mtime is this write's.
+    """
+    global _config_entry
+    config = build_automation_config(copy.deepcopy(data))
+    with _config_lock:
+        _config_entry = (_data_file_key(), config)
 
 def save_data(data):
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+    with json_file_lock(DATA_FILE):
+        write_json_atomic(DATA_FILE, data)
+        _publish_automation_config(data)
+
+@contextmanager
+def update_data():
+    """Read-modify-write automation_data.json; yields a private copy to edit in place"""
+    with json_file_lock(DATA_FILE):
+        data = copy.deepcopy(get_automation_config().data)
+        yield data
+        write_json_atomic(DATA_FILE, data)
+        _publish_automation_config(data)
 
 def load_learning_index():
-    """Load the learning index that tracks all training examples"""
+    """Load the legacy JSON learning index (only used for migration)"""
     if os.path.exists(LEARNING_INDEX_FILE):
         with open(LEARNING_INDEX_FILE, 'r') as f:
             return json.load(f)
     return {"examples": [], "last_updated": None}
 
-def save_learning_index(index):
-    """Save the learning index"""
-    index['last_updated'] = datetime.now().isoformat()
-    with open(LEARNING_INDEX_FILE, 'w') as f:
-        json.dump(index, f, indent=2)
-
 def get_learning_context():
     """Get accumulated learning examples to include in AI prompts"""
-    index = load_learning_index()
     context = "Previous learning examples:\n\n"
-    
-    for example in index.get('examples', [])[-10:]:  # Last 10 examples
+
+    for example in get_recent_learning_examples(10):  # Last 10 examples
         context += f"Date: {example.get('timestamp')}\n"
         context += f"Notes: {example.get('notes', 'N/A')}\n"
         if 'analysis_result' in example:
@@ -147,93 +476,1211 @@ def get_learning_context():
     
     return context
 
-def load_simpro_config():
-    """Load Simpro configuration"""
-    if os.path.exists(SIMPRO_CONFIG_FILE):
-        with open(SIMPRO_CONFIG_FILE, 'r') as f:
-            return json.load(f)
+# ============================================================================
+# PROJECT & LEARNING STORE
+# ============================================================================
+
+def _connect_sqlite(path: str) -> sqlite3.Connection:
+    """Open a SQLite connection with dict-like rows."""
+    _ensure_parent_folder(path)
+    con = sqlite3.connect(path, timeout=30)
+    con.row_factory = sqlite3.Row
+    return con
+
+
+def init_learning_store() -> None:
+    """Create the project/learning tables and import the legacy JSON index."""
+    with closing(_connect_sqlite(LEARNING_DB_FILE)) as con:
+        con.executescript("""
+        CREATE TABLE IF NOT EXISTS projects(
+            project_id TEXT PRIMARY KEY,
+            project_name TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS learning_examples(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            type TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_learning_examples_type ON learning_examples(type);
+        """)
+    migrate_learning_index()
+
+
+def migrate_learning_index() -> None:
+    """One-shot import of learning_index.json into the SQLite store.
+
+    Analysed projects (entries with placements and a PDF) become rows in
+    `projects`; every entry is appended to `learning_examples` in its original
+    order. The JSON file is renamed afterwards so the import never repeats.
+    """
+    if not os.path.exists(LEARNING_INDEX_FILE):
+        return
+
+    now = datetime.now().isoformat()
+    with closing(_connect_sqlite(LEARNING_DB_FILE)) as con:
+        # Serialise concurrent workers starting up at the same time
+        con.execute("BEGIN IMMEDIATE")
+        if not os.path.exists(LEARNING_INDEX_FILE):
+            con.rollback()
+            return
+
+        examples = load_learning_index().get('examples', [])
+        with con:
+            for example in examples:
+                if 'placements' in example and 'pdf_path' in example:
+                    # The old linear scan returned the first match, so keep it
+                    con.execute(
+                        "INSERT OR IGNORE INTO projects(project_id, project_name, created_at, updated_at, data) "
+                        "VALUES(?, ?, ?, ?, ?)",
+                        (example.get('timestamp'), example.get('project_name'), now, now, json.dumps(example))
+                    )
+                    example = _project_learning_example(example)
+                con.execute(
+                    "INSERT INTO learning_examples(timestamp, type, data) VALUES(?, ?, ?)",
+                    (example.get('timestamp'), example.get('type'), json.dumps(example))
+                )
+            os.replace(LEARNING_INDEX_FILE, f'{LEARNING_INDEX_FILE}.migrated')
+
+    print(f"✅ Migrated {len(examples)} learning examples to {LEARNING_DB_FILE}")
+
+
+def _project_learning_example(project):
+    """Summarise an analysed project for the learning context (no placements)."""
     return {
-        "connected": False,
-        "base_url": "",
-        "company_id": "0",
-        "client_id": "",
-        "client_secret": "",
-        "access_token": None,
-        "refresh_token": None,
-        "token_expires_at": None
+        'timestamp': project.get('timestamp'),
+        'project_id': project.get('timestamp'),
+        'project_name': project.get('project_name'),
+        'type': 'analysis',
+        'analysis_result': project.get('analysis_result', {})
     }
 
+
+def get_project(project_id):
+    """Look up an analysed project by id, or None."""
+    with closing(_connect_sqlite(LEARNING_DB_FILE)) as con:
+        row = con.execute("SELECT data FROM projects WHERE project_id = ?", (project_id,)).fetchone()
+    return json.loads(row['data']) if row else None
+
+
+def save_project(project) -> None:
+    """Insert or update an analysed project keyed by its timestamp id."""
+    now = datetime.now().isoformat()
+    with closing(_connect_sqlite(LEARNING_DB_FILE)) as con:
+        with con:
+            con.execute(
+                "INSERT INTO projects(project_id, project_name, created_at, updated_at, data) "
+                "VALUES(?, ?, ?, ?, ?) "
+                "ON CONFLICT(project_id) DO UPDATE SET project_name = excluded.project_name, "
+                "updated_at = excluded.updated_at, data = excluded.data",
+                (project['timestamp'], project.get('project_name'), now, now, json.dumps(project))
+            )
+
+
+def add_learning_example(example) -> None:
+    """Append a feedback/instruction/training example to the learning log."""
+    with closing(_connect_sqlite(LEARNING_DB_FILE)) as con:
+        with con:
+            con.execute(
+                "INSERT INTO learning_examples(timestamp, type, data) VALUES(?, ?, ?)",
+                (example.get('timestamp'), example.get('type'), json.dumps(example))
+            )
+
+
+def get_recent_learning_examples(limit=10):
+    """Return the most recent learning examples, oldest first."""
+    with closing(_connect_sqlite(LEARNING_DB_FILE)) as con:
+        rows = con.execute(
+            "SELECT data FROM learning_examples ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+    return [json.loads(row['data']) for row in reversed(rows)]
+
+SIMPRO_DEFAULT_CONFIG = {
+    "connected": False,
+    "base_url": "",
+    "company_id": "0",
+    "client_id": "",
+    "client_secret": "",
+    "access_token": None,
+    "refresh_token": None,
+    "token_expires_at": None
+}
+
+def load_simpro_config():
+    """Load Simpro configuration"""
+    return load_json_file(SIMPRO_CONFIG_FILE, SIMPRO_DEFAULT_CONFIG)
+
 def save_simpro_config(config):
     """Save Simpro configuration"""
-    with open(SIMPRO_CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=2)
+    save_json_file(SIMPRO_CONFIG_FILE, config)
 
+def update_simpro_config():
+    """Read-modify-write the Simpro configuration (see json_transaction)"""
+    return json_transaction(SIMPRO_CONFIG_FILE, SIMPRO_DEFAULT_CONFIG)
 
-def _ensure_parent_folder(path: str) -> None:
-    """Ensure the directory for a JSON file exists."""
-    folder = os.path.dirname(path)
-    if folder:
-        os.makedirs(folder, exist_ok=True)
 
+init_learning_store()
 
-def load_json_file(path: str, default):
-    """Safely load JSON data from disk for CRM storage.
+# ============================================================================
+# CRM STORE
+# ============================================================================
 
-    Falls back to the provided default when the file is missing or invalid.
+# Each collection is a table of full JSON records plus the columns that are
+# filtered, sorted or aggregated on. 'search' lists the record fields that go
+# into the collection's full-text index. The JSON files are only read by the importer.
+CRM_COLLECTIONS = {
+    'customers': {
+        'file': CUSTOMERS_FILE,
+        'columns': {'name': 'TEXT', 'email': 'TEXT', 'status': 'TEXT',
+                    'created_at': 'TEXT', 'updated_at': 'TEXT'},
+        'indexes': ['status', 'created_at', 'name'],
+        'search': ['name', 'email', 'company', 'phone', 'address', 'notes']
+    },
+    'projects': {
+        'file': PROJECTS_FILE,
+        'columns': {'customer_id': 'TEXT', 'status': 'TEXT', 'priority': 'TEXT', 'due_date': 'TEXT',
+                    'quote_amount': 'REAL', 'actual_amount': 'REAL',
+                    'created_at': 'TEXT', 'updated_at': 'TEXT'},
+        'indexes': ['customer_id', 'status', 'due_date', 'created_at']
+    },
+    'communications': {
+        'file': COMMUNICATIONS_FILE,
+        'columns': {'customer_id': 'TEXT', 'type': 'TEXT', 'created_at': 'TEXT'},
+        'indexes': ['customer_id', 'created_at'],
+        'search': ['subject', 'content']
+    },
+    'calendar': {
+        'file': CALENDAR_FILE,
+        'columns': {'date': 'TEXT', 'time': 'TEXT', 'type': 'TEXT', 'status': 'TEXT',
+                    'created_at': 'TEXT'},
+        'indexes': ['date', 'status']
+    },
+    'technicians': {
+        'file': TECHNICIANS_FILE,
+        'columns': {'name': 'TEXT', 'status': 'TEXT', 'created_at': 'TEXT'},
+        'indexes': ['status', 'name']
+    },
+    'inventory': {
+        'file': INVENTORY_FILE,
+        'columns': {'name': 'TEXT', 'sku': 'TEXT', 'category': 'TEXT', 'quantity': 'REAL',
+                    'unit_cost': 'REAL', 'reorder_level': 'REAL', 'created_at': 'TEXT'},
+        'indexes': ['sku', 'category', 'name']
+    },
+    'suppliers': {
+        'file': SUPPLIERS_FILE,
+        'columns': {'name': 'TEXT', 'created_at': 'TEXT'},
+        'indexes': ['name']
+    }
+}
+
+
+def _crm_row_values(collection: str, record) -> list:
+    """Column values for a record, in CRM_COLLECTIONS order, followed by the JSON blob"""
+    columns = CRM_COLLECTIONS[collection]['columns']
+    values = []
+    for column, column_type in columns.items():
+        value = record.get(column)
+        if column_type == 'REAL' and value not in (None, ''):
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                value = None
+        elif isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        values.append(value)
+    return [record['id']] + values + [json.dumps(record)]
+
+
+def _crm_insert_sql(collection: str, verb: str = 'INSERT') -> str:
+    columns = ['id'] + list(CRM_COLLECTIONS[collection]['columns']) + ['data']
+    return (f"{verb} INTO crm_{collection}({', '.join(columns)}) "
+            f"VALUES({', '.join('?' for _ in columns)})")
+
+
+def init_crm_store() -> None:
+    """Create the CRM tables and indexes, then import any legacy JSON files."""
+    with closing(_connect_sqlite(CRM_DB_FILE)) as con:
+        for collection, spec in CRM_COLLECTIONS.items():
+            column_sql = ''.join(f", {column} {column_type}" for column, column_type in spec['columns'].items())
+            con.execute(f"CREATE TABLE IF NOT EXISTS crm_{collection}(id TEXT PRIMARY KEY{column_sql}, data TEXT NOT NULL)")
+            for column in spec['indexes']:
+                con.execute(f"CREATE INDEX IF NOT EXISTS idx_crm_{collection}_{column} ON crm_{collection}({column})")
+            if spec.get('search'):
+                init_crm_search_index(con, collection)
+        init_crm_stats(con)
+        con.commit()
+    import_crm_json()
+
+
+# Dashboard statistics, kept in crm_stats and maintained by triggers. Each
+# stat is the sum over a collection of an expression of one row; {row} is
+# replaced by new./old. in the triggers and by the table name when rebuilding.
+CRM_STATS = {
+    'customers': {
+        'customers_total': "1",
+        'customers_active': "{row}status = 'active'",
+    },
+    'projects': {
+        'projects_total': "1",
+        'projects_active': "{row}status IN ('pending', 'in_progress')",
+        'projects_completed': "{row}status = 'completed'",
+        'revenue_total_cents': "CASE WHEN {row}status = 'completed' THEN COALESCE({row}actual_amount, 0) ELSE 0 END",
+        'revenue_pending_cents': "CASE WHEN {row}status IN ('pending', 'in_progress') "
+                                 "THEN COALESCE({row}quote_amount, 0) ELSE 0 END",
+    },
+    'inventory': {
+        'inventory_value_cents': "COALESCE({row}quantity, 0) * COALESCE({row}unit_cost, 0)",
+        'inventory_low_stock': "COALESCE({row}quantity, 0) <= COALESCE({row}reorder_level, 10)",
+    }
+}
+
+CRM_STATS_EXPRS = {key: expr for stats in CRM_STATS.values() for key, expr in stats.items()}
+
+
+def _crm_stat_expr(key: str, row: str) -> str:
+    # Money stats are kept as whole cents so repeated trigger deltas add up
+    # exactly instead of accumulating floating point error
+    expr = CRM_STATS_EXPRS[key].format(row=row)
+    return f"CAST(ROUND(({expr}) * 100) AS INTEGER)" if key.endswith('_cents') else expr
+
+
+def _crm_stats_delta(stats, row: str) -> str:
+    return 'CASE key ' + ' '.join(f"WHEN '{key}' THEN ({_crm_stat_expr(key, row)})" for key in stats) + ' END'
+
+
+def init_crm_stats(con) -> None:
+    """Create crm_stats and its triggers; recompute it in full when the table, keys or triggers change."""
+    if not con.in_transaction:
+        # Workers start together; only the first one migrates
+        con.execute("BEGIN IMMEDIATE")
+    columns = {row['name']: row['type'] for row in con.execute("PRAGMA table_info(crm_stats)")}
+    rebuild = columns.get('value') != 'INTEGER'
+    if rebuild:
+        # Older installs kept REAL totals; every stat is now an integer (counts and cents)
+        con.execute("DROP TABLE IF EXISTS crm_stats")
+        con.execute("CREATE TABLE crm_stats(key TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)")
+
+    for collection, stats in CRM_STATS.items():
+        keys = ', '.join(f"'{key}'" for key in stats)
+        update = f"UPDATE crm_stats SET value = value {{sign}} {{delta}} WHERE key IN ({keys});"
+        add, remove = _crm_stats_delta(stats, 'new.'), _crm_stats_delta(stats, 'old.')
+        triggers = {
+            f"crm_{collection}_stats_ai": f"AFTER INSERT ON crm_{collection} BEGIN "
+                                          + update.format(sign='+', delta=add) + " END",
+            f"crm_{collection}_stats_ad": f"AFTER DELETE ON crm_{collection} BEGIN "
+                                          + update.format(sign='-', delta=remove) + " END",
+            f"crm_{collection}_stats_au": f"AFTER UPDATE ON crm_{collection} BEGIN "
+                                          + update.format(sign='+', delta=f"{add} - {remove}") + " END",
+        }
+        for name, body in triggers.items():
+            sql = f"CREATE TRIGGER {name} {body}"
+            stored = con.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                                 (name,)).fetchone()
+            if stored is None or stored['sql'] != sql:
+                con.execute(f"DROP TRIGGER IF EXISTS {name}")
+                con.execute(sql)
+                rebuild = True
+
+    stored = {row['key'] for row in con.execute("SELECT key FROM crm_stats")}
+    if rebuild or stored != set(CRM_STATS_EXPRS):
+        rebuild_crm_stats(con)
+
+
+def rebuild_crm_stats(con) -> None:
+    """Recompute every stat from the CRM tables (inside the caller's transaction)."""
+    con.execute("DELETE FROM crm_stats")
+    for collection, stats in CRM_STATS.items():
+        for key in stats:
+            con.execute(f"INSERT INTO crm_stats(key, value) "
+                        f"SELECT ?, COALESCE(SUM({_crm_stat_expr(key, '')}), 0) FROM crm_{collection}", (key,))
+
+
+# Set to False when this SQLite build lacks FTS5; search then falls back to substring scans
+CRM_FTS_AVAILABLE = True
+
+
+def init_crm_search_index(con, collection: str) -> None:
+    """Create the FTS5 index for a collection and the triggers that keep it in sync.
+
+    The index is keyed on the record table's rowid and built the first time
+    it is created, so existing databases are indexed on upgrade.
     """
-    _ensure_parent_folder(path)
+    global CRM_FTS_AVAILABLE
+    fields = CRM_COLLECTIONS[collection]['search']
+    table = f"crm_{collection}_fts"
+    exists = con.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone()
+    if not exists:
+        try:
+            con.execute(f"CREATE VIRTUAL TABLE {table} USING fts5({', '.join(fields)}, "
+                        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')")
+        except sqlite3.OperationalError as e:
+            CRM_FTS_AVAILABLE = False
+            print(f"⚠️  FTS5 unavailable, CRM search will scan: {e}")
+            return
 
-    if not os.path.exists(path):
-        return copy.deepcopy(default)
+    field_list = ', '.join(fields)
+    new_values = ', '.join(f"json_extract(new.data, '$.{field}')" for field in fields)
+    con.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON crm_{collection} BEGIN "
+                f"INSERT INTO {table}(rowid, {field_list}) VALUES(new.rowid, {new_values}); END")
+    con.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON crm_{collection} BEGIN "
+                f"DELETE FROM {table} WHERE rowid = old.rowid; END")
+    con.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE OF data ON crm_{collection} BEGIN "
+                f"DELETE FROM {table} WHERE rowid = old.rowid; "
+                f"INSERT INTO {table}(rowid, {field_list}) VALUES(new.rowid, {new_values}); END")
+    if not exists:
+        con.execute(f"INSERT INTO {table}(rowid, {field_list}) "
+                    f"SELECT rowid, {new_values.replace('new.data', 'data')} FROM crm_{collection}")
+
+
+def crm_match_query(search: str) -> Optional[str]:
+    """Turn user input into an FTS5 query: every word must match as a prefix,
+    so partial words anywhere in the input still find the record.
 
+    Returns None when the input has no indexable words (e.g. just punctuation).
+    """
+    words = re.findall(r'\w+', search.lower())
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def import_crm_json() -> None:
+    """One-shot import of the legacy CRM JSON arrays into SQLite.
+
+    Records keep their original order (rowid); files are renamed to
+    *.migrated afterwards so the import never repeats.
+    """
+    pending = [c for c, spec in CRM_COLLECTIONS.items() if os.path.exists(spec['file'])]
+    if not pending:
+        return
+
+    with closing(_connect_sqlite(CRM_DB_FILE)) as con:
+        # Serialise concurrent workers starting up at the same time
+        con.execute("BEGIN IMMEDIATE")
+        imported = {}
+        with con:
+            for collection in pending:
+                path = CRM_COLLECTIONS[collection]['file']
+                if not os.path.exists(path):
+                    continue
+                records = [r for r in load_json_file(path, []) if isinstance(r, dict) and r.get('id')]
+                con.executemany(_crm_insert_sql(collection, 'INSERT OR IGNORE'),
+                                [_crm_row_values(collection, r) for r in records])
+                os.replace(path, f'{path}.migrated')
+                imported[collection] = len(records)
+
+    if imported:
+        print(f"✅ Imported CRM JSON into {CRM_DB_FILE}: {imported}")
+
+
+CRM_MAX_PAGE_SIZE = 500
+
+
+def _encode_crm_cursor(sort_value, rowid) -> str:
+    raw = json.dumps([sort_value, rowid]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_crm_cursor(cursor: str):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, rowid = json.loads(base64.urlsafe_b64decode(padded))
+        return sort_value, int(rowid)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+def _crm_where(collection: str, filters=None, search=None):
+    """FROM source, WHERE clauses and parameters for filters plus an optional text search.
+
+    A filter value is matched exactly, or a list of values with IN.
+
+    With FTS5 the search joins the collection's full-text index, exposing a
+    `rank` (bm25, lower is better); otherwise it is a substring scan.
+    """
+    table = f"crm_{collection}"
+    source, clauses, params = table, [], []
+    search_fields = CRM_COLLECTIONS[collection].get('search')
+    if search and search_fields:
+        match = crm_match_query(search) if CRM_FTS_AVAILABLE else None
+        if match:
+            source = (f"{table} JOIN (SELECT rowid AS hit, rank FROM {table}_fts "
+                      f"WHERE {table}_fts MATCH ?) ON hit = {table}.rowid")
+            params.append(match)
+        else:
+            clauses.append('(' + ' OR '.join(f"instr(lower(json_extract(data, '$.{field}')), ?) > 0"
+                                             for field in search_fields) + ')')
+            params.extend([search.lower()] * len(search_fields))
+    for column, value in (filters or {}).items():
+        if isinstance(value, (list, tuple)):
+            clauses.append(f"{table}.{column} IN ({', '.join('?' * len(value))})")
+            params.extend(value)
+        elif value is not None:
+            clauses.append(f"{table}.{column} = ?")
+            params.append(value)
+    return source, clauses, params
+
+
+def crm_query(collection: str, filters=None, limit=None, cursor=None, sort=None, fields=None,
+              search=None):
+    """One page of a collection, returning (records, next_cursor).
+
+    Pages are keyset-paginated on (sort column, rowid), so every page costs
+    the same however deep the cursor is. `sort` is a column name, prefixed
+    with '-' for descending; the default is insertion order, or best match
+    first when searching (sort=rank). `fields`
+    projects each record down to those keys (plus id). Without a limit the
+    whole (filtered) collection is returned, as the endpoints used to.
+    """
+    spec = CRM_COLLECTIONS[collection]
+    table = f"crm_{collection}"
+    source, clauses, params = _crm_where(collection, filters, search)
+    ranked = source != table
+    if not sort:
+        sort = 'rank' if ranked else 'rowid'
+    elif sort.lstrip('-') == 'rank' and not ranked:
+        sort = 'rowid'
+    descending = sort.startswith('-')
+    sort_column = sort.lstrip('-')
+    if sort_column not in ('rowid', 'id', 'rank') and sort_column not in spec['columns']:
+        raise ValueError(f'Cannot sort {collection} by {sort_column}')
+
+    rowid_ref = f"{table}.rowid"
+    sort_ref = rowid_ref if sort_column == 'rowid' else sort_column
+    if sort_column == 'id':
+        sort_ref = f"{table}.id"
+    if cursor:
+        value, rowid = _decode_crm_cursor(cursor)
+        op = '<' if descending else '>'
+        if sort_column == 'rowid':
+            clauses.append(f"{rowid_ref} {op} ?")
+            params.append(rowid)
+        elif value is None:
+            # NULLs sort first ascending and last descending
+            clauses.append(f"(({sort_ref} IS NULL AND {rowid_ref} {op} ?)"
+                           + ("" if descending else f" OR {sort_ref} IS NOT NULL") + ")")
+            params.append(rowid)
+        else:
+            clauses.append(f"({sort_ref} {op} ? OR ({sort_ref} = ? AND {rowid_ref} {op} ?)"
+                           + (f" OR {sort_ref} IS NULL" if descending else "") + ")")
+            params.extend([value, value, rowid])
+
+    direction = 'DESC' if descending else 'ASC'
+    order = f"{rowid_ref} {direction}" if sort_column == 'rowid' else f"{sort_ref} {direction}, {rowid_ref} {direction}"
+    sql = (f"SELECT {rowid_ref} AS rowid, {'NULL' if sort_column == 'rowid' else sort_ref} AS sort_value, data "
+           f"FROM {source}"
+           + (f" WHERE {' AND '.join(clauses)}" if clauses else '')
+           + f" ORDER BY {order}")
+    if limit is not None:
+        limit = max(1, min(int(limit), CRM_MAX_PAGE_SIZE))
+        sql += " LIMIT ?"
+        params.append(limit + 1)
+
+    with closing(_connect_sqlite(CRM_DB_FILE)) as con:
+        rows = con.execute(sql, params).fetchall()
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_crm_cursor(rows[-1]['sort_value'], rows[-1]['rowid'])
+
+    records = [json.loads(row['data']) for row in rows]
+    if fields:
+        keep = set(fields) | {'id'}
+        records = [{k: v for k, v in record.items() if k in keep} for record in records]
+    return records, next_cursor
+
+
+def crm_count(collection: str, filters=None, search=None) -> int:
+    source, clauses, params = _crm_where(collection, filters, search)
+    with closing(_connect_sqlite(CRM_DB_FILE)) as con:
+        return con.execute(f"SELECT COUNT(*) FROM {source}"
+                           + (f" WHERE {' AND '.join(clauses)}" if clauses else ''), params).fetchone()[0]
+
+
+def crm_get(collection: str, record_id: str):
+    with closing(_connect_sqlite(CRM_DB_FILE)) as con:
+        row = con.execute(f"SELECT data FROM crm_{collection} WHERE id = ?", (record_id,)).fetchone()
+    return json.loads(row['data']) if row else None
+
+
+def crm_insert(collection: str, record) -> None:
+    with closing(_connect_sqlite(CRM_DB_FILE)) as con:
+        with con:
+            con.execute(_crm_insert_sql(collection), _crm_row_values(collection, record))
+
+
+def crm_update(collection: str, record_id: str, changes):
+    """Apply `changes` to one record in a single transaction; returns it, or None if missing"""
+    with closing(_connect_sqlite(CRM_DB_FILE)) as con:
+        con.execute("BEGIN IMMEDIATE")
+        with con:
+            row = con.execute(f"SELECT data FROM crm_{collection} WHERE id = ?", (record_id,)).fetchone()
+            if row is None:
+                return None
+            record = json.loads(row['data'])
+            record.update(changes)
+            record['id'] = record_id
+            values = _crm_row_values(collection, record)
+            assignments = ', '.join(f"{column} = ?" for column in list(CRM_COLLECTIONS[collection]['columns']) + ['data'])
+            con.execute(f"UPDATE crm_{collection} SET {assignments} WHERE id = ?", values[1:] + [record_id])
+    return record
+
+
+def crm_delete(collection: str, record_id: str) -> bool:
+    with closing(_connect_sqlite(CRM_DB_FILE)) as con:
+        with con:
+            cur = con.execute(f"DELETE FROM crm_{collection} WHERE id = ?", (record_id,))
+    return cur.rowcount > 0
+
+
+CRM_IMPORT_BATCH = 500
+CRM_IMPORT_MAX_ERRORS = 20
+
+# Field defaults for new records, shared by the POST endpoints and bulk import
+# so that a record looks the same however it was created
+CRM_DEFAULTS = {
+    'customers': {'email': '', 'phone': '', 'address': '', 'company': '', 'notes': '',
+                  'status': 'active', 'total_projects': 0, 'total_revenue': 0.0},
+    'projects': {'customer_id': None, 'title': '', 'description': '', 'status': 'pending',
+                 'priority': 'medium', 'quote_amount': 0.0, 'actual_amount': 0.0, 'due_date': None},
+    'communications': {'customer_id': None, 'type': 'note', 'subject': '', 'content': ''},
+    'calendar': {'title': '', 'date': '', 'time': '', 'type': 'appointment', 'status': 'scheduled'},
+    'technicians': {'name': '', 'email': '', 'phone': '', 'skills': [], 'status': 'available'},
+    'inventory': {'name': '', 'sku': '', 'category': '', 'quantity': 0, 'unit_cost': 0.0,
+                  'reorder_level': 10},
+    'suppliers': {'name': '', 'email': '', 'phone': '', 'website': ''}
+}
+
+
+def crm_new_record(collection: str, data, client_fields=None, timestamps=('created_at',)):
+    """A new record as the POST endpoint creates it: CRM_DEFAULTS overridden by `data`.
+
+    `client_fields` limits which defaulted fields the caller may set (all by default).
+    """
+    now = datetime.now().isoformat()
+    record = {'id': str(uuid.uuid4())}
+    for field, default in CRM_DEFAULTS[collection].items():
+        settable = client_fields is None or field in client_fields
+        record[field] = data.get(field, copy.deepcopy(default)) if settable else copy.deepcopy(default)
+    record.update((field, now) for field in timestamps)
+    return record
+
+
+def crm_numeric_fields(collection: str):
+    """Fields holding numbers: REAL columns plus numeric defaults stored only in the JSON"""
+    numeric = {column for column, column_type in CRM_COLLECTIONS[collection]['columns'].items()
+               if column_type == 'REAL'}
+    numeric.update(field for field, default in CRM_DEFAULTS.get(collection, {}).items()
+                   if isinstance(default, (int, float)) and not isinstance(default, bool))
+    return numeric
+
+
+def _crm_upsert_sql(collection: str) -> str:
+    columns = list(CRM_COLLECTIONS[collection]['columns']) + ['data']
+    updates = ', '.join(f"{column} = excluded.{column}" for column in columns)
+    return _crm_insert_sql(collection) + f" ON CONFLICT(id) DO UPDATE SET {updates}"
+
+
+def crm_import_records(collection: str, records):
+    """Upsert an iterable of (line number, record or error message) in batched transactions.
+
+    Records without an id get a new one. Records whose id already exists are
+    merged into the stored record, so a CSV with only some columns updates
+    just those fields. Returns (imported, skipped, errors). The iterable is
+    consumed lazily, so a streamed request body is never held in memory.
+    """
+    defaults = CRM_DEFAULTS.get(collection, {})
+    tracks_updates = 'updated_at' in CRM_COLLECTIONS[collection]['columns']
+    sql = _crm_upsert_sql(collection)
+    imported, skipped, errors = 0, 0, []
+
+    def write(con, batch):
+        now = datetime.now().isoformat()
+        con.execute("BEGIN IMMEDIATE")
+        with con:
+            existing = {}
+            ids = list(batch)
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                existing.update((row['id'], json.loads(row['data'])) for row in con.execute(
+                    f"SELECT id, data FROM crm_{collection} WHERE id IN ({', '.join('?' for _ in chunk)})", chunk))
+            rows = []
+            for record_id, record in batch.items():
+                stamps = {'updated_at': now} if tracks_updates else {}
+                if record_id in existing:
+                    record = {**existing[record_id], **record, **stamps}
+                else:
+                    record = {**copy.deepcopy(defaults), 'created_at': now, **stamps, **record}
+                record['id'] = record_id
+                rows.append(_crm_row_values(collection, record))
+            con.executemany(sql, rows)
+
+    with closing(_connect_sqlite(CRM_DB_FILE)) as con:
+        batch = {}
+        for line_number, record in records:
+            if not isinstance(record, dict):
+                skipped += 1
+                if len(errors) < CRM_IMPORT_MAX_ERRORS:
+                    message = record if isinstance(record, str) else 'Expected a JSON object'
+                    errors.append({'line': line_number, 'error': message})
+                continue
+            record_id = str(record.get('id') or uuid.uuid4())
+            # A repeated id within the batch merges, as it would across batches
+            batch[record_id] = {**batch.get(record_id, {}), **record}
+            if len(batch) >= CRM_IMPORT_BATCH:
+                write(con, batch)
+                imported += len(batch)
+                batch = {}
+        if batch:
+            write(con, batch)
+            imported += len(batch)
+    return imported, skipped, errors
+
+
+def crm_export_columns(collection: str) -> List[str]:
+    """Every top-level key used by the collection's records, id first (computed in SQLite)"""
+    with closing(_connect_sqlite(CRM_DB_FILE)) as con:
+        keys = [row['key'] for row in con.execute(
+            f"SELECT DISTINCT j.key FROM crm_{collection}, json_each(crm_{collection}.data) AS j ORDER BY j.key")]
+    return ['id'] + [key for key in keys if key != 'id']
+
+
+def crm_iter_records(collection: str):
+    """Yield every record in insertion order, reading rows from SQLite as they are consumed"""
+    with closing(_connect_sqlite(CRM_DB_FILE)) as con:
+        for row in con.execute(f"SELECT data FROM crm_{collection} ORDER BY rowid"):
+            yield json.loads(row['data'])
+
+init_crm_store()
+
+# ============================================================================
+# ANALYSIS CACHE
+# ============================================================================
+
+ANALYSIS_CACHE_STATS = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+_analysis_cache_lock = threading.Lock()
+_file_hash_memo = {}
+
+
+def file_sha256(path: str) -> str:
+    """Return the SHA-256 of a file, memoised on (path, mtime, size)."""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    cached = _file_hash_memo.get(memo_key)
+    if cached:
+        return cached
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    remember_file_sha256(path, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def remember_file_sha256(path: str, sha256: str) -> None:
+    """Record a hash computed elsewhere (e.g. while streaming an upload)"""
+    stat = os.stat(path)
+    if len(_file_hash_memo) > 1024:
+        _file_hash_memo.clear()
+    _file_hash_memo[(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)] = sha256
+
+
+def analysis_cache_key(pdf_hash: str, page_num: int = 0, zoom: float = RENDER_ZOOM) -> str:
+    """Build the cache key for one analysed page.
+
+    The learning context is deliberately left out of the key: it changes after
+    every analysis, which would make the cache useless.
+    """
+    raw = f"{pdf_hash}:{page_num}:{zoom}:{ANALYSIS_PROMPT_VERSION}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _analysis_cache_path(key: str) -> str:
+    return os.path.join(ANALYSIS_CACHE_FOLDER, f'{key}.json')
+
+
+def _restore_analysis_tuples(analysis):
+    """JSON turns coordinate tuples into lists; placement code relies on tuples."""
+    for room in analysis.get('rooms', []):
+        room['center'] = tuple(room['center'])
+    analysis['doors'] = [tuple(d) for d in analysis.get('doors', [])]
+    analysis['windows'] = [tuple(w) for w in analysis.get('windows', [])]
+    analysis['page_size'] = tuple(analysis.get('page_size', (1000, 1000)))
+    return analysis
+
+
+def load_cached_analysis(key: str):
+    """Return a cached analysis or None, updating hit/miss counters."""
+    path = _analysis_cache_path(key)
     try:
         with open(path, 'r') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, OSError) as exc:
-        print(f"⚠️  Failed to load JSON file {path}: {exc}")
-        return copy.deepcopy(default)
+            analysis = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        with _analysis_cache_lock:
+            ANALYSIS_CACHE_STATS['misses'] += 1
+        return None
 
+    # Touch the entry so eviction treats it as recently used
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+    with _analysis_cache_lock:
+        ANALYSIS_CACHE_STATS['hits'] += 1
+    return _restore_analysis_tuples(analysis)
+
+
+def store_cached_analysis(key: str, analysis) -> None:
+    """Persist an analysis result and evict least recently used entries."""
+    path = _analysis_cache_path(key)
+    try:
+        write_json_atomic(path, analysis, indent=None)
+    except OSError as exc:
+        print(f"⚠️  Failed to write analysis cache entry: {exc}")
+        return
+
+    with _analysis_cache_lock:
+        ANALYSIS_CACHE_STATS['stores'] += 1
+    _evict_analysis_cache()
+
+
+def _evict_analysis_cache() -> None:
+    """Drop least recently used entries until the cache fits its size budget."""
+    entries = []
+    total_size = 0
+    for entry in os.scandir(ANALYSIS_CACHE_FOLDER):
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size += stat.st_size
+
+    if total_size <= ANALYSIS_CACHE_MAX_BYTES:
+        return
+
+    entries.sort()
+    for _, size, path in entries:
+        if total_size <= ANALYSIS_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_size -= size
+        with _analysis_cache_lock:
+            ANALYSIS_CACHE_STATS['evictions'] += 1
+
+# ============================================================================
+# STREAMING UPLOADS
+# ============================================================================
+
+PDF_HEADER_WINDOW = 1024  # PDF readers accept "%PDF-" anywhere in the first 1 KB
+
+
+class HashingUploadStream:
+    """Temp file that multipart parsing writes an upload into chunk by chunk.
+
+    Each chunk is hashed and the PDF header is checked as it arrives, so the
+    route never has to re-read the file. Once a file that claims to be a PDF
+    fails the header check, the rest of its body is dropped instead of written.
+    """
+
+    def __init__(self, folder, expect_pdf=False):
+        self._file = tempfile.NamedTemporaryFile(dir=folder, prefix='.upload-', suffix='.part',
+                                                 delete=False)
+        self.path = self._file.name
+        self.expect_pdf = expect_pdf
+        self.size = 0
+        self.rejected = False
+        self._digest = hashlib.sha256()
+        self._head = b''
+        self._committed = False
+
+    def write(self, data):
+        if len(self._head) < PDF_HEADER_WINDOW:
+            self._head += data[:PDF_HEADER_WINDOW - len(self._head)]
+            if (self.expect_pdf and len(self._head) >= PDF_HEADER_WINDOW
+                    and b'%PDF-' not in self._head):
+                self.rejected = True
+        self.size += len(data)
+        if self.rejected:
+            return len(data)
+        self._digest.update(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    @property
+    def is_pdf(self):
+        return not self.rejected and b'%PDF-' in self._head
+
+    def commit(self, dest_path):
+        """Move the finished upload to dest_path; returns False if an identical file is already there"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._committed = True
+        if os.path.exists(dest_path) and file_sha256(dest_path) == self.sha256:
+            os.unlink(self.path)
+            return False
+        try:
+            os.replace(self.path, dest_path)
+        except OSError:
+            shutil.move(self.path, dest_path)
+        remember_file_sha256(dest_path, self.sha256)
+        return True
+
+    def close(self):
+        self._file.close()
+        if not self._committed and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
 
-def save_json_file(path: str, data) -> None:
-    """Persist JSON data to disk for CRM storage."""
-    _ensure_parent_folder(path)
-    with open(path, 'w') as f:
-        json.dump(data, f, indent=2)
+
+class UploadRequest(Request):
+    """Request that streams file parts to disk through HashingUploadStream"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        expect_pdf = (content_type == 'application/pdf'
+                      or (filename or '').lower().endswith('.pdf'))
+        return HashingUploadStream(app.config['UPLOAD_FOLDER'], expect_pdf)
+
+
+app.request_class = UploadRequest
+
+
+def save_upload(file_storage, dest_path):
+    """Persist an uploaded file, returning (sha256, is_new).
+
+    Streamed uploads are renamed into place; anything else (e.g. test clients
+    that bypass UploadRequest) is copied and hashed the old way.
+    """
+    stream = file_storage.stream
+    if isinstance(stream, HashingUploadStream):
+        return stream.sha256, stream.commit(dest_path)
+    file_storage.save(dest_path)
+    return file_sha256(dest_path), True
+
+# ============================================================================
+# MODEL CLIENT
+# ============================================================================
+
+_model_client = None
+_model_client_key = None
+_model_executor = None
+_model_executor_pid = None
+_model_lock = threading.Lock()
+
+
+def get_model_client():
+    """Return the process-wide Anthropic client, or None if AI is unavailable.
+
+    The client keeps HTTP connections alive between calls and retries
+    connection errors, 408/409/429 and 5xx responses with exponential backoff
+    (MODEL_MAX_RETRIES). It is rebuilt after a fork or an API key change.
+    """
+    global _model_client, _model_client_key
+    api_key = os.environ.get('ANTHROPIC_API_KEY')
+    if not ANTHROPIC_AVAILABLE or not api_key:
+        return None
+
+    base_url = os.environ.get('ANTHROPIC_BASE_URL') or None
+    client_key = (os.getpid(), api_key, base_url)
+    with _model_lock:
+        if _model_client is None or _model_client_key != client_key:
+            import httpx
+            _model_client = anthropic.Anthropic(
+                api_key=api_key,
+                base_url=base_url,
+                timeout=httpx.Timeout(MODEL_TIMEOUT, connect=MODEL_CONNECT_TIMEOUT),
+                max_retries=MODEL_MAX_RETRIES,
+                http_client=anthropic.DefaultHttpxClient(
+                    limits=httpx.Limits(max_connections=MODEL_MAX_CONNECTIONS,
+                                        max_keepalive_connections=MODEL_MAX_CONNECTIONS)
+                )
+            )
+            _model_client_key = client_key
+            print(f"✅ Claude client initialized ({base_url or 'default endpoint'})")
+        return _model_client
+
+
+def get_model_executor():
+    """Thread pool shared by all concurrent model calls in this process"""
+    global _model_executor, _model_executor_pid
+    with _model_lock:
+        if _model_executor is None or _model_executor_pid != os.getpid():
+            _model_executor = ThreadPoolExecutor(max_workers=max(1, ANALYSIS_MAX_CONCURRENCY),
+                                                 thread_name_prefix='model-call')
+            _model_executor_pid = os.getpid()
+        return _model_executor
+
+
+def run_model_calls(calls):
+    """Run independent zero-argument callables concurrently; results keep input order.
+
+    Calls must not submit further work to the shared executor themselves.
+    """
+    if len(calls) < 2:
+        return [call() for call in calls]
+    futures = [get_model_executor().submit(call) for call in calls]
+    return [future.result() for future in futures]
 
 # ============================================================================
 # AI ANALYSIS FUNCTIONS
 # ============================================================================
 
-def pdf_to_image_base64(pdf_path, page_num=0):
-    """Convert PDF page to base64 image for Claude Vision API"""
+def render_page_png(pdf_path, page_num=0, zoom=RENDER_ZOOM, pdf_hash=None):
+    """Render a PDF page to PNG once and return the cached file path"""
+    pdf_hash = pdf_hash or file_sha256(pdf_path)
+    png_path = os.path.join(RENDER_CACHE_FOLDER, f'{pdf_hash}_p{page_num}_z{zoom:g}.png')
+    if os.path.exists(png_path):
+        return png_path
+
     doc = fitz.open(pdf_path)
-    page = doc[page_num]
-    
-    # Render at high resolution
-    mat = fitz.Matrix(2.0, 2.0)  # 2x zoom for better quality
-    pix = page.get_pixmap(matrix=mat)
-    
-    # Convert to PNG bytes
-    img_bytes = pix.tobytes("png")
-    
-    # Convert to base64
-    img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-    
-    doc.close()
-    return img_base64
+    try:
+        # Render at high resolution
+        mat = fitz.Matrix(zoom, zoom)  # 2x zoom for better quality
+        pix = doc[page_num].get_pixmap(matrix=mat)
+        img_bytes = pix.tobytes("png")
+    finally:
+        doc.close()
+
+    tmp_path = f'{png_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(img_bytes)
+    os.replace(tmp_path, png_path)
+    return png_path
+
+class LRUMemo:
+    """Thread-safe memo that forgets its least recently used entries past maxsize"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+_page_size_memo = LRUMemo(PAGE_MEMO_SIZE)
+
+def get_page_size(pdf_path, page_num=0, pdf_hash=None):
+    """Return (width, height) of a page in PDF points"""
+    pdf_hash = pdf_hash or file_sha256(pdf_path)
+    memo_key = (pdf_hash, page_num)
+    size = _page_size_memo.get(memo_key)
+    if size is None:
+        doc = fitz.open(pdf_path)
+        try:
+            rect = doc[page_num].rect
+            size = (rect.width, rect.height)
+        finally:
+            doc.close()
+        _page_size_memo.put(memo_key, size)
+    return size
+
+def tile_scale(z):
+    """Pixels per PDF point at tile zoom level z"""
+    return TILE_BASE_SCALE * (2 ** z)
+
+def render_page_tile(pdf_path, page_num, z, x, y, pdf_hash=None):
+    """Render one TILE_SIZE tile of a page and return its cached path.
+
+    Only the clipped region is rasterised, so deep zoom levels on A0/A1 plans
+    never produce a full-page raster. Returns None for tiles outside the page.
+    """
+    pdf_hash = pdf_hash or file_sha256(pdf_path)
+    tile_path = os.path.join(TILE_CACHE_FOLDER, pdf_hash, f'p{page_num}', str(z), f'{x}_{y}.png')
+    if os.path.exists(tile_path):
+        return tile_path
+
+    width, height = get_page_size(pdf_path, page_num, pdf_hash)
+    scale = tile_scale(z)
+    span = TILE_SIZE / scale  # Tile edge length in PDF points
+    if x < 0 or y < 0 or x * span >= width or y * span >= height:
+        return None
+
+    doc = fitz.open(pdf_path)
+    try:
+        page = doc[page_num]
+        origin = page.rect.tl
+        clip = fitz.Rect(origin.x + x * span, origin.y + y * span,
+                         origin.x + (x + 1) * span, origin.y + (y + 1) * span) & page.rect
+        pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), clip=clip)
+        img_bytes = pix.tobytes("png")
+    finally:
+        doc.close()
+
+    os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+    tmp_path = f'{tile_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(img_bytes)
+    os.replace(tmp_path, tile_path)
+    return tile_path
+
+_page_count_memo = LRUMemo(PAGE_MEMO_SIZE)
+
+def get_page_count(pdf_path, pdf_hash=None):
+    """Number of pages in a PDF (memoised by content hash when one is given)"""
+    count = _page_count_memo.get(pdf_hash) if pdf_hash else None
+    if count is not None:
+        return count
+    doc = fitz.open(pdf_path)
+    try:
+        count = doc.page_count
+    finally:
+        doc.close()
+    if pdf_hash:
+        _page_count_memo.put(pdf_hash, count)
+    return count
+
+_render_pool = None
+_render_pool_pid = None
+_render_pool_lock = threading.Lock()
+
+def get_render_pool():
+    """Long-lived process pool for page rendering, one per app process.
+
+    Workers come from a forkserver rather than fork(): this process runs
+    request and job threads, and forking it mid-flight can copy held locks.
+    """
+    global _render_pool, _render_pool_pid
+    with _render_pool_lock:
+        if _render_pool is None or _render_pool_pid != os.getpid():
+            _render_pool = ProcessPoolExecutor(max_workers=RENDER_PROCESSES,
+                                               mp_context=multiprocessing.get_context('forkserver'))
+            _render_pool_pid = os.getpid()
+        return _render_pool
+
+def _discard_render_pool(pool) -> None:
+    """Drop a broken pool so the next call starts a fresh one"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def render_pages_parallel(pdf_path, page_nums, zoom=RENDER_ZOOM, pdf_hash=None):
+    """Rasterise uncached pages in the render pool so the PNG cache is warm"""
+    pdf_hash = pdf_hash or file_sha256(pdf_path)
+    missing = [n for n in page_nums
+               if not os.path.exists(os.path.join(RENDER_CACHE_FOLDER, f'{pdf_hash}_p{n}_z{zoom:g}.png'))]
+    if len(missing) < 2 or RENDER_PROCESSES < 2:
+        for page_num in missing:
+            render_page_png(pdf_path, page_num, zoom, pdf_hash)
+        return
+
+    print(f"🔄 Rendering {len(missing)} pages with {RENDER_PROCESSES} processes...")
+    pool = get_render_pool()
+    try:
+        list(pool.map(render_page_png, [pdf_path] * len(missing), missing,
+                      [zoom] * len(missing), [pdf_hash] * len(missing)))
+    except BrokenProcessPool:
+        _discard_render_pool(pool)
+        raise
+
+def pdf_to_image_base64(pdf_path, page_num=0, zoom=RENDER_ZOOM, pdf_hash=None):
+    """Convert PDF page to base64 image for Claude Vision API"""
+    png_path = render_page_png(pdf_path, page_num, zoom, pdf_hash)
+    with open(png_path, 'rb') as f:
+        return base64.b64encode(f.read()).decode('utf-8')
+
+def analyze_floorplan_with_ai(pdf_path, pdf_hash=None):
+    """Analyze every page (level) of a floor plan set.
+
+    Uncached pages are rasterised in a process pool, then the vision model is
+    called for up to ANALYSIS_MAX_CONCURRENCY pages at a time. The result keeps
+    per-page analyses under 'pages' plus flattened rooms/doors/windows.
+    """
+    pdf_hash = pdf_hash or file_sha256(pdf_path)
+    page_nums = prepare_pages_for_analysis(pdf_path, pdf_hash)
+    pages = run_model_calls([lambda n=n: analyze_page_with_ai(pdf_path, n, pdf_hash)
+                             for n in page_nums])
+    return combine_page_analyses(pages)
+
+def prepare_pages_for_analysis(pdf_path, pdf_hash):
+    """Return the page numbers to analyse, pre-rendering any the vision model will need"""
+    page_nums = list(range(get_page_count(pdf_path)))
+    uncached = [n for n in page_nums
+                if not os.path.exists(_analysis_cache_path(analysis_cache_key(pdf_hash, n)))]
+    if uncached and ANTHROPIC_AVAILABLE and os.environ.get('ANTHROPIC_API_KEY'):
+        render_pages_parallel(pdf_path, uncached, RENDER_ZOOM, pdf_hash)
+    return page_nums
+
+def combine_page_analyses(pages):
+    """Merge per-page analyses; every room/door/window list stays available per page"""
+    methods = {page.get('method') for page in pages}
+    if methods == {'ai_vision'}:
+        method = 'ai_vision'
+    elif 'ai_vision' in methods:
+        method = 'mixed'
+    else:
+        method = 'fallback'
+
+    notes = [f"Page {page['page'] + 1}: {page['ai_notes']}" for page in pages if page.get('ai_notes')]
+    return {
+        'pages': pages,
+        'rooms': [dict(room, page=page['page']) for page in pages for room in page['rooms']],
+        'doors': [door for page in pages for door in page['doors']],
+        'windows': [window for page in pages for window in page['windows']],
+        'page_size': pages[0]['page_size'] if pages else (1000, 1000),
+        'ai_notes': '\n'.join(notes) if len(pages) > 1 else (pages[0].get('ai_notes', '') if pages else ''),
+        'method': method
+    }
+
+def analyze_page_with_ai(pdf_path, page_num=0, pdf_hash=None):
+    """Use Claude Vision API to intelligently analyze one floor plan page"""
+    analysis = _analyze_page_with_ai(pdf_path, page_num, pdf_hash)
+    analysis['page'] = page_num
+    return analysis
+
+def _analyze_page_with_ai(pdf_path, page_num, pdf_hash):
+    # Repeat uploads of the same plan skip rendering and the vision call
+    pdf_hash = pdf_hash or file_sha256(pdf_path)
+    cache_key = analysis_cache_key(pdf_hash, page_num)
+    cached = load_cached_analysis(cache_key)
+    if cached:
+        print(f"⚡ Analysis cache hit: {cache_key[:12]} (page {page_num + 1})")
+        return cached
 
-def analyze_floorplan_with_ai(pdf_path):
-    """Use Claude Vision API to intelligently analyze floor plans"""
-    
     # Check if API key is available and anthropic is installed
     if not ANTHROPIC_AVAILABLE:
         print("Anthropic package not available, using fallback")
-        return analyze_floorplan_smart(pdf_path)
-    
+        return analyze_floorplan_smart(pdf_path, page_num)
+
     api_key = os.environ.get('ANTHROPIC_API_KEY')
     if not api_key:
         print("WARNING: No ANTHROPIC_API_KEY found, using fallback method")
-        return analyze_floorplan_smart(pdf_path)
+        return analyze_floorplan_smart(pdf_path, page_num)
     
     print(f"✅ API key found: {api_key[:20]}...")
     print(f"✅ API key length: {len(api_key)}")
@@ -241,15 +1688,13 @@ def analyze_floorplan_with_ai(pdf_path):
     try:
         print("🔄 Converting PDF to image...")
         # Convert PDF to image
-        image_base64 = pdf_to_image_base64(pdf_path)
+        image_base64 = pdf_to_image_base64(pdf_path, page_num, pdf_hash=pdf_hash)
         print(f"✅ Image converted, base64 length: {len(image_base64)}")
         
         # Get learning context
         learning_context = get_learning_context()
         
-        # Initialize Claude client
-        client = anthropic.Anthropic(api_key=api_key)
-        print("✅ Claude client initialized")
+        client = get_model_client()
         
         # Create vision prompt
         prompt = f"""{learning_context}
@@ -294,7 +1739,7 @@ Respond ONLY with valid JSON, no other text."""
         print("🔄 Calling Claude Vision API...")
         # Call Claude Vision API
         message = client.messages.create(
-            model="claude-sonnet-4-20250514",
+            model=MODEL_NAME,
             max_tokens=4000,
             messages=[
                 {
@@ -346,8 +1791,8 @@ Respond ONLY with valid JSON, no other text."""
         windows = [(int(w['x']), int(w['y'])) for w in analysis.get('windows', [])]
         
         page_dims = analysis.get('page_dimensions', {})
-        
-        return {
+
+        result = {
             'rooms': rooms,
             'doors': doors,
             'windows': windows,
@@ -355,6 +1800,8 @@ Respond ONLY with valid JSON, no other text."""
             'ai_notes': analysis.get('notes', ''),
             'method': 'ai_vision'
         }
+        store_cached_analysis(cache_key, result)
+        return result
     
     except Exception as e:
         print(f"❌ AI analysis failed with error: {type(e).__name__}")
@@ -362,13 +1809,13 @@ Respond ONLY with valid JSON, no other text."""
         print(f"❌ Full traceback:")
         traceback.print_exc()
         print("⚠️  Falling back to Smart Grid analysis")
-        return analyze_floorplan_smart(pdf_path)
+        return analyze_floorplan_smart(pdf_path, page_num)
 
-def analyze_floorplan_smart(pdf_path):
+def analyze_floorplan_smart(pdf_path, page_num=0):
     """Fallback method - smart analysis without AI"""
     reader = PdfReader(pdf_path)
-    first_page = reader.pages[0]
-    
+    first_page = reader.pages[page_num]
+
     page_box = first_page.mediabox
     width = float(page_box.width)
     height = float(page_box.height)
@@ -515,6 +1962,64 @@ def place_symbols_intelligently(analysis, automation_types, tier="basic"):
     
     return placements
 
+def redistribute_bad_coordinates(analysis):
+    """Spread rooms (and stacked doors/windows) over a grid when the vision
+    model returned the same coordinates for most of them. Mutates `analysis`.
+    """
+    rooms = analysis['rooms']
+    doors = analysis['doors']
+    windows = analysis['windows']
+
+    page_width = analysis.get('page_size', (1000, 1000))[0]
+    page_height = analysis.get('page_size', (1000, 1000))[1]
+    
+    coords_are_bad = False
+    if len(rooms) > 1:
+        first_center = rooms[0].get('center', (0, 0))
+        same_coords_count = sum(1 for room in rooms if room.get('center') == first_center)
+        if same_coords_count >= len(rooms) * 0.8:  # 80% of rooms at same spot
+            coords_are_bad = True
+            print(f"⚠️  WARNING: Claude Vision returned bad coordinates!")
+            print(f"   {same_coords_count}/{len(rooms)} rooms at same location: {first_center}")
+            print(f"   🔄 Switching to intelligent grid distribution...")
+    
+    # If coordinates are bad, create a smart grid
+    if coords_are_bad and len(rooms) > 0:
+        # Distribute symbols across the floor plan in a grid
+        grid_cols = min(4, int(len(rooms) ** 0.5) + 1)
+        grid_rows = (len(rooms) + grid_cols - 1) // grid_cols
+        
+        # Use middle 60% of the page (avoid edges)
+        margin_x = page_width * 0.2
+        margin_y = page_height * 0.2
+        usable_width = page_width * 0.6
+        usable_height = page_height * 0.6
+        
+        cell_width = usable_width / grid_cols
+        cell_height = usable_height / grid_rows
+        
+        # Recalculate room centers in grid
+        for i, room in enumerate(rooms):
+            row = i // grid_cols
+            col = i % grid_cols
+            new_x = margin_x + (col + 0.5) * cell_width
+            new_y = margin_y + (row + 0.5) * cell_height
+            room['center'] = (new_x, new_y)
+            print(f"   📍 Room {i}: {room.get('type', 'unknown')} → ({new_x:.0f}, {new_y:.0f})")
+        
+        # Also distribute doors and windows in grid if they're bad too
+        if doors and len(set(doors)) < len(doors) * 0.3:  # Less than 30% unique
+            for i, _ in enumerate(doors):
+                door_x = margin_x + (i % grid_cols) * cell_width + cell_width * 0.2
+                door_y = margin_y + (i // grid_cols) * cell_height + cell_height * 0.8
+                doors[i] = (door_x, door_y)
+        
+        if windows and len(set(windows)) < len(windows) * 0.3:
+            for i, _ in enumerate(windows):
+                win_x = margin_x + (i % grid_cols) * cell_width + cell_width * 0.8
+                win_y = margin_y + (i // grid_cols) * cell_height + cell_height * 0.2
+                windows[i] = (win_x, win_y)
+
 def place_symbols_with_ai(analysis, automation_types, tier="basic"):
     """
     Use Claude AI to intelligently place automation symbols based on floor plan analysis.
@@ -535,16 +2040,15 @@ def place_symbols_with_ai(analysis, automation_types, tier="basic"):
         print("🤖 Using AI to determine optimal symbol placement...")
         
         # Get learning context from past projects
-        learning_index = load_learning_index()
+        recent_examples = get_recent_learning_examples(5)  # Last 5 examples
         learning_context = ""
-        if learning_index.get('examples'):
+        if recent_examples:
             learning_context = "\n\nLearning from past projects:\n"
-            for ex in learning_index.get('examples', [])[-5:]:  # Last 5 examples
+            for ex in recent_examples:
                 if 'placement_feedback' in ex:
                     learning_context += f"- {ex.get('placement_feedback')}\n"
         
-        # Initialize Claude client
-        client = anthropic.Anthropic(api_key=api_key)
+        client = get_model_client()
         
         # Prepare room data
         rooms_info = []
@@ -616,7 +2120,7 @@ Use room_index to reference rooms from the list above."""
 
         print("🔄 Asking Claude AI for optimal placement strategy...")
         message = client.messages.create(
-            model="claude-sonnet-4-20250514",
+            model=MODEL_NAME,
             max_tokens=2000,
             messages=[{"role": "user", "content": prompt}]
         )
@@ -650,56 +2154,7 @@ Use room_index to reference rooms from the list above."""
         if windows:
             print(f"   First window: {windows[0]}")
         
-        # CHECK IF COORDINATES ARE BAD (all rooms at same location)
-        page_width = analysis.get('page_size', (1000, 1000))[0]
-        page_height = analysis.get('page_size', (1000, 1000))[1]
-        
-        coords_are_bad = False
-        if len(rooms) > 1:
-            first_center = rooms[0].get('center', (0, 0))
-            same_coords_count = sum(1 for room in rooms if room.get('center') == first_center)
-            if same_coords_count >= len(rooms) * 0.8:  # 80% of rooms at same spot
-                coords_are_bad = True
-                print(f"⚠️  WARNING: Claude Vision returned bad coordinates!")
-                print(f"   {same_coords_count}/{len(rooms)} rooms at same location: {first_center}")
-                print(f"   🔄 Switching to intelligent grid distribution...")
-        
-        # If coordinates are bad, create a smart grid
-        if coords_are_bad and len(rooms) > 0:
-            # Distribute symbols across the floor plan in a grid
-            grid_cols = min(4, int(len(rooms) ** 0.5) + 1)
-            grid_rows = (len(rooms) + grid_cols - 1) // grid_cols
-            
-            # Use middle 60% of the page (avoid edges)
-            margin_x = page_width * 0.2
-            margin_y = page_height * 0.2
-            usable_width = page_width * 0.6
-            usable_height = page_height * 0.6
-            
-            cell_width = usable_width / grid_cols
-            cell_height = usable_height / grid_rows
-            
-            # Recalculate room centers in grid
-            for i, room in enumerate(rooms):
-                row = i // grid_cols
-                col = i % grid_cols
-                new_x = margin_x + (col + 0.5) * cell_width
-                new_y = margin_y + (row + 0.5) * cell_height
-                room['center'] = (new_x, new_y)
-                print(f"   📍 Room {i}: {room.get('type', 'unknown')} → ({new_x:.0f}, {new_y:.0f})")
-            
-            # Also distribute doors and windows in grid if they're bad too
-            if doors and len(set(doors)) < len(doors) * 0.3:  # Less than 30% unique
-                for i, _ in enumerate(doors):
-                    door_x = margin_x + (i % grid_cols) * cell_width + cell_width * 0.2
-                    door_y = margin_y + (i // grid_cols) * cell_height + cell_height * 0.8
-                    doors[i] = (door_x, door_y)
-            
-            if windows and len(set(windows)) < len(windows) * 0.3:
-                for i, _ in enumerate(windows):
-                    win_x = margin_x + (i % grid_cols) * cell_width + cell_width * 0.8
-                    win_y = margin_y + (i // grid_cols) * cell_height + cell_height * 0.2
-                    windows[i] = (win_x, win_y)
+        redistribute_bad_coordinates(analysis)
         
         # Process each automation type
         for auto_type in automation_types:
@@ -784,106 +2239,300 @@ Use room_index to reference rooms from the list above."""
         traceback.print_exc()
         return place_symbols_intelligently(analysis, automation_types, tier)
 
+# Offsets keep symbols of different types in the same room from overlapping
+SYMBOL_OFFSETS = {'lighting': (0, 0), 'climate': (30, 30), 'audio': (-30, -30)}
+
+def resolve_room_type(room_type, rules):
+    """Map a vision room type onto a key of rules['room_types'], or None if unknown.
+
+    Handles case/spacing, aliases, numbered rooms ("bedroom_2") and qualified
+    names ("guest_bedroom" -> "bedroom").
+    """
+    room_types = rules.get('room_types', {})
+    aliases = rules.get('aliases', {})
+    name = '_'.join(str(room_type or 'generic').lower().replace('-', ' ').split())
+    parts = [part for part in name.split('_') if not part.isdigit()]
+    for start in range(len(parts)):
+        candidate = '_'.join(parts[start:])
+        candidate = aliases.get(candidate, candidate)
+        if candidate in room_types:
+            return candidate
+    return None
+
+def _rule_placement(position, auto_type, quantity, **extra):
+    """Expand one rule hit into `quantity` symbols spread 30px apart"""
+    dx, dy = SYMBOL_OFFSETS.get(auto_type, (0, 0))
+    return [dict({
+        'position': (position[0] + dx + (q - quantity // 2) * 30, position[1] + dy),
+        'quantity': 1,
+    }, **extra) for q in range(quantity)]
+
+def place_symbols_with_rules(analysis, automation_types, rules, tier="basic"):
+    """Place symbols from the declarative placement_rules table.
+
+    Known room types, windows, doors and floors are handled locally with no
+    network call. Rooms whose type is not in the table are sent to
+    place_symbols_with_ai (or get the 'generic' rule when the model is
+    unavailable).
+    """
+    placements = {auto_type: [] for auto_type in automation_types}
+    redistribute_bad_coordinates(analysis)
+    rooms = analysis['rooms']
+
+    room_rules = rules.get('room_types', {})
+    room_based = {auto_type for quantities in room_rules.values() for auto_type in quantities}
+    unknown_rooms = []
+
+    for i, room in enumerate(rooms):
+        resolved = resolve_room_type(room.get('type'), rules)
+        if resolved is None:
+            unknown_rooms.append(i)
+            continue
+        for auto_type, quantity in room_rules[resolved].items():
+            if auto_type in placements and quantity > 0:
+                placements[auto_type].extend(_rule_placement(
+                    room.get('center', (0, 0)), auto_type, int(quantity),
+                    room_index=i, room_type=room.get('type', 'generic'),
+                    confidence=room.get('confidence', 0.9)))
+
+    for auto_type, per_window in rules.get('per_window', {}).items():
+        if auto_type in placements:
+            for i, window_pos in enumerate(analysis['windows']):
+                placements[auto_type].extend(_rule_placement(
+                    window_pos, auto_type, int(per_window), window_index=i, confidence=0.9))
+
+    for auto_type, per_door in rules.get('per_door', {}).items():
+        if auto_type in placements:
+            for i, door_pos in enumerate(analysis['doors']):
+                placements[auto_type].extend(_rule_placement(
+                    door_pos, auto_type, int(per_door), door_index=i, confidence=0.9))
+
+    # Floor-level devices go in the largest room on the page
+    if rooms:
+        main_index = max(range(len(rooms)), key=lambda i: rooms[i].get('area', 0) or 0)
+        for auto_type, per_floor in rules.get('per_floor', {}).items():
+            if auto_type in placements:
+                placements[auto_type].extend(_rule_placement(
+                    rooms[main_index].get('center', (0, 0)), auto_type, int(per_floor),
+                    room_index=main_index, room_type=rooms[main_index].get('type', 'generic'),
+                    confidence=0.8))
+
+    fallback_types = [t for t in automation_types if t in room_based]
+    if unknown_rooms and fallback_types:
+        unknown_types = sorted({str(rooms[i].get('type')) for i in unknown_rooms})
+        if get_model_client() is None:
+            print(f"⚠️  Unknown room types {unknown_types}, using generic rule")
+            for i in unknown_rooms:
+                for auto_type, quantity in room_rules.get('generic', {}).items():
+                    if auto_type in placements and quantity > 0:
+                        placements[auto_type].extend(_rule_placement(
+                            rooms[i].get('center', (0, 0)), auto_type, int(quantity),
+                            room_index=i, room_type=rooms[i].get('type', 'generic'),
+                            confidence=rooms[i].get('confidence', 0.7)))
+        else:
+            print(f"🤖 Asking AI about unknown room types {unknown_types}")
+            sub_analysis = dict(analysis, rooms=[rooms[i] for i in unknown_rooms],
+                                doors=[], windows=[])
+            ai_placements = place_symbols_with_ai(sub_analysis, fallback_types, tier)
+            for auto_type, entries in ai_placements.items():
+                for entry in entries:
+                    if 'room_index' in entry:
+                        entry['room_index'] = unknown_rooms[entry['room_index']]
+                    placements[auto_type].append(entry)
+
+    for auto_type, items in placements.items():
+        print(f"  ✅ {auto_type}: {len(items)} items placed (rules)")
+    return placements
+
+def place_page_symbols(page_analysis, automation_types, tier="basic", placement_rules=None):
+    """Place symbols on one analysed page and tag each placement with its page"""
+    if PLACEMENT_MODE == 'rules' and placement_rules:
+        page_placements = place_symbols_with_rules(page_analysis, automation_types,
+                                                   placement_rules, tier)
+    else:
+        page_placements = place_symbols_with_ai(page_analysis, automation_types, tier)
+    for entries in page_placements.values():
+        for entry in entries:
+            entry['page'] = page_analysis.get('page', 0)
+    return page_placements
+
+def merge_page_placements(per_page, automation_types):
+    """Concatenate per-page placements into one dict keyed by automation type"""
+    placements = {auto_type: [] for auto_type in automation_types}
+    for page_placements in per_page:
+        for auto_type, entries in page_placements.items():
+            placements.setdefault(auto_type, []).extend(entries)
+    return placements
+
+def analyze_and_place(pdf_path, automation_types, tier="basic", pdf_hash=None,
+                      placement_rules=None):
+    """Analyse every page and place its symbols, returning (analysis, placements).
+
+    Each page's vision and placement calls run back to back as one task, so
+    placement for page 1 does not wait on the vision call for page 3.
+    """
+    pdf_hash = pdf_hash or file_sha256(pdf_path)
+    page_nums = prepare_pages_for_analysis(pdf_path, pdf_hash)
+
+    def process_page(page_num):
+        page_analysis = analyze_page_with_ai(pdf_path, page_num, pdf_hash)
+        return page_analysis, place_page_symbols(page_analysis, automation_types, tier,
+                                                 placement_rules)
+
+    results = run_model_calls([lambda n=n: process_page(n) for n in page_nums])
+    analysis = combine_page_analyses([page_analysis for page_analysis, _ in results])
+    placements = merge_page_placements([page_placements for _, page_placements in results],
+                                       automation_types)
+    return analysis, placements
+
 # ============================================================================
 # PDF AND QUOTE GENERATION
 # ============================================================================
 
+def group_marks_by_page(placements, automation_data):
+    """Return {page: [(symbol, (x, y)), ...]} with positions in editor image space"""
+    marks_by_page = {}
+    for auto_type, positions in placements.items():
+        if auto_type in automation_data['automation_types']:
+            symbol = automation_data['automation_types'][auto_type]['symbols'][0]
+            for pos_data in positions:
+                marks_by_page.setdefault(pos_data.get('page', 0), []).append((symbol, pos_data['position']))
+    return marks_by_page
+
 def create_annotated_pdf(original_pdf_path, placements, automation_data, output_path):
-    """Create annotated PDF with symbols - coordinates are scaled correctly"""
+    """Create annotated PDF with symbols on every page.
+
+    The original file is copied byte for byte, symbols are appended to each
+    page's content stream with PyMuPDF, and the result is saved incrementally,
+    so untouched pages are never parsed or rewritten. Set
+    ANNOTATION_BACKEND=overlay for the old reportlab/pypdf merge.
+    """
+    if ANNOTATION_BACKEND == 'overlay':
+        return create_annotated_pdf_overlay(original_pdf_path, placements, automation_data, output_path)
+
+    # Placements are in image space (rendered at RENDER_ZOOM); PyMuPDF page
+    # space is top-left based like the image, so only a scale is needed
+    scale = 1.0 / RENDER_ZOOM
+    marks_by_page = group_marks_by_page(placements, automation_data)
+
+    shutil.copyfile(original_pdf_path, output_path)
+    doc = fitz.open(output_path)
+    symbol_count = 0
+    try:
+        for page_num, marks in sorted(marks_by_page.items()):
+            if not 0 <= page_num < doc.page_count:
+                continue
+            page = doc[page_num]
+            # One shape per page -> a single content stream is appended
+            shape = page.new_shape()
+            for symbol, (x_image, y_image) in marks:
+                # Base-14 Helvetica only covers cp1252; encoding up front also
+                # skips PyMuPDF building a glyph-width table up to the emoji code point
+                text = symbol.encode('cp1252', 'replace').decode('cp1252')
+                point = fitz.Point(x_image * scale, y_image * scale) * page.derotation_matrix
+                shape.insert_text(point, text, fontsize=24, fontname='helv',
+                                  color=(1, 0, 0), rotate=page.rotation)
+                symbol_count += 1
+            shape.commit()
+
+        print(f"📊 Total symbols placed: {symbol_count} across {len(marks_by_page)} page(s)")
+
+        if doc.can_save_incrementally():
+            doc.saveIncr()
+        else:
+            # Damaged or encrypted originals cannot be appended to; write a clean copy
+            tmp_path = f'{output_path}.tmp'
+            doc.save(tmp_path, garbage=1, deflate=True)
+            doc.close()
+            os.replace(tmp_path, output_path)
+    finally:
+        if not doc.is_closed:
+            doc.close()
+
+    return output_path
+
+def create_annotated_pdf_overlay(original_pdf_path, placements, automation_data, output_path):
+    """Legacy backend: draw a reportlab overlay per page and merge it with pypdf"""
     reader = PdfReader(original_pdf_path)
     writer = PdfWriter()
-    
-    first_page = reader.pages[0]
-    page_box = first_page.mediabox
-    pdf_width = float(page_box.width)
-    pdf_height = float(page_box.height)
-    
-    print(f"📐 PDF Dimensions: {pdf_width} x {pdf_height}")
-    
-    packet = io.BytesIO()
-    c = canvas.Canvas(packet, pagesize=(pdf_width, pdf_height))
-    
-    c.setFont("Helvetica", 24)
-    c.setFillColorRGB(1, 0, 0)
-    
+
     # CRITICAL: Coordinates from AI analysis are in image space (2x zoom)
     # We need to scale them down to PDF space
     SCALE_FACTOR = 0.5  # Because image was rendered at 2x zoom
-    
+
+    marks_by_page = group_marks_by_page(placements, automation_data)
+
     symbol_count = 0
-    for auto_type, positions in placements.items():
-        if auto_type in automation_data['automation_types']:
-            symbol = automation_data['automation_types'][auto_type]['symbols'][0]
-            for pos_data in positions:
-                x_image, y_image = pos_data['position']
-                
+    for page_num, page in enumerate(reader.pages):
+        marks = marks_by_page.get(page_num)
+        if marks:
+            page_box = page.mediabox
+            pdf_width = float(page_box.width)
+            pdf_height = float(page_box.height)
+            print(f"📐 Page {page_num + 1} dimensions: {pdf_width} x {pdf_height}")
+
+            packet = io.BytesIO()
+            c = canvas.Canvas(packet, pagesize=(pdf_width, pdf_height))
+            c.setFont("Helvetica", 24)
+            c.setFillColorRGB(1, 0, 0)
+
+            for symbol, (x_image, y_image) in marks:
                 # Convert image coordinates to PDF coordinates
-                x_pdf = x_image * SCALE_FACTOR
-                y_pdf = y_image * SCALE_FACTOR
-                
-                # PDF coordinate system: (0,0) is bottom-left, but image is top-left
-                # So we need to flip Y coordinate
-                y_pdf_flipped = pdf_height - y_pdf
-                
-                # DEBUG: Print first few coordinates
-                if symbol_count < 5:
-                    print(f"🔍 Symbol {symbol_count}: {symbol}")
-                    print(f"   Image coords: ({x_image}, {y_image})")
-                    print(f"   PDF coords: ({x_pdf}, {y_pdf})")
-                    print(f"   Flipped: ({x_pdf}, {y_pdf_flipped})")
-                symbol_count += 1
-                
-                c.drawString(x_pdf, y_pdf_flipped, symbol)
-    
-    print(f"📊 Total symbols placed: {symbol_count}")
-    
-    c.save()
-    
-    packet.seek(0)
-    overlay_reader = PdfReader(packet)
-    first_page.merge_page(overlay_reader.pages[0])
-    
-    writer.add_page(first_page)
-    
-    for page_num in range(1, len(reader.pages)):
-        writer.add_page(reader.pages[page_num])
-    
+                x_pdf = x_image * SCALE_FACTOR
+                y_pdf = y_image * SCALE_FACTOR
+
+                # PDF coordinate system: (0,0) is bottom-left, but image is top-left
+                # So we need to flip Y coordinate
+                c.drawString(x_pdf, pdf_height - y_pdf, symbol)
+                symbol_count += 1
+
+            c.save()
+            packet.seek(0)
+            page.merge_page(PdfReader(packet).pages[0])
+
+        writer.add_page(page)
+
+    print(f"📊 Total symbols placed: {symbol_count} across {len(marks_by_page)} page(s)")
+
     with open(output_path, 'wb') as f:
         writer.write(f)
-    
+
     return output_path
 
 def calculate_costs(placements, automation_data, tier="basic"):
+    pricing = pricing_tables(automation_data)
+    unit_costs = pricing.unit_cost[tier]
+    hours_per_unit = pricing.labor_hours[tier]
+    labor_rate = pricing.labor_rate
+
     total_cost = 0
     total_labor_hours = 0
     items = []
     
     for auto_type, positions in placements.items():
-        if auto_type in automation_data['automation_types']:
-            type_data = automation_data['automation_types'][auto_type]
-            quantity = len(positions)
-            
-            unit_cost = type_data['base_cost_per_unit'][tier]
-            labor_hours_per_unit = type_data['labor_hours'][tier]
-            
-            subtotal = unit_cost * quantity
-            labor_hours = labor_hours_per_unit * quantity
-            labor_cost = labor_hours * automation_data['labor_rate']
-            
-            total_cost += subtotal + labor_cost
-            total_labor_hours += labor_hours
-            
-            items.append({
-                'type': type_data['name'],
-                'quantity': quantity,
-                'unit_cost': unit_cost,
-                'subtotal': subtotal,
-                'labor_hours': labor_hours,
-                'labor_cost': labor_cost,
-                'total': subtotal + labor_cost
-            })
+        unit_cost = unit_costs.get(auto_type)
+        if unit_cost is None:
+            continue
+        quantity = len(positions)
+        
+        subtotal = unit_cost * quantity
+        labor_hours = hours_per_unit[auto_type] * quantity
+        labor_cost = labor_hours * labor_rate
+        
+        total_cost += subtotal + labor_cost
+        total_labor_hours += labor_hours
+        
+        items.append({
+            'type': pricing.type_names[auto_type],
+            'quantity': quantity,
+            'unit_cost': unit_cost,
+            'subtotal': subtotal,
+            'labor_hours': labor_hours,
+            'labor_cost': labor_cost,
+            'total': subtotal + labor_cost
+        })
     
-    markup = total_cost * (automation_data['markup_percentage'] / 100)
+    markup = total_cost * pricing.markup_rate
     grand_total = total_cost + markup
     
     return {
@@ -1038,80 +2687,1087 @@ def create_quote_pdf(project_name, costs, placements, output_path, annotated_pdf
             f"${item.get('total', 0):.2f}"
         ])
 
-    quote_data.append(['', '', '', 'Subtotal:', f"${costs.get('subtotal', 0):.2f}"])
-    markup_pct = automation_data.get('markup_percentage', 0)
-    quote_data.append(['', '', '', f'Markup ({markup_pct}%):', f"${costs.get('markup', 0):.2f}"])
-    quote_data.append(['', '', '', 'Grand Total:', f"${costs.get('grand_total', 0):.2f}"])
+    quote_data.append(['', '', '', 'Subtotal:', f"${costs.get('subtotal', 0):.2f}"])
+    markup_pct = automation_data.get('markup_percentage', 0)
+    quote_data.append(['', '', '', f'Markup ({markup_pct}%):', f"${costs.get('markup', 0):.2f}"])
+    quote_data.append(['', '', '', 'Grand Total:', f"${costs.get('grand_total', 0):.2f}"])
+
+    cost_table = Table(quote_data, colWidths=[2.5 * inch, 0.7 * inch, 1 * inch, 1 * inch, 1.3 * inch])
+    cost_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#556B2F')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('GRID', (0, 0), (-1, -4), 0.5, colors.grey),
+        ('BACKGROUND', (3, -1), (-1, -1), colors.HexColor('#556B2F')),
+        ('TEXTCOLOR', (3, -1), (-1, -1), colors.white),
+        ('FONTNAME', (3, -1), (-1, -1), 'Helvetica-Bold')
+    ]))
+    elements.append(Paragraph('<b>Investment Summary</b>', styles['Heading3']))
+    elements.append(cost_table)
+
+    elements.append(Spacer(1, 0.3 * inch))
+    elements.append(Paragraph(
+        "Annotated floor plan reference: <b>{}</b>".format(annotated_pdf_path),
+        styles['Normal']
+    ))
+
+    doc.build(elements)
+
+# ============================================================================
+# SIMPRO API INTEGRATION
+# ============================================================================
+
+_simpro_session = None
+_simpro_session_pid = None
+_simpro_config_entry = None   # (file mtime/size, config) - re-read only when the file changes
+_simpro_token = None          # (base_url, client_id, access_token, expires_at)
+_simpro_lock = threading.Lock()
+
+
+class SimproAuthError(Exception):
+    """Simpro is not configured, or the token endpoint refused our credentials"""
+
+
+class SimproRateLimiter:
+    """Token bucket shared by all threads: `rate` requests per second, bursts up to `burst`"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+simpro_rate_limiter = SimproRateLimiter(SIMPRO_RATE_LIMIT / SIMPRO_WORKER_PROCESSES)
+
+
+def get_simpro_session() -> requests.Session:
+    """Process-wide Simpro session: keep-alive pool, retrying failed connections.
+
+    429 and 5xx responses are retried by simpro_send rather than here, so
+    that every retry also waits for the rate limiter.
+    """
+    global _simpro_session, _simpro_session_pid
+    with _simpro_lock:
+        if _simpro_session is None or _simpro_session_pid != os.getpid():
+            retry = Retry(
+                total=SIMPRO_MAX_RETRIES,
+                backoff_factor=SIMPRO_BACKOFF,
+                status=0,
+                allowed_methods=SIMPRO_RETRY_METHODS,
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=SIMPRO_POOL_SIZE, max_retries=retry)
+            http = requests.Session()
+            http.mount('https://', adapter)
+            http.mount('http://', adapter)
+            http.headers['Accept'] = 'application/json'
+            _simpro_session, _simpro_session_pid = http, os.getpid()
+        return _simpro_session
+
+
+def simpro_retry_delay(response, retries: int) -> float:
+    """Seconds to wait before retrying a 429/5xx: Retry-After if given, else exponential backoff"""
+    retry_after = response.headers.get('Retry-After')
+    if retry_after:
+        with suppress(ValueError):
+            return max(0.0, float(retry_after))
+        with suppress(TypeError, ValueError):
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    return min(SIMPRO_BACKOFF * (2 ** retries), 120.0)
+
+
+def get_simpro_config():
+    """Simpro configuration from memory, re-read only when the file changes"""
+    global _simpro_config_entry
+    try:
+        stat = os.stat(SIMPRO_CONFIG_FILE)
+        key = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        key = None
+    entry = _simpro_config_entry
+    if entry is None or entry[0] != key:
+        entry = (key, load_simpro_config())
+        _simpro_config_entry = entry
+    return entry[1]
+
+
+def _token_is_fresh(expires_at) -> bool:
+    return bool(expires_at) and float(expires_at) - SIMPRO_TOKEN_MARGIN > time.time()
+
+
+def request_simpro_token(config):
+    """Client-credentials token request; returns (access_token, refresh_token, expires_at)"""
+    if not config.get('base_url') or not config.get('client_id'):
+        raise SimproAuthError('Simpro is not configured')
+    response = get_simpro_session().post(
+        f"{config['base_url']}/oauth2/token",
+        data={
+            'grant_type': 'client_credentials',
+            'client_id': config['client_id'],
+            'client_secret': config['client_secret']
+        },
+        timeout=(SIMPRO_CONNECT_TIMEOUT, SIMPRO_TIMEOUT)
+    )
+    if response.status_code in (400, 401, 403):
+        raise SimproAuthError(f'Simpro rejected the client credentials (status {response.status_code})')
+    response.raise_for_status()
+    token_data = response.json()
+    return (token_data.get('access_token'), token_data.get('refresh_token'),
+            time.time() + token_data.get('expires_in', 3600))
+
+
+def get_simpro_token(force_refresh=False):
+    """Return (config, access_token), refreshing the token shortly before it expires.
+
+    The token is cached in memory. A refresh happens under the config file
+    lock, so when several workers notice expiry at once only the first one
+    calls Simpro and the rest pick up the token it saved.
+    """
+    global _simpro_token
+    config = get_simpro_config()
+    identity = (config.get('base_url'), config.get('client_id'))
+    cached = _simpro_token
+    if not force_refresh and cached and cached[:2] == identity and _token_is_fresh(cached[3]):
+        return config, cached[2]
+
+    with json_file_lock(SIMPRO_CONFIG_FILE):
+        config = _load_json_for_update(SIMPRO_CONFIG_FILE, SIMPRO_DEFAULT_CONFIG)
+        identity = (config.get('base_url'), config.get('client_id'))
+        reuse = bool(config.get('access_token')) and _token_is_fresh(config.get('token_expires_at'))
+        if force_refresh and (not cached or config.get('access_token') == cached[2]):
+            reuse = False  # unless another worker already replaced the token we gave up on
+        if reuse:
+            access_token = config['access_token']
+        else:
+            access_token, refresh_token, expires_at = request_simpro_token(config)
+            config.update({'access_token': access_token, 'refresh_token': refresh_token,
+                           'token_expires_at': expires_at, 'connected': True})
+            write_json_atomic(SIMPRO_CONFIG_FILE, config)
+            print(f"🔑 Simpro token refreshed (valid {int(expires_at - time.time())}s)")
+        _simpro_token = identity + (access_token, float(config['token_expires_at']))
+    return config, access_token
+
+
+def simpro_send(endpoint, method='GET', data=None, params=None) -> requests.Response:
+    """Authenticated Simpro call returning the raw response (raises on HTTP errors).
+
+    Every attempt takes a token from the rate limiter. 429 and 5xx answers
+    to idempotent methods are retried up to SIMPRO_MAX_RETRIES times.
+    """
+    http = get_simpro_session()
+    force_refresh, refreshed, retries = False, False, 0
+    while True:
+        config, access_token = get_simpro_token(force_refresh=force_refresh)
+        force_refresh = False
+        url = f"{config['base_url']}/api/v1.0/companies/{config['company_id']}{endpoint}"
+        simpro_rate_limiter.acquire()
+        response = http.request(
+            method, url,
+            headers={'Authorization': f"Bearer {access_token}"},
+            params=params,
+            json=data if method != 'GET' else None,
+            timeout=(SIMPRO_CONNECT_TIMEOUT, SIMPRO_TIMEOUT)
+        )
+        if response.status_code == 401 and not refreshed:
+            # The token was revoked or expired early: refresh once and retry
+            force_refresh = refreshed = True
+            continue
+        if (response.status_code in SIMPRO_RETRY_STATUSES and method in SIMPRO_RETRY_METHODS
+                and retries < SIMPRO_MAX_RETRIES):
+            delay = simpro_retry_delay(response, retries)
+            retries += 1
+            print(f"⏳ Simpro answered {response.status_code} for {endpoint}, retry {retries} in {delay:.1f}s")
+            response.close()
+            time.sleep(delay)
+            continue
+        break
+    response.raise_for_status()
+    return response
+
+
+def simpro_fetch_pages(endpoint, params=None, page_size=250):
+    """Yield every page (a list of items) of a Simpro list endpoint, in order.
+
+    Page 1 tells us how many pages there are (Result-Pages, or Result-Total);
+    the rest are fetched SIMPRO_FETCH_CONCURRENCY at a time under the rate
+    limiter, holding at most twice that many pages in memory. Without those
+    headers, pages are read one at a time until a short page.
+    """
+    params = {**(params or {}), 'pageSize': page_size}
+
+    def fetch(page):
+        response = simpro_send(endpoint, params={**params, 'page': page})
+        items = response.json()
+        if not isinstance(items, list):
+            raise ValueError(f'Unexpected Simpro response for {endpoint} page {page}')
+        return response, items
+
+    response, items = fetch(1)
+    yield items
+    pages = response.headers.get('Result-Pages')
+    total = response.headers.get('Result-Total')
+    if pages or total:
+        pages = int(pages) if pages else -(-int(total) // page_size)
+    else:
+        page = 1
+        while len(items) >= page_size:
+            page += 1
+            _, items = fetch(page)
+            yield items
+        return
+
+    with ThreadPoolExecutor(max_workers=max(1, SIMPRO_FETCH_CONCURRENCY),
+                            thread_name_prefix='simpro-fetch') as executor:
+        pending, next_page = deque(), 2
+        try:
+            while pending or next_page <= pages:
+                while next_page <= pages and len(pending) < 2 * SIMPRO_FETCH_CONCURRENCY:
+                    pending.append(executor.submit(fetch, next_page))
+                    next_page += 1
+                yield pending.popleft().result()[1]
+        finally:
+            # Stop queued pages if the consumer goes away (e.g. client disconnect)
+            for future in pending:
+                future.cancel()
+
+
+def make_simpro_request(endpoint, method='GET', data=None, params=None):
+    """Make authenticated request to Simpro API"""
+    config = get_simpro_config()
+    
+    if not config.get('connected'):
+        return {'error': 'Not connected to Simpro'}
+    
+    if method not in ('GET', 'POST', 'PUT', 'PATCH', 'DELETE'):
+        return {'error': f'Unsupported method: {method}'}
+    
+    try:
+        response = simpro_send(endpoint, method, data, params)
+        
+        # Try to parse JSON, handle cases where response might not be JSON
+        try:
+            return response.json()
+        except ValueError:
+            return {'error': 'Invalid JSON response from Simpro', 'status_code': response.status_code, 'text': response.text[:200]}
+    
+    except SimproAuthError as e:
+        return {'error': str(e)}
+    except requests.exceptions.RequestException as e:
+        print(f"Simpro API error: {str(e)}")
+        # Try to get more details from the response
+        error_msg = str(e)
+        if hasattr(e, 'response') and e.response is not None:
+            try:
+                error_details = e.response.json()
+                error_msg = f"{error_msg}: {error_details}"
+            except:
+                error_msg = f"{error_msg} (Status: {e.response.status_code})"
+        return {'error': error_msg}
+
+# ============================================================================
+# SIMPRO MIRROR
+# ============================================================================
+
+# Simpro list resources mirrored locally. `modified` is the field used for
+# changes-only syncs; resources without one are re-read in full each time.
+# Simpro list endpoints return a summary column set unless `columns` is given,
+# and the summary has no DateModified. Without it there is no high-water mark
+# and every sync is a full pass, so each resource asks for its columns
+# explicitly (ID and the modified field are always added).
+SIMPRO_RESOURCES = {
+    'customers': {'endpoint': '/customers/', 'modified': 'DateModified',
+                  'columns': ['CompanyName', 'GivenName', 'FamilyName', 'Email', 'Phone']},
+    'jobs': {'endpoint': '/jobs/', 'modified': 'DateModified',
+             'columns': ['Name', 'Description', 'Customer', 'Site', 'Stage', 'Status', 'Total', 'DateIssued']},
+    'quotes': {'endpoint': '/quotes/', 'modified': 'DateModified',
+               'columns': ['Name', 'Description', 'Customer', 'Site', 'Stage', 'Status', 'Total', 'DateIssued']},
+    'catalogs': {'endpoint': '/catalogs/', 'modified': 'DateModified',
+                 'columns': ['PartNo', 'Name', 'TradePrice']},
+    'labor-rates': {'endpoint': '/laborRates/', 'modified': None}
+}
+
+
+def simpro_list_params(resource: str):
+    """Query parameters every list request for a mirrored resource carries"""
+    spec = SIMPRO_RESOURCES[resource]
+    if not spec.get('columns'):
+        return {}
+    columns = ['ID'] + [column for column in spec['columns'] if column != 'ID']
+    if spec['modified'] and spec['modified'] not in columns:
+        columns.append(spec['modified'])
+    return {'columns': ','.join(columns)}
+
+# A sync that hasn't finished after this long is assumed dead and can be retaken;
+# after a failed sync, background syncs pause for SIMPRO_SYNC_RETRY seconds
+SIMPRO_SYNC_LEASE = 600
+SIMPRO_SYNC_RETRY = 60
+
+
+def init_simpro_mirror() -> None:
+    with closing(_connect_sqlite(SIMPRO_MIRROR_DB)) as con:
+        con.executescript("""
+            CREATE TABLE IF NOT EXISTS simpro_records(
+                resource TEXT NOT NULL,
+                simpro_id TEXT NOT NULL,
+                sort_id INTEGER,
+                modified TEXT,
+                synced_at REAL NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY(resource, simpro_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_simpro_records_order ON simpro_records(resource, sort_id, simpro_id);
+            CREATE TABLE IF NOT EXISTS simpro_sync(
+                resource TEXT PRIMARY KEY,
+                synced_at REAL,
+                full_synced_at REAL,
+                high_water TEXT,
+                total INTEGER,
+                running_since REAL,
+                retry_after REAL,
+                error TEXT
+            );
+        """)
+
+
+def get_simpro_sync_state(resource: str):
+    with closing(_connect_sqlite(SIMPRO_MIRROR_DB)) as con:
+        row = con.execute("SELECT * FROM simpro_sync WHERE resource = ?", (resource,)).fetchone()
+    return dict(row) if row else {'resource': resource}
+
+
+def _claim_simpro_sync(resource: str, ignore_backoff: bool = False) -> bool:
+    """Take the sync lease for a resource; False if another thread or worker holds it"""
+    now = time.time()
+    with closing(_connect_sqlite(SIMPRO_MIRROR_DB)) as con:
+        with con:
+            con.execute("INSERT OR IGNORE INTO simpro_sync(resource) VALUES(?)", (resource,))
+            cur = con.execute(
+                "UPDATE simpro_sync SET running_since = ? WHERE resource = ? "
+                "AND (running_since IS NULL OR running_since < ?) "
+                "AND (? OR retry_after IS NULL OR retry_after < ?)",
+                (now, resource, now - SIMPRO_SYNC_LEASE, ignore_backoff, now)
+            )
+    return cur.rowcount == 1
+
+
+def _store_simpro_items(con, resource: str, items, synced_at: float, modified_field) -> Optional[str]:
+    """Upsert one page of items; returns the newest modified value seen"""
+    rows, newest = [], None
+    for item in items:
+        simpro_id = str(item.get('ID'))
+        modified = item.get(modified_field) if modified_field else None
+        if modified and (newest is None or modified > newest):
+            newest = modified
+        sort_id = int(simpro_id) if simpro_id.isdigit() else None
+        rows.append((resource, simpro_id, sort_id, modified, synced_at, json.dumps(item)))
+    con.executemany(
+        "INSERT INTO simpro_records(resource, simpro_id, sort_id, modified, synced_at, data) "
+        "VALUES(?, ?, ?, ?, ?, ?) ON CONFLICT(resource, simpro_id) DO UPDATE SET "
+        "sort_id = excluded.sort_id, modified = excluded.modified, "
+        "synced_at = excluded.synced_at, data = excluded.data",
+        rows
+    )
+    return newest
+
+
+def sync_simpro_resource(resource: str, full: bool = False):
+    """Pull a resource into the mirror; call only while holding its sync lease.
+
+    Normally only records modified since the last sync are fetched. A full
+    pass (first sync, forced, or older than SIMPRO_FULL_SYNC_INTERVAL) reads
+    everything and drops records Simpro no longer returns.
+    """
+    spec = SIMPRO_RESOURCES[resource]
+    state = get_simpro_sync_state(resource)
+    started = time.time()
+    modified_field = spec['modified']
+    full = (full or not modified_field or not state.get('high_water')
+            or started - (state.get('full_synced_at') or 0) > SIMPRO_FULL_SYNC_INTERVAL)
+
+    params = simpro_list_params(resource)
+    if not full:
+        # ge rather than gt: an edit in the same second as the last sync isn't missed
+        params[modified_field] = f"ge({state['high_water']})"
+
+    high_water = None if full else state.get('high_water')
+    fetched = 0
+    try:
+        with closing(_connect_sqlite(SIMPRO_MIRROR_DB)) as con:
+            for items in simpro_fetch_pages(spec['endpoint'], params, SIMPRO_SYNC_PAGE_SIZE):
+                with con:
+                    newest = _store_simpro_items(con, resource, items, started, modified_field)
+                if newest and (high_water is None or newest > high_water):
+                    high_water = newest
+                fetched += len(items)
+
+            with con:
+                if full:
+                    con.execute("DELETE FROM simpro_records WHERE resource = ? AND synced_at < ?",
+                                (resource, started))
+                total = con.execute("SELECT COUNT(*) FROM simpro_records WHERE resource = ?",
+                                    (resource,)).fetchone()[0]
+                note = None
+                if modified_field and fetched and high_water is None:
+                    # Still saved, but the next sync has to be a full pass again
+                    note = f'{modified_field} missing from Simpro items; incremental sync unavailable'
+                    print(f"⚠️  Simpro {resource}: {note}")
+                con.execute(
+                    "UPDATE simpro_sync SET synced_at = ?, high_water = ?, total = ?, error = ?, "
+                    "running_since = NULL, retry_after = NULL, full_synced_at = CASE WHEN ? THEN ? ELSE full_synced_at END "
+                    "WHERE resource = ?",
+                    (started, high_water, total, note, full, started, resource)
+                )
+        print(f"🔄 Simpro {resource}: {'full' if full else 'incremental'} sync, {fetched} fetched, {total} mirrored")
+        return {'fetched': fetched, 'total': total, 'full': full}
+    except Exception as e:
+        with closing(_connect_sqlite(SIMPRO_MIRROR_DB)) as con:
+            with con:
+                con.execute("UPDATE simpro_sync SET running_since = NULL, retry_after = ?, error = ? "
+                            "WHERE resource = ?", (time.time() + SIMPRO_SYNC_RETRY, str(e), resource))
+        print(f"⚠️  Simpro {resource} sync failed: {e}")
+        raise
+
+
+def start_simpro_sync(resource: str) -> bool:
+    """Sync a resource on a background thread unless a sync is already running"""
+    if not _claim_simpro_sync(resource):
+        return False
+
+    def run():
+        try:
+            sync_simpro_resource(resource)
+        except Exception:
+            pass  # recorded in simpro_sync.error
+
+    threading.Thread(target=run, name=f'simpro-sync-{resource}', daemon=True).start()
+    return True
+
+
+def invalidate_simpro_mirror(resource: str) -> None:
+    """Mark a resource as due for a sync, e.g. after we changed it in Simpro"""
+    with closing(_connect_sqlite(SIMPRO_MIRROR_DB)) as con:
+        with con:
+            con.execute("UPDATE simpro_sync SET synced_at = 0 WHERE resource = ?", (resource,))
+
+
+def simpro_freshness(state, source: str, syncing: bool):
+    synced_at = state.get('synced_at') or None
+    age = round(time.time() - synced_at) if synced_at else None
+    return {
+        'source': source,
+        'synced_at': datetime.fromtimestamp(synced_at).isoformat() if synced_at else None,
+        'age_seconds': age,
+        'stale': age is None or age > SIMPRO_MIRROR_TTL,
+        'syncing': syncing or bool(state.get('running_since')),
+        'last_error': state.get('error')
+    }
+
+
+def read_simpro_mirror(resource: str, page=None, page_size=None):
+    """Records from the mirror in Simpro ID order; all of them without a page size"""
+    sql = ("SELECT data FROM simpro_records WHERE resource = ? "
+           "ORDER BY sort_id, simpro_id")
+    params = [resource]
+    if page_size:
+        sql += " LIMIT ? OFFSET ?"
+        params += [page_size, (max(page or 1, 1) - 1) * page_size]
+    with closing(_connect_sqlite(SIMPRO_MIRROR_DB)) as con:
+        return [json.loads(row['data']) for row in con.execute(sql, params)]
+
+
+def iter_simpro_mirror(resource: str, batch_size=None):
+    """Yield the mirror in Simpro ID order, one list of records per batch.
+
+    Each batch is its own short keyset query, so a slow reader never holds
+    the database open against a running sync.
+    """
+    batch_size = batch_size or SIMPRO_SYNC_PAGE_SIZE
+    after = None
+    while True:
+        sql = "SELECT simpro_id, sort_id, data FROM simpro_records WHERE resource = ?"
+        params = [resource]
+        if after is not None:
+            sort_id, simpro_id = after
+            if sort_id is None:
+                # Non-numeric IDs sort first (NULL sort_id), by simpro_id
+                sql += " AND (sort_id IS NOT NULL OR simpro_id > ?)"
+                params.append(simpro_id)
+            else:
+                sql += " AND (sort_id > ? OR (sort_id = ? AND simpro_id > ?))"
+                params += [sort_id, sort_id, simpro_id]
+        sql += " ORDER BY sort_id, simpro_id LIMIT ?"
+        params.append(batch_size)
+        with closing(_connect_sqlite(SIMPRO_MIRROR_DB)) as con:
+            rows = con.execute(sql, params).fetchall()
+        if rows:
+            yield [json.loads(row['data']) for row in rows]
+        if len(rows) < batch_size:
+            return
+        after = (rows[-1]['sort_id'], rows[-1]['simpro_id'])
+
+
+def serve_simpro_resource(resource: str, default_page_size=None):
+    """GET handler for a mirrored Simpro list: read-through with stale-while-revalidate.
+
+    Once a resource has been synced, pages come from the mirror and a
+    background sync starts when it is older than SIMPRO_MIRROR_TTL. Until
+    then requests go to Simpro directly while the first sync runs.
+    ?refresh=1 syncs before answering; ?all=1 streams the whole collection.
+    """
+    if request.args.get('all'):
+        return stream_simpro_resource(resource)
+
+    page = request.args.get('page', 1, type=int)
+    page_size = request.args.get('pageSize', default_page_size, type=int)
+    state = get_simpro_sync_state(resource)
+    syncing = False
+
+    if request.args.get('refresh') and get_simpro_config().get('connected'):
+        if _claim_simpro_sync(resource, ignore_backoff=True):
+            try:
+                sync_simpro_resource(resource)
+            except Exception:
+                pass  # answered below from whatever we have, with last_error set
+        state = get_simpro_sync_state(resource)
+    elif get_simpro_config().get('connected') and simpro_freshness(state, 'mirror', False)['stale']:
+        syncing = start_simpro_sync(resource)
+
+    if state.get('synced_at') is None:
+        params = simpro_list_params(resource)
+        if page_size:
+            params.update(pageSize=page_size, page=page)
+        result = make_simpro_request(SIMPRO_RESOURCES[resource]['endpoint'], params=params or None)
+        if 'error' in result:
+            return jsonify({'success': False, 'error': result['error']}), 400
+        return jsonify({'success': True, 'data': result,
+                        'freshness': simpro_freshness(state, 'simpro', syncing)})
+
+    return jsonify({'success': True, 'data': read_simpro_mirror(resource, page, page_size),
+                    'total': state.get('total'),
+                    'freshness': simpro_freshness(state, 'mirror', syncing)})
+
+def stream_simpro_resource(resource: str):
+    """?all=1: the whole collection as NDJSON, one item per line.
+
+    Served from the mirror while it is fresh, otherwise (or with ?live=1)
+    pulled from Simpro with concurrent page fetches. If Simpro fails part
+    way through, the stream ends with an {"error": ...} line.
+    """
+    state = get_simpro_sync_state(resource)
+    if not request.args.get('live') and not simpro_freshness(state, 'mirror', False)['stale']:
+        source, pages = 'mirror', iter_simpro_mirror(resource)
+    else:
+        if not get_simpro_config().get('connected'):
+            return jsonify({'success': False, 'error': 'Not connected to Simpro'}), 400
+        source = 'simpro'
+        pages = simpro_fetch_pages(SIMPRO_RESOURCES[resource]['endpoint'], simpro_list_params(resource),
+                                   page_size=SIMPRO_SYNC_PAGE_SIZE)
+        try:
+            # Fetch page 1 now so auth and HTTP errors get a normal error response
+            pages = chain([next(pages)], pages)
+        except (SimproAuthError, requests.exceptions.RequestException, ValueError) as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+    def body():
+        try:
+            for items in pages:
+                yield ''.join(json.dumps(item) + '\n' for item in items)
+        except (SimproAuthError, requests.exceptions.RequestException, ValueError) as e:
+            yield json.dumps({'error': str(e)}) + '\n'
+
+    return Response(body(), mimetype='application/x-ndjson', headers={'X-Simpro-Source': source})
+
+init_simpro_mirror()
+
+# ============================================================================
+# SIMPRO QUOTE PUSH
+# ============================================================================
+
+# Every pushed quote has a ledger row keyed by its idempotency key that
+# records each step done in Simpro (quote, section, cost center, lines).
+# Re-sending a batch skips finished quotes and resumes unfinished ones from
+# the last recorded step, so retries never create duplicate quotes or lines.
+
+SIMPRO_PUSH_LEASE = 300
+
+
+def init_simpro_quote_ledger() -> None:
+    with closing(_connect_sqlite(SIMPRO_MIRROR_DB)) as con:
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS simpro_quote_pushes(
+                idempotency_key TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                claim TEXT,
+                claimed_at REAL,
+                quote_id TEXT,
+                section_id TEXT,
+                cost_center_id TEXT,
+                lines_done INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at REAL
+            )
+        """)
+        con.commit()
+
+
+class SimproPushClaimLost(Exception):
+    """Another worker took over a quote push after this one's lease expired"""
+
+
+def simpro_quote_key(quote, costs) -> str:
+    """Idempotency key for a quote: the caller's, or a hash of what would be sent.
+
+    The resolved costs are part of the hash, so a project whose placements or
+    tier change after a push is pushed again as a new quote.
+    """
+    if quote.get('idempotency_key'):
+        return str(quote['idempotency_key'])
+    basis = {'customer_id': quote.get('customer_id'), 'project_id': quote.get('project_id'),
+             'site_id': quote.get('site_id'), 'costs': costs}
+    return hashlib.sha256(json.dumps(basis, sort_keys=True).encode()).hexdigest()
+
+
+def simpro_quote_costs(quote, pricing: AutomationConfig):
+    """(costs, name) for a quote: its inline costs, or recomputed from the stored project"""
+    if quote.get('costs') is not None:
+        return quote['costs'], quote.get('name')
+    project = get_project(quote['project_id']) if quote.get('project_id') else None
+    if project is None:
+        raise ValueError('Quote needs costs or a known project_id')
+    costs = calculate_costs(project.get('placements', {}), pricing.data, project.get('tier', 'basic'))
+    return costs, quote.get('name') or project.get('project_name')
+
+
+def simpro_quote_lines(costs, labor_rate: float):
+    """One-off cost center lines for a calculate_costs() result: equipment, labour, markup"""
+    lines = []
+    for item in costs.get('items', []):
+        lines.append({'Description': item['type'], 'Quantity': item['quantity'],
+                      'BasePrice': round(item['unit_cost'], 2)})
+        if item.get('labor_hours'):
+            rate = item['labor_cost'] / item['labor_hours'] if item.get('labor_cost') else labor_rate
+            lines.append({'Description': f"{item['type']} - installation labour",
+                          'Quantity': item['labor_hours'], 'BasePrice': round(rate, 2)})
+    if costs.get('markup'):
+        lines.append({'Description': 'Markup', 'Quantity': 1, 'BasePrice': round(costs['markup'], 2)})
+    return lines
+
+
+def _claim_quote_push(key: str):
+    """Claim a ledger row; returns (row, claim token) or (row, None) if it is done or busy"""
+    claim, now = uuid.uuid4().hex, time.time()
+    with closing(_connect_sqlite(SIMPRO_MIRROR_DB)) as con:
+        with con:
+            con.execute(
+                "INSERT INTO simpro_quote_pushes(idempotency_key, status, claim, claimed_at, updated_at) "
+                "VALUES(?, 'pending', ?, ?, ?) ON CONFLICT(idempotency_key) DO UPDATE SET "
+                "status = 'pending', claim = excluded.claim, claimed_at = excluded.claimed_at "
+                "WHERE status = 'failed' OR (status = 'pending' AND claimed_at < ?)",
+                (key, claim, now, now, now - SIMPRO_PUSH_LEASE)
+            )
+            row = dict(con.execute("SELECT * FROM simpro_quote_pushes WHERE idempotency_key = ?",
+                                   (key,)).fetchone())
+    return row, (claim if row['claim'] == claim and row['status'] == 'pending' else None)
+
+
+def _record_quote_push(key: str, claim: str, **fields) -> None:
+    """Record progress under our claim, renewing its lease; raises SimproPushClaimLost if it was taken"""
+    fields['updated_at'] = fields['claimed_at'] = time.time()
+    with closing(_connect_sqlite(SIMPRO_MIRROR_DB)) as con:
+        with con:
+            cur = con.execute(f"UPDATE simpro_quote_pushes SET {', '.join(f'{k} = ?' for k in fields)} "
+                              f"WHERE idempotency_key = ? AND claim = ?", list(fields.values()) + [key, claim])
+    if cur.rowcount == 0:
+        raise SimproPushClaimLost(key)
+
+
+def push_simpro_quote(quote, cost_center: str, pricing: AutomationConfig):
+    """Create one quote with its line items in Simpro; returns a per-quote status dict"""
+    result = {'idempotency_key': quote.get('idempotency_key'), 'project_id': quote.get('project_id')}
+    try:
+        costs, name = simpro_quote_costs(quote, pricing)
+    except ValueError as e:
+        result.update(status='failed', error=str(e))
+        return result
+    key = result['idempotency_key'] = simpro_quote_key(quote, costs)
+    row, claim = _claim_quote_push(key)
+    if claim is None:
+        result.update(status='duplicate' if row['status'] == 'created' else 'in_progress',
+                      simpro_quote_id=row['quote_id'], line_items=row['lines_done'])
+        return result
+
+    try:
+        lines = simpro_quote_lines(costs, pricing.labor_rate)
+
+        # Each step is skipped when the ledger says an earlier attempt already did it
+        quote_id = row['quote_id']
+        if not quote_id:
+            payload = {'Customer': quote['customer_id'], 'Name': name or 'Automation quote',
+                       'Description': quote.get('description') or f'Ref {key[:16]}'}
+            if quote.get('site_id'):
+                payload['Site'] = quote['site_id']
+            quote_id = str(simpro_send('/quotes/', 'POST', payload).json()['ID'])
+            _record_quote_push(key, claim, quote_id=quote_id)
+        section_id = row['section_id']
+        if not section_id:
+            section_id = str(simpro_send(f'/quotes/{quote_id}/sections/', 'POST',
+                                         {'Name': 'Automation'}).json()['ID'])
+            _record_quote_push(key, claim, section_id=section_id)
+        cost_center_id = row['cost_center_id']
+        if not cost_center_id:
+            cost_center_id = str(simpro_send(f'/quotes/{quote_id}/sections/{section_id}/costCenters/', 'POST',
+                                             {'CostCenter': int(cost_center), 'Name': 'Automation'}).json()['ID'])
+            _record_quote_push(key, claim, cost_center_id=cost_center_id)
+        lines_endpoint = f'/quotes/{quote_id}/sections/{section_id}/costCenters/{cost_center_id}/oneOffs/'
+        for index in range(row['lines_done'], len(lines)):
+            simpro_send(lines_endpoint, 'POST', lines[index])
+            _record_quote_push(key, claim, lines_done=index + 1)
+
+        _record_quote_push(key, claim, status='created', error=None)
+        result.update(status='created', simpro_quote_id=quote_id, line_items=len(lines),
+                      total=round(costs.get('grand_total', 0), 2))
+    except SimproPushClaimLost:
+        # Whoever holds the claim now finishes the push; nothing more is sent from here
+        result.update(status='in_progress', simpro_quote_id=None)
+    except Exception as e:
+        error = str(e)
+        if isinstance(e, KeyError):
+            error = f'Missing field: {e}'
+        with suppress(SimproPushClaimLost):
+            _record_quote_push(key, claim, status='failed', error=error)
+        result.update(status='failed', error=error)
+    return result
+
+
+def push_simpro_quotes(quotes, cost_center: str):
+    """Push a batch of quotes concurrently; results come back in request order"""
+    pricing = pricing_tables(load_data())
+    with ThreadPoolExecutor(max_workers=max(1, SIMPRO_FETCH_CONCURRENCY),
+                            thread_name_prefix='simpro-push') as executor:
+        results = list(executor.map(lambda quote: push_simpro_quote(quote, cost_center, pricing), quotes))
+    if any(result['status'] == 'created' for result in results):
+        invalidate_simpro_mirror('quotes')
+    return results
+
+init_simpro_quote_ledger()
+
+# ============================================================================
+# ANALYSIS PIPELINE
+# ============================================================================
+
+def run_analysis_pipeline(payload, report_progress):
+    """Run upload -> vision -> placement -> PDFs -> costs for one saved plan.
+
+    `report_progress(stage, fraction)` is called as each stage starts. Returns
+    the same result dict /api/analyze used to return synchronously.
+    """
+    timestamp = payload['timestamp']
+    project_name = payload['project_name']
+    automation_types = payload['automation_types']
+    tier = payload['tier']
+    input_path = payload['input_path']
+    pdf_hash = payload['pdf_hash']
+
+    # AI analysis and placement (with fallbacks), pipelined page by page
+    report_progress('analyzing', 0.1)
+    automation_data = load_data()
+    placement_rules = automation_data.get('placement_rules') or DEFAULT_DATA['placement_rules']
+    analysis, placements = analyze_and_place(input_path, automation_types, tier, pdf_hash,
+                                             placement_rules)
+
+    # Store the project and a summary of its analysis in the learning store
+    report_progress('saving', 0.6)
+    project = {
+        'timestamp': timestamp,
+        'project_name': project_name,
+        'automation_types': automation_types,
+        'tier': tier,
+        'pdf_path': input_path,
+        'pdf_hash': pdf_hash,
+        'original_filename': payload.get('original_filename'),
+        'page_count': len(analysis.get('pages', [])) or 1,
+        'placements': placements,
+        'analysis_result': {
+            'rooms': len(analysis['rooms']),
+            'doors': len(analysis['doors']),
+            'windows': len(analysis['windows']),
+            'method': analysis.get('method', 'unknown'),
+            'ai_notes': analysis.get('ai_notes', '')
+        }
+    }
+    save_project(project)
+    add_learning_example(_project_learning_example(project))
+
+    # Create annotated PDF immediately
+    report_progress('annotating', 0.7)
+    annotated_pdf_path = os.path.join(app.config['OUTPUT_FOLDER'], f'{timestamp}_annotated.pdf')
+    create_annotated_pdf(input_path, placements, automation_data, annotated_pdf_path)
+
+    # Calculate costs
+    report_progress('pricing', 0.85)
+    costs = calculate_costs(placements, automation_data, tier)
+
+    # Generate quote PDF
+    report_progress('quoting', 0.9)
+    quote_pdf_path = os.path.join(app.config['OUTPUT_FOLDER'], f'{timestamp}_quote.pdf')
+    generate_quote_pdf(costs, automation_data, project_name, tier, quote_pdf_path)
+
+    # Return BOTH files AND editor link
+    return {
+        'project_id': timestamp,
+        'editor_url': f'/editor/{timestamp}',
+        'analysis': {
+            'rooms_detected': len(analysis['rooms']),
+            'doors_detected': len(analysis['doors']),
+            'windows_detected': len(analysis['windows']),
+            'pages_analyzed': len(analysis.get('pages', [])) or 1,
+            'method': analysis.get('method', 'unknown'),
+            'ai_notes': analysis.get('ai_notes', '')
+        },
+        'costs': costs,
+        'files': {
+            'annotated_pdf': f'/download/{os.path.basename(annotated_pdf_path)}',
+            'quote_pdf': f'/download/{os.path.basename(quote_pdf_path)}',
+            'floor_plan_preview': f'/api/floor-plan-image/{timestamp}'
+        }
+    }
+
+# ============================================================================
+# BACKGROUND JOBS
+# ============================================================================
+# Jobs are persisted in SQLite so any gunicorn worker can pick them up and
+# queued work survives restarts. Each worker process runs JOB_WORKERS threads.
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_POLL_INTERVAL = 2.0
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', '600'))
+JOB_HEARTBEAT_INTERVAL = JOB_STALE_SECONDS / 4
+JOB_MAX_ATTEMPTS = 2
+
+JOB_HANDLERS = {
+    'analyze': run_analysis_pipeline
+}
+
+_job_wakeup = threading.Event()
+_job_workers_lock = threading.Lock()
+_job_workers_pid = None
+
+
+def init_job_store() -> None:
+    """Create the jobs table"""
+    with closing(_connect_sqlite(JOBS_DB_FILE)) as con:
+        con.executescript("""
+        CREATE TABLE IF NOT EXISTS jobs(
+            id TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            stage TEXT,
+            progress REAL DEFAULT 0,
+            payload TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            attempts INTEGER DEFAULT 0,
+            heartbeat REAL,
+            claim TEXT,
+            created_at TEXT,
+            updated_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at);
+        """)
+        columns = {row['name'] for row in con.execute("PRAGMA table_info(jobs)")}
+        if 'claim' not in columns:
+            con.execute("ALTER TABLE jobs ADD COLUMN claim TEXT")
+        con.commit()
+
+
+def submit_job(job_type: str, payload) -> str:
+    """Queue a job and wake a worker; returns the job id"""
+    job_id = uuid.uuid4().hex
+    now = datetime.now().isoformat()
+    with closing(_connect_sqlite(JOBS_DB_FILE)) as con:
+        with con:
+            con.execute(
+                "INSERT INTO jobs(id, type, status, stage, progress, payload, created_at, updated_at) "
+                "VALUES(?, ?, 'queued', 'queued', 0, ?, ?, ?)",
+                (job_id, job_type, json.dumps(payload), now, now)
+            )
+    ensure_job_workers()
+    _job_wakeup.set()
+    return job_id
+
+
+def get_job(job_id):
+    """Return a job's public status dict, or None"""
+    ensure_job_workers()
+    with closing(_connect_sqlite(JOBS_DB_FILE)) as con:
+        row = con.execute(
+            "SELECT id, type, status, stage, progress, result, error, created_at, updated_at "
+            "FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    if not row:
+        return None
+
+    job = dict(row)
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+def update_job_progress(job_id: str, claim: str, stage: str, progress: float) -> bool:
+    """Record the current stage and refresh the heartbeat; False if the claim was lost"""
+    with closing(_connect_sqlite(JOBS_DB_FILE)) as con:
+        with con:
+            cur = con.execute(
+                "UPDATE jobs SET stage = ?, progress = ?, heartbeat = ?, updated_at = ? "
+                "WHERE id = ? AND claim = ?",
+                (stage, progress, time.time(), datetime.now().isoformat(), job_id, claim)
+            )
+    return cur.rowcount > 0
 
-    cost_table = Table(quote_data, colWidths=[2.5 * inch, 0.7 * inch, 1 * inch, 1 * inch, 1.3 * inch])
-    cost_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#556B2F')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('GRID', (0, 0), (-1, -4), 0.5, colors.grey),
-        ('BACKGROUND', (3, -1), (-1, -1), colors.HexColor('#556B2F')),
-        ('TEXTCOLOR', (3, -1), (-1, -1), colors.white),
-        ('FONTNAME', (3, -1), (-1, -1), 'Helvetica-Bold')
-    ]))
-    elements.append(Paragraph('<b>Investment Summary</b>', styles['Heading3']))
-    elements.append(cost_table)
 
-    elements.append(Spacer(1, 0.3 * inch))
-    elements.append(Paragraph(
-        "Annotated floor plan reference: <b>{}</b>".format(annotated_pdf_path),
-        styles['Normal']
-    ))
+def _touch_job(job_id: str, claim: str) -> bool:
+    """Refresh the heartbeat of a job we still hold; False if the claim was lost"""
+    with closing(_connect_sqlite(JOBS_DB_FILE)) as con:
+        with con:
+            cur = con.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND claim = ?",
+                              (time.time(), job_id, claim))
+    return cur.rowcount > 0
 
-    doc.build(elements)
 
-# ============================================================================
-# SIMPRO API INTEGRATION
-# ============================================================================
+def _finish_job(job_id: str, claim: str, status: str, result=None, error=None) -> bool:
+    """Store the outcome under our claim; a worker that lost the claim changes nothing"""
+    with closing(_connect_sqlite(JOBS_DB_FILE)) as con:
+        with con:
+            cur = con.execute(
+                "UPDATE jobs SET status = ?, stage = ?, progress = COALESCE(?, progress), result = ?, "
+                "error = ?, claim = NULL, updated_at = ? WHERE id = ? AND claim = ?",
+                (status, status, 1.0 if result is not None else None,
+                 json.dumps(result) if result is not None else None, error,
+                 datetime.now().isoformat(), job_id, claim)
+            )
+    return cur.rowcount > 0
 
-def make_simpro_request(endpoint, method='GET', data=None, params=None):
-    """Make authenticated request to Simpro API"""
-    config = load_simpro_config()
-    
-    if not config.get('connected') or not config.get('access_token'):
-        return {'error': 'Not connected to Simpro'}
-    
-    headers = {
-        'Authorization': f"Bearer {config['access_token']}",
-        'Content-Type': 'application/json'
-    }
-    
-    url = f"{config['base_url']}/api/v1.0/companies/{config['company_id']}{endpoint}"
-    
+
+def _claim_next_job():
+    """Atomically move the oldest queued job to running; returns it with its claim token"""
+    claim = uuid.uuid4().hex
+    with closing(_connect_sqlite(JOBS_DB_FILE)) as con:
+        con.execute("BEGIN IMMEDIATE")
+
+        # Jobs whose worker died stop heartbeating; retry or fail them. Clearing
+        # the claim fences off the old worker in case it is only slow.
+        stale_before = time.time() - JOB_STALE_SECONDS
+        con.execute(
+            "UPDATE jobs SET status = 'failed', stage = 'failed', error = 'Worker stopped responding', "
+            "claim = NULL WHERE status = 'running' AND heartbeat < ? AND attempts >= ?",
+            (stale_before, JOB_MAX_ATTEMPTS)
+        )
+        con.execute(
+            "UPDATE jobs SET status = 'queued', stage = 'queued', claim = NULL "
+            "WHERE status = 'running' AND heartbeat < ?",
+            (stale_before,)
+        )
+
+        row = con.execute(
+            "SELECT id, type, payload FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+        ).fetchone()
+        if row:
+            con.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, claim = ?, heartbeat = ?, "
+                "updated_at = ? WHERE id = ?",
+                (claim, time.time(), datetime.now().isoformat(), row['id'])
+            )
+            row = {**dict(row), 'claim': claim}
+        con.commit()
+    return row
+
+
+def _job_heartbeat(job_id: str, claim: str, stop: threading.Event) -> None:
+    """Keep a running job's heartbeat fresh until stopped or the claim is lost"""
+    while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+        try:
+            if not _touch_job(job_id, claim):
+                return
+        except sqlite3.Error as exc:
+            print(f"⚠️  Job heartbeat error: {exc}")
+
+
+def _run_job(row) -> None:
+    """Run a claimed job's handler and record its outcome"""
+    job_id, claim = row['id'], row['claim']
+    print(f"🔄 Running job {job_id} ({row['type']})")
+
+    # A single stage can outlast JOB_STALE_SECONDS, so beat from a side thread
+    stop = threading.Event()
+    threading.Thread(target=_job_heartbeat, args=(job_id, claim, stop),
+                     name=f'job-heartbeat-{job_id}', daemon=True).start()
     try:
-        if method == 'GET':
-            response = requests.get(url, headers=headers, params=params, timeout=30)
-        elif method == 'POST':
-            response = requests.post(url, headers=headers, json=data, timeout=30)
-        elif method == 'PUT':
-            response = requests.put(url, headers=headers, json=data, timeout=30)
-        else:
-            return {'error': f'Unsupported method: {method}'}
-        
-        response.raise_for_status()
-        
-        # Try to parse JSON, handle cases where response might not be JSON
+        handler = JOB_HANDLERS[row['type']]
+        result = handler(
+            json.loads(row['payload']),
+            lambda stage, progress: update_job_progress(job_id, claim, stage, progress)
+        )
+        finished = _finish_job(job_id, claim, 'completed', result=result)
+        print(f"✅ Job {job_id} completed" if finished else f"⚠️  Job {job_id} was reclaimed, result dropped")
+    except Exception as e:
+        print(f"❌ Job {job_id} failed: {str(e)}")
+        traceback.print_exc()
+        _finish_job(job_id, claim, 'failed', error=str(e) or type(e).__name__)
+    finally:
+        stop.set()
+
+
+def _job_worker_loop() -> None:
+    while True:
         try:
-            return response.json()
-        except ValueError:
-            return {'error': 'Invalid JSON response from Simpro', 'status_code': response.status_code, 'text': response.text[:200]}
-    
-    except requests.exceptions.RequestException as e:
-        print(f"Simpro API error: {str(e)}")
-        # Try to get more details from the response
-        error_msg = str(e)
-        if hasattr(e, 'response') and e.response is not None:
-            try:
-                error_details = e.response.json()
-                error_msg = f"{error_msg}: {error_details}"
-            except:
-                error_msg = f"{error_msg} (Status: {e.response.status_code})"
-        return {'error': error_msg}
+            row = _claim_next_job()
+        except sqlite3.Error as exc:
+            print(f"⚠️  Job queue error: {exc}")
+            row = None
+
+        if not row:
+            _job_wakeup.wait(JOB_POLL_INTERVAL)
+            _job_wakeup.clear()
+            continue
+
+        _run_job(row)
+
+
+def ensure_job_workers() -> None:
+    """Start this process's worker threads (again after a fork)"""
+    global _job_workers_pid
+    if _job_workers_pid == os.getpid():
+        return
+    with _job_workers_lock:
+        if _job_workers_pid == os.getpid():
+            return
+        for i in range(JOB_WORKERS):
+            threading.Thread(target=_job_worker_loop, name=f'job-worker-{i}', daemon=True).start()
+        _job_workers_pid = os.getpid()
+
+
+init_job_store()
+# gunicorn imports the app in every worker process, so each one starts its
+# own threads here and picks up jobs left queued or running by a restart.
+# Render pool processes import this module too and must not start any.
+if multiprocessing.parent_process() is None:
+    ensure_job_workers()
 
 # ============================================================================
 # FLASK ROUTES
@@ -1148,76 +3804,61 @@ def analyze():
         if not automation_types:
             return jsonify({'success': False, 'error': 'No automation types selected'}), 400
         
+        stream = file.stream
+        if isinstance(stream, HashingUploadStream) and not stream.is_pdf:
+            return jsonify({'success': False, 'error': 'Uploaded file is not a PDF'}), 400
+
+        # Uploads are stored by content hash, so re-uploading a plan reuses the file
         filename = secure_filename(file.filename)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], f'{timestamp}_{filename}')
-        file.save(input_path)
-        
-        # Use AI analysis (or fallback)
-        automation_data = load_data()
-        analysis = analyze_floorplan_with_ai(input_path)
-        
-        # Use AI-powered placement (with fallback to intelligent placement)
-        placements = place_symbols_with_ai(analysis, automation_types, tier)
-        
-        # Store analysis result and placements in learning index
-        learning_index = load_learning_index()
-        learning_index['examples'].append({
+        if isinstance(stream, HashingUploadStream):
+            stored_name = f'{stream.sha256}.pdf'
+        else:
+            stored_name = f'{timestamp}_{filename}'
+        input_path = os.path.join(app.config['UPLOAD_FOLDER'], stored_name)
+        pdf_hash, is_new = save_upload(file, input_path)
+        if not is_new:
+            print(f"♻️  Duplicate upload {filename}, reusing {input_path}")
+
+        payload = {
             'timestamp': timestamp,
             'project_name': project_name,
             'automation_types': automation_types,
             'tier': tier,
-            'pdf_path': input_path,
-            'placements': placements,
-            'analysis_result': {
-                'rooms': len(analysis['rooms']),
-                'doors': len(analysis['doors']),
-                'windows': len(analysis['windows']),
-                'method': analysis.get('method', 'unknown'),
-                'ai_notes': analysis.get('ai_notes', '')
-            }
-        })
-        save_learning_index(learning_index)
-        
-        # Create annotated PDF immediately
-        annotated_pdf_path = os.path.join(app.config['OUTPUT_FOLDER'], f'{timestamp}_annotated.pdf')
-        create_annotated_pdf(input_path, placements, automation_data, annotated_pdf_path)
-        
-        # Calculate costs
-        costs = calculate_costs(placements, automation_data, tier)
-        
-        # Generate quote PDF
-        quote_pdf_path = os.path.join(app.config['OUTPUT_FOLDER'], f'{timestamp}_quote.pdf')
-        generate_quote_pdf(costs, automation_data, project_name, tier, quote_pdf_path)
-        
-        # Generate floor plan preview image
-        preview_image_path = f'/api/floor-plan-image/{timestamp}'
-        
-        # Return BOTH files AND editor link
+            'input_path': input_path,
+            'original_filename': filename,
+            'pdf_hash': pdf_hash
+        }
+
+        # Scripts can still ask for the old blocking behaviour with async=false
+        if request.form.get('async', 'true').lower() in ('0', 'false', 'no'):
+            result = run_analysis_pipeline(payload, lambda stage, progress: None)
+            return jsonify({'success': True, **result})
+
+        job_id = submit_job('analyze', payload)
         return jsonify({
             'success': True,
-            'project_id': timestamp,
-            'editor_url': f'/editor/{timestamp}',
-            'analysis': {
-                'rooms_detected': len(analysis['rooms']),
-                'doors_detected': len(analysis['doors']),
-                'windows_detected': len(analysis['windows']),
-                'method': analysis.get('method', 'unknown'),
-                'ai_notes': analysis.get('ai_notes', '')
-            },
-            'costs': costs,
-            'files': {
-                'annotated_pdf': f'/download/{os.path.basename(annotated_pdf_path)}',
-                'quote_pdf': f'/download/{os.path.basename(quote_pdf_path)}',
-                'floor_plan_preview': preview_image_path
-            }
-        })
-    
+            'job_id': job_id,
+            'status_url': f'/api/jobs/{job_id}'
+        }), 202
+
     except Exception as e:
         print(f"Error: {str(e)}")
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """Report stage-by-stage progress and the final result of a background job"""
+    try:
+        job = get_job(job_id)
+        if not job:
+            return jsonify({'success': False, 'error': 'Job not found'}), 404
+        return jsonify({'success': True, 'job': job})
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/upload-learning-data', methods=['POST'])
 def upload_learning_data():
     """Upload training data for learning system"""
@@ -1230,38 +3871,49 @@ def upload_learning_data():
         os.makedirs(batch_folder, exist_ok=True)
         
         saved_files = []
+        file_hashes = {}
+        skipped = []
         for file in files:
             if file:
                 filename = secure_filename(file.filename)
+                stream = file.stream
+                if isinstance(stream, HashingUploadStream):
+                    # Drop corrupt PDFs and repeats of a file already in this batch
+                    if stream.expect_pdf and not stream.is_pdf:
+                        skipped.append(filename)
+                        continue
+                    if stream.sha256 in file_hashes.values():
+                        skipped.append(filename)
+                        continue
                 filepath = os.path.join(batch_folder, filename)
-                file.save(filepath)
+                file_hashes[filename], _ = save_upload(file, filepath)
                 saved_files.append(filename)
         
         metadata = {
             'timestamp': timestamp,
             'files': saved_files,
+            'sha256': file_hashes,
+            'skipped': skipped,
             'notes': notes,
             'uploaded_at': datetime.now().isoformat()
         }
         
-        with open(os.path.join(batch_folder, 'metadata.json'), 'w') as f:
-            json.dump(metadata, f, indent=2)
+        write_json_atomic(os.path.join(batch_folder, 'metadata.json'), metadata)
         
-        # Add to learning index
-        learning_index = load_learning_index()
-        learning_index['examples'].append({
+        # Add to learning store
+        add_learning_example({
             'timestamp': timestamp,
             'batch_folder': batch_folder,
             'files': saved_files,
             'notes': notes,
             'type': 'training_data'
         })
-        save_learning_index(learning_index)
         
         return jsonify({
             'success': True,
             'message': f'Uploaded {len(saved_files)} files - System will use this data in future analysis',
-            'batch_id': timestamp
+            'batch_id': timestamp,
+            'skipped': skipped
         })
     
     except Exception as e:
@@ -1275,15 +3927,13 @@ def process_instructions():
         
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         
-        # Add to learning index
-        learning_index = load_learning_index()
-        learning_index['examples'].append({
+        # Add to learning store
+        add_learning_example({
             'timestamp': timestamp,
             'instructions': instructions,
             'type': 'user_instruction',
             'created_at': datetime.now().isoformat()
         })
-        save_learning_index(learning_index)
         
         return jsonify({
             'success': True,
@@ -1307,16 +3957,14 @@ def placement_feedback():
         if not feedback:
             return jsonify({'success': False, 'error': 'No feedback provided'}), 400
         
-        # Add to learning index
-        learning_index = load_learning_index()
-        learning_index['examples'].append({
+        # Add to learning store
+        add_learning_example({
             'timestamp': timestamp,
             'project_name': project_name,
             'placement_feedback': feedback,
             'type': 'placement_feedback',
             'created_at': datetime.now().isoformat()
         })
-        save_learning_index(learning_index)
         
         return jsonify({
             'success': True,
@@ -1337,29 +3985,30 @@ def download(filename):
 
 @app.route('/api/health')
 def health():
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'analysis_cache': dict(ANALYSIS_CACHE_STATS)
+    })
 
 @app.route('/api/update-pricing', methods=['POST'])
 def update_pricing():
     """Update pricing configuration"""
     try:
         new_data = request.json
-        current_data = load_data()
-        
-        if 'labor_rate' in new_data:
-            current_data['labor_rate'] = new_data['labor_rate']
-        if 'markup_percentage' in new_data:
-            current_data['markup_percentage'] = new_data['markup_percentage']
-        
-        if 'automation_types' in new_data:
-            for auto_type, config in new_data['automation_types'].items():
-                if auto_type in current_data['automation_types']:
-                    if 'base_cost_per_unit' in config:
-                        current_data['automation_types'][auto_type]['base_cost_per_unit'].update(
-                            config['base_cost_per_unit']
-                        )
-        
-        save_data(current_data)
+        with update_data() as current_data:
+            if 'labor_rate' in new_data:
+                current_data['labor_rate'] = new_data['labor_rate']
+            if 'markup_percentage' in new_data:
+                current_data['markup_percentage'] = new_data['markup_percentage']
+
+            if 'automation_types' in new_data:
+                for auto_type, config in new_data['automation_types'].items():
+                    if auto_type in current_data['automation_types']:
+                        if 'base_cost_per_unit' in config:
+                            current_data['automation_types'][auto_type]['base_cost_per_unit'].update(
+                                config['base_cost_per_unit']
+                            )
         
         return jsonify({
             'success': True,
@@ -1389,15 +4038,13 @@ def simpro_config():
     else:  # POST
         try:
             data = request.json
-            config = load_simpro_config()
-            
-            config['base_url'] = data.get('base_url', '').rstrip('/')
-            config['company_id'] = data.get('company_id', '0')
-            config['client_id'] = data.get('client_id', '')
-            config['client_secret'] = data.get('client_secret', '')
-            config['connected'] = False  # Will be set to True after successful auth
-            
-            save_simpro_config(config)
+            with update_simpro_config() as config:
+                config['base_url'] = data.get('base_url', '').rstrip('/')
+                config['company_id'] = data.get('company_id', '0')
+                config['client_id'] = data.get('client_id', '')
+                config['client_secret'] = data.get('client_secret', '')
+                config['connected'] = False  # Will be set to True after successful auth
+                config['access_token'] = config['token_expires_at'] = None
             
             return jsonify({'success': True, 'message': 'Configuration saved'})
         except Exception as e:
@@ -1407,28 +4054,8 @@ def simpro_config():
 def simpro_connect():
     """Test connection and get access token"""
     try:
-        config = load_simpro_config()
-        
-        # OAuth2 token request
-        token_url = f"{config['base_url']}/oauth2/token"
-        
-        data = {
-            'grant_type': 'client_credentials',
-            'client_id': config['client_id'],
-            'client_secret': config['client_secret']
-        }
-        
-        response = requests.post(token_url, data=data, timeout=30)
-        response.raise_for_status()
-        
-        token_data = response.json()
-        
-        config['access_token'] = token_data.get('access_token')
-        config['refresh_token'] = token_data.get('refresh_token')
-        config['token_expires_at'] = datetime.now().timestamp() + token_data.get('expires_in', 3600)
-        config['connected'] = True
-        
-        save_simpro_config(config)
+        # Always ask Simpro for a new token so the credentials are really tested
+        get_simpro_token(force_refresh=True)
         
         return jsonify({'success': True, 'message': 'Successfully connected to Simpro'})
     
@@ -1440,18 +4067,7 @@ def simpro_connect():
 def simpro_catalogs():
     """Fetch catalog items from Simpro"""
     try:
-        params = {
-            'pageSize': request.args.get('pageSize', 100),
-            'page': request.args.get('page', 1)
-        }
-        
-        result = make_simpro_request('/catalogs/', params=params)
-        
-        if 'error' in result:
-            return jsonify({'success': False, 'error': result['error']}), 400
-        
-        return jsonify({'success': True, 'data': result})
-    
+        return serve_simpro_resource('catalogs', default_page_size=100)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -1459,13 +4075,7 @@ def simpro_catalogs():
 def simpro_labor_rates():
     """Fetch labor rates from Simpro"""
     try:
-        result = make_simpro_request('/laborRates/')
-        
-        if 'error' in result:
-            return jsonify({'success': False, 'error': result['error']}), 400
-        
-        return jsonify({'success': True, 'data': result})
-    
+        return serve_simpro_resource('labor-rates')
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -1473,18 +4083,7 @@ def simpro_labor_rates():
 def simpro_jobs():
     """Fetch jobs from Simpro"""
     try:
-        params = {
-            'pageSize': request.args.get('pageSize', 50),
-            'page': request.args.get('page', 1)
-        }
-        
-        result = make_simpro_request('/jobs/', params=params)
-        
-        if 'error' in result:
-            return jsonify({'success': False, 'error': result['error']}), 400
-        
-        return jsonify({'success': True, 'data': result})
-    
+        return serve_simpro_resource('jobs', default_page_size=50)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -1492,18 +4091,7 @@ def simpro_jobs():
 def simpro_customers():
     """Fetch customers from Simpro"""
     try:
-        params = {
-            'pageSize': request.args.get('pageSize', 50),
-            'page': request.args.get('page', 1)
-        }
-        
-        result = make_simpro_request('/customers/', params=params)
-        
-        if 'error' in result:
-            return jsonify({'success': False, 'error': result['error']}), 400
-        
-        return jsonify({'success': True, 'data': result})
-    
+        return serve_simpro_resource('customers', default_page_size=50)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -1512,18 +4100,7 @@ def simpro_quotes():
     """Get or create quotes in Simpro"""
     if request.method == 'GET':
         try:
-            params = {
-                'pageSize': request.args.get('pageSize', 50),
-                'page': request.args.get('page', 1)
-            }
-            
-            result = make_simpro_request('/quotes/', params=params)
-            
-            if 'error' in result:
-                return jsonify({'success': False, 'error': result['error']}), 400
-            
-            return jsonify({'success': True, 'data': result})
-        
+            return serve_simpro_resource('quotes', default_page_size=50)
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
     
@@ -1535,11 +4112,67 @@ def simpro_quotes():
             if 'error' in result:
                 return jsonify({'success': False, 'error': result['error']}), 400
             
+            invalidate_simpro_mirror('quotes')
             return jsonify({'success': True, 'message': 'Quote created in Simpro', 'data': result})
         
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/simpro/quotes/batch', methods=['POST'])
+def simpro_quotes_batch():
+    """Create several quotes with line items in Simpro.
+
+    Body: {"cost_center": <Simpro setup cost center ID>, "quotes": [{"customer_id",
+    "project_id" or "costs", optional "name", "site_id", "idempotency_key"}]}.
+    Safe to resend: each quote reports created, duplicate, in_progress or failed.
+    """
+    try:
+        data = request.json or {}
+        quotes = data.get('quotes')
+        if not isinstance(quotes, list) or not quotes:
+            return jsonify({'success': False, 'error': 'quotes must be a non-empty list'}), 400
+        if not all(isinstance(quote, dict) and quote.get('customer_id') for quote in quotes):
+            return jsonify({'success': False, 'error': 'Every quote needs a customer_id'}), 400
+        cost_center = data.get('cost_center') or SIMPRO_QUOTE_COST_CENTER
+        if not cost_center:
+            return jsonify({'success': False, 'error': 'cost_center (or SIMPRO_QUOTE_COST_CENTER) is required'}), 400
+        if not get_simpro_config().get('connected'):
+            return jsonify({'success': False, 'error': 'Not connected to Simpro'}), 400
+
+        results = push_simpro_quotes(quotes, cost_center)
+        summary = {}
+        for result in results:
+            summary[result['status']] = summary.get(result['status'], 0) + 1
+        print(f"📤 Simpro quote batch: {summary}")
+        return jsonify({'success': True, 'results': results, 'summary': summary})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/simpro/sync', methods=['GET'])
+def simpro_sync_status():
+    """Freshness of every mirrored Simpro resource"""
+    try:
+        return jsonify({'success': True, 'resources': {
+            resource: simpro_freshness(get_simpro_sync_state(resource), 'mirror', False)
+            for resource in SIMPRO_RESOURCES
+        }})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/simpro/sync/<resource>', methods=['POST'])
+def simpro_sync_now(resource):
+    """Sync one resource now; ?full=1 re-reads everything and drops deleted records"""
+    try:
+        if resource not in SIMPRO_RESOURCES:
+            return jsonify({'success': False, 'error': f'Unknown Simpro resource: {resource}'}), 404
+        if not _claim_simpro_sync(resource, ignore_backoff=True):
+            return jsonify({'success': False, 'error': f'{resource} is already syncing'}), 409
+        result = sync_simpro_resource(resource, full=bool(request.args.get('full')))
+        return jsonify({'success': True, **result,
+                        'freshness': simpro_freshness(get_simpro_sync_state(resource), 'mirror', False)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # ============================================================================
 # INTERACTIVE EDITOR ROUTES
 # ============================================================================
@@ -1549,14 +4182,7 @@ def editor(project_id):
     """Interactive floor plan editor"""
     try:
         # Load project data
-        learning_index = load_learning_index()
-        project = None
-        
-        for example in learning_index.get('examples', []):
-            if example.get('timestamp') == project_id:
-                project = example
-                break
-        
+        project = get_project(project_id)
         if not project:
             return "Project not found", 404
         
@@ -1572,14 +4198,15 @@ def editor(project_id):
                     'symbol': get_symbol_for_type(auto_type),
                     'x': pos_data['position'][0],
                     'y': pos_data['position'][1],
+                    'page': pos_data.get('page', 0),
                     'id': len(symbols)
                 })
         
-        # Load floor plan image (base64)
+        # Floor plan is streamed to the editor as tiles
         pdf_path = project.get('pdf_path', '')
-        floor_plan_image = ''
+        floor_plan_tiles = ''
         if pdf_path and os.path.exists(pdf_path):
-            floor_plan_image = '/api/floor-plan-image/' + project_id
+            floor_plan_tiles = f'/api/floor-plan-tiles/{project_id}/info'
         
         # Load pricing config
         automation_data = load_data()
@@ -1592,7 +4219,8 @@ def editor(project_id):
             project_name=project.get('project_name', 'Unnamed Project'),
             tier=project.get('tier', 'basic'),
             initial_symbols=symbols,
-            floor_plan_image=floor_plan_image,
+            floor_plan_tiles=floor_plan_tiles,
+            page_count=project.get('page_count', 1),
             pricing=pricing_dict
         )
     
@@ -1601,37 +4229,113 @@ def editor(project_id):
         traceback.print_exc()
         return f"Error loading editor: {str(e)}", 500
 
+def _load_project_pdf(project_id):
+    """Return (pdf_path, pdf_hash) for a project, or None if it is missing"""
+    project = get_project(project_id)
+    if not project:
+        return None
+
+    pdf_path = project.get('pdf_path', '')
+    if not pdf_path or not os.path.exists(pdf_path):
+        return None
+
+    return pdf_path, project.get('pdf_hash') or file_sha256(pdf_path)
+
+def _requested_page(pdf_path, pdf_hash):
+    """The ?page= index if the PDF has that page, else None"""
+    page_num = request.args.get('page', 0, type=int)
+    if 0 <= page_num < get_page_count(pdf_path, pdf_hash):
+        return page_num
+    return None
+
 @app.route('/api/floor-plan-image/<project_id>')
 def floor_plan_image(project_id):
     """Serve floor plan image for editor"""
     try:
-        learning_index = load_learning_index()
-        project = None
-        
-        for example in learning_index.get('examples', []):
-            if example.get('timestamp') == project_id:
-                project = example
-                break
-        
-        if not project:
-            return "Project not found", 404
-        
-        pdf_path = project.get('pdf_path', '')
-        if not pdf_path or not os.path.exists(pdf_path):
+        project_pdf = _load_project_pdf(project_id)
+        if not project_pdf:
             return "Floor plan not found", 404
-        
-        # Convert PDF to PNG
-        image_base64 = pdf_to_image_base64(pdf_path)
-        import base64
-        image_bytes = base64.b64decode(image_base64)
-        
-        from io import BytesIO
-        return send_file(BytesIO(image_bytes), mimetype='image/png')
+
+        # Serve the cached PNG; the ETag is derived from the PDF content
+        pdf_path, pdf_hash = project_pdf
+        page_num = _requested_page(pdf_path, pdf_hash)
+        if page_num is None:
+            return "Page out of range", 404
+        image_path = render_page_png(pdf_path, page_num, RENDER_ZOOM, pdf_hash)
+        return send_file(
+            image_path,
+            mimetype='image/png',
+            etag=f'{pdf_hash}-p{page_num}-z{RENDER_ZOOM:g}',
+            max_age=IMAGE_CACHE_MAX_AGE,
+            conditional=True
+        )
     
     except Exception as e:
         print(f"Floor plan image error: {str(e)}")
         return f"Error: {str(e)}", 500
 
+@app.route('/api/floor-plan-tiles/<project_id>/info')
+def floor_plan_tiles_info(project_id):
+    """Describe the tile pyramid so the editor can pan/zoom without the full raster"""
+    try:
+        project_pdf = _load_project_pdf(project_id)
+        if not project_pdf:
+            return jsonify({'success': False, 'error': 'Floor plan not found'}), 404
+
+        pdf_path, pdf_hash = project_pdf
+        page_num = _requested_page(pdf_path, pdf_hash)
+        if page_num is None:
+            return jsonify({'success': False, 'error': 'Page out of range'}), 404
+        width, height = get_page_size(pdf_path, page_num, pdf_hash)
+
+        return jsonify({
+            'success': True,
+            'page': page_num,
+            'page_width': width,
+            'page_height': height,
+            'world_scale': RENDER_ZOOM,
+            'tile_size': TILE_SIZE,
+            'base_scale': TILE_BASE_SCALE,
+            'min_zoom': TILE_MIN_ZOOM,
+            'max_zoom': TILE_MAX_ZOOM,
+            'url_template': f'/api/floor-plan-tiles/{project_id}/{{z}}/{{x}}/{{y}}.png?page={page_num}'
+        })
+
+    except Exception as e:
+        print(f"Floor plan tiles info error: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/floor-plan-tiles/<project_id>/<int:z>/<int:x>/<int:y>.png')
+def floor_plan_tile(project_id, z, x, y):
+    """Serve a single cached floor plan tile"""
+    try:
+        if z < TILE_MIN_ZOOM or z > TILE_MAX_ZOOM:
+            return "Zoom level out of range", 404
+
+        project_pdf = _load_project_pdf(project_id)
+        if not project_pdf:
+            return "Floor plan not found", 404
+
+        pdf_path, pdf_hash = project_pdf
+        page_num = _requested_page(pdf_path, pdf_hash)
+        if page_num is None:
+            return "Page out of range", 404
+        tile_path = render_page_tile(pdf_path, page_num, z, x, y, pdf_hash)
+        if not tile_path:
+            return "Tile out of range", 404
+
+        return send_file(
+            tile_path,
+            mimetype='image/png',
+            etag=f'{pdf_hash}-p{page_num}-t{z}-{x}-{y}',
+            max_age=IMAGE_CACHE_MAX_AGE,
+            conditional=True
+        )
+
+    except Exception as e:
+        print(f"Floor plan tile error: {str(e)}")
+        return f"Error: {str(e)}", 500
+
 @app.route('/api/generate-final-quote', methods=['POST'])
 def generate_final_quote():
     """Generate final PDF with user-edited symbol placement"""
@@ -1643,14 +4347,7 @@ def generate_final_quote():
         tier = data.get('tier', 'basic')
         
         # Find original project
-        learning_index = load_learning_index()
-        project = None
-        
-        for example in learning_index.get('examples', []):
-            if example.get('timestamp') == project_id:
-                project = example
-                break
-        
+        project = get_project(project_id)
         if not project:
             return jsonify({'success': False, 'error': 'Project not found'}), 404
         
@@ -1670,6 +4367,7 @@ def generate_final_quote():
             if auto_type in placements:
                 placements[auto_type].append({
                     'position': (sym['x'], sym['y']),
+                    'page': sym.get('page', 0),
                     'quantity': 1,
                     'confidence': 1.0,
                     'user_placed': True
@@ -1717,9 +4415,6 @@ def upload_placement_knowledge():
         feedback = data.get('feedback', '')
         tier = data.get('tier', 'basic')
         
-        # Save to learning index
-        learning_index = load_learning_index()
-        
         # Convert symbols to placement format
         placement_summary = {}
         for sym in symbols:
@@ -1728,7 +4423,8 @@ def upload_placement_knowledge():
                 placement_summary[auto_type] = 0
             placement_summary[auto_type] += 1
         
-        learning_index['examples'].append({
+        # Save to learning store
+        add_learning_example({
             'timestamp': datetime.now().strftime('%Y%m%d_%H%M%S'),
             'project_id': project_id,
             'project_name': project_name,
@@ -1739,9 +4435,7 @@ def upload_placement_knowledge():
             'tier': tier,
             'created_at': datetime.now().isoformat()
         })
-        
-        save_learning_index(learning_index)
-        
+
         print(f"✅ Knowledge uploaded: {feedback}")
         print(f"   Placement: {placement_summary}")
         
@@ -1787,20 +4481,15 @@ def ai_chat():
         api_key = os.environ.get('ANTHROPIC_API_KEY')
         if not api_key:
             return jsonify({'success': False, 'error': 'API key not configured'}), 500
+        if not ANTHROPIC_AVAILABLE:
+            return jsonify({'success': False, 'error': 'anthropic package not installed'}), 500
         
         # Load project context if available
         context_info = ""
         current_data = {}
         
         if project_id:
-            learning_index = load_learning_index()
-            project = None
-            
-            for example in learning_index.get('examples', []):
-                if example.get('timestamp') == project_id:
-                    project = example
-                    break
-            
+            project = get_project(project_id)
             if project:
                 current_data = {
                     'project_name': project.get('project_name', 'Unknown'),
@@ -1934,11 +4623,10 @@ Be helpful, concise, and professional. Use emojis sparingly for clarity.
         })
         
         # Call Claude API
-        from anthropic import Anthropic
-        client = Anthropic(api_key=api_key)
+        client = get_model_client()
         
         response_params = {
-            "model": "claude-sonnet-4-20250514",
+            "model": MODEL_NAME,
             "max_tokens": 2000,
             "system": system_prompt,
             "messages": messages
@@ -1990,17 +4678,8 @@ Be helpful, concise, and professional. Use emojis sparingly for clarity.
 def execute_agent_action(project_id, tool_name, tool_input, current_data):
     """Execute an agentic action on the floor plan"""
     try:
-        learning_index = load_learning_index()
-        project = None
-        project_index = None
-        
         # Find the project
-        for idx, example in enumerate(learning_index.get('examples', [])):
-            if example.get('timestamp') == project_id:
-                project = example
-                project_index = idx
-                break
-        
+        project = get_project(project_id)
         if not project:
             return {'success': False, 'action': tool_name, 'error': 'Project not found'}
         
@@ -2033,8 +4712,7 @@ def execute_agent_action(project_id, tool_name, tool_input, current_data):
                 })
             
             # Save updated project
-            learning_index['examples'][project_index] = project
-            save_learning_index(learning_index)
+            save_project(project)
             
             return {
                 'success': True,
@@ -2056,8 +4734,7 @@ def execute_agent_action(project_id, tool_name, tool_input, current_data):
                 project['placements'][symbol_type] = project['placements'][symbol_type][:-remove_count]
                 
                 # Save
-                learning_index['examples'][project_index] = project
-                save_learning_index(learning_index)
+                save_project(project)
                 
                 return {
                     'success': True,
@@ -2076,8 +4753,7 @@ def execute_agent_action(project_id, tool_name, tool_input, current_data):
             project['tier'] = new_tier
             
             # Save
-            learning_index['examples'][project_index] = project
-            save_learning_index(learning_index)
+            save_project(project)
             
             return {
                 'success': True,
@@ -2128,37 +4804,47 @@ def execute_agent_action(project_id, tool_name, tool_input, current_data):
 # CRM API ROUTES
 # ============================================================================
 
+def crm_list_response(collection, key, filters=None, search=None, with_total=False):
+    """GET handler shared by the CRM list endpoints.
+
+    Query parameters: limit, cursor (the previous page's next_cursor),
+    fields=a,b,c, sort=column or sort=-column and ids=a,b,c to fetch just
+    those records. Searches are ranked best match first unless a sort is given.
+    """
+    args = request.args
+    fields = [field for field in args.get('fields', '').split(',') if field] or None
+    ids = [record_id for record_id in args.get('ids', '').split(',') if record_id]
+    if len(ids) > CRM_MAX_PAGE_SIZE:
+        return jsonify({'success': False, 'error': f'At most {CRM_MAX_PAGE_SIZE} ids per request'}), 400
+    if ids:
+        filters = {**(filters or {}), 'id': ids}
+    limit = args.get('limit', type=int)
+    try:
+        records, next_cursor = crm_query(collection, filters, limit, args.get('cursor'),
+                                         args.get('sort'), fields, search)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    response = {'success': True, key: records, 'next_cursor': next_cursor}
+    if with_total:
+        response['total'] = len(records) if limit is None else crm_count(collection, filters, search)
+    return jsonify(response)
+
 @app.route('/api/crm/customers', methods=['GET', 'POST'])
 def handle_customers():
     try:
         if request.method == 'GET':
-            customers = load_json_file(CUSTOMERS_FILE, [])
-            search = request.args.get('search', '').lower()
-            if search:
-                customers = [c for c in customers if search in c.get('name', '').lower() or
-                            search in c.get('email', '').lower()]
-            return jsonify({'success': True, 'customers': customers, 'total': len(customers)})
+            return crm_list_response('customers', 'customers', search=request.args.get('search'),
+                                     with_total=True)
         else:
             data = request.json
             if not data.get('name'):
                 return jsonify({'success': False, 'error': 'Name required'}), 400
-            customers = load_json_file(CUSTOMERS_FILE, [])
-            customer = {
-                'id': str(uuid.uuid4()),
-                'name': data['name'],
-                'email': data.get('email', ''),
-                'phone': data.get('phone', ''),
-                'address': data.get('address', ''),
-                'company': data.get('company', ''),
-                'notes': data.get('notes', ''),
-                'created_at': datetime.now().isoformat(),
-                'updated_at': datetime.now().isoformat(),
-                'status': 'active',
-                'total_projects': 0,
-                'total_revenue': 0.0
-            }
-            customers.append(customer)
-            save_json_file(CUSTOMERS_FILE, customers)
+            # Status and totals are maintained by the CRM, not set by the caller
+            customer = crm_new_record('customers', data, timestamps=('created_at', 'updated_at'),
+                                      client_fields=('email', 'phone', 'address', 'company', 'notes'))
+            customer['name'] = data['name']
+            crm_insert('customers', customer)
             return jsonify({'success': True, 'customer': customer})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -2166,30 +4852,24 @@ def handle_customers():
 @app.route('/api/crm/customers/<customer_id>', methods=['GET', 'PUT', 'DELETE'])
 def handle_customer(customer_id):
     try:
-        customers = load_json_file(CUSTOMERS_FILE, [])
-        idx = next((i for i, c in enumerate(customers) if c['id'] == customer_id), None)
-        
         if request.method == 'GET':
-            if idx is None:
+            customer = crm_get('customers', customer_id)
+            if customer is None:
                 return jsonify({'success': False, 'error': 'Not found'}), 404
-            return jsonify({'success': True, 'customer': customers[idx]})
+            return jsonify({'success': True, 'customer': customer})
         
         elif request.method == 'PUT':
-            if idx is None:
-                return jsonify({'success': False, 'error': 'Not found'}), 404
             data = request.json
-            customer = customers[idx]
-            for field in ['name', 'email', 'phone', 'address', 'company', 'notes', 'status']:
-                if field in data:
-                    customer[field] = data[field]
-            customer['updated_at'] = datetime.now().isoformat()
-            customers[idx] = customer
-            save_json_file(CUSTOMERS_FILE, customers)
+            changes = {field: data[field] for field in ['name', 'email', 'phone', 'address', 'company', 'notes', 'status']
+                       if field in data}
+            changes['updated_at'] = datetime.now().isoformat()
+            customer = crm_update('customers', customer_id, changes)
+            if customer is None:
+                return jsonify({'success': False, 'error': 'Not found'}), 404
             return jsonify({'success': True, 'customer': customer})
         
         elif request.method == 'DELETE':
-            customers = [c for c in customers if c['id'] != customer_id]
-            save_json_file(CUSTOMERS_FILE, customers)
+            crm_delete('customers', customer_id)
             return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -2198,48 +4878,32 @@ def handle_customer(customer_id):
 def handle_projects():
     try:
         if request.method == 'GET':
-            projects = load_json_file(PROJECTS_FILE, [])
-            customer_id = request.args.get('customer_id')
-            if customer_id:
-                projects = [p for p in projects if p.get('customer_id') == customer_id]
-            return jsonify({'success': True, 'projects': projects})
+            return crm_list_response('projects', 'projects',
+                                     {'customer_id': request.args.get('customer_id') or None})
         else:
             data = request.json
-            projects = load_json_file(PROJECTS_FILE, [])
-            project = {
-                'id': str(uuid.uuid4()),
-                'customer_id': data.get('customer_id'),
-                'title': data.get('title', ''),
-                'description': data.get('description', ''),
-                'status': data.get('status', 'pending'),
-                'priority': data.get('priority', 'medium'),
-                'quote_amount': data.get('quote_amount', 0.0),
-                'actual_amount': data.get('actual_amount', 0.0),
-                'due_date': data.get('due_date'),
-                'created_at': datetime.now().isoformat(),
-                'updated_at': datetime.now().isoformat()
-            }
-            projects.append(project)
-            save_json_file(PROJECTS_FILE, projects)
+            project = crm_new_record('projects', data, timestamps=('created_at', 'updated_at'))
+            crm_insert('projects', project)
             return jsonify({'success': True, 'project': project})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/crm/projects/<project_id>', methods=['PUT'])
+@app.route('/api/crm/projects/<project_id>', methods=['GET', 'PUT'])
 def update_project(project_id):
     try:
-        projects = load_json_file(PROJECTS_FILE, [])
-        idx = next((i for i, p in enumerate(projects) if p['id'] == project_id), None)
-        if idx is None:
-            return jsonify({'success': False, 'error': 'Not found'}), 404
+        if request.method == 'GET':
+            project = crm_get('projects', project_id)
+            if project is None:
+                return jsonify({'success': False, 'error': 'Not found'}), 404
+            return jsonify({'success': True, 'project': project})
+
         data = request.json
-        project = projects[idx]
-        for field in ['title', 'description', 'status', 'priority', 'quote_amount', 'actual_amount', 'due_date']:
-            if field in data:
-                project[field] = data[field]
-        project['updated_at'] = datetime.now().isoformat()
-        projects[idx] = project
-        save_json_file(PROJECTS_FILE, projects)
+        changes = {field: data[field] for field in ['title', 'description', 'status', 'priority', 'quote_amount', 'actual_amount', 'due_date']
+                   if field in data}
+        changes['updated_at'] = datetime.now().isoformat()
+        project = crm_update('projects', project_id, changes)
+        if project is None:
+            return jsonify({'success': False, 'error': 'Not found'}), 404
         return jsonify({'success': True, 'project': project})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -2248,24 +4912,13 @@ def update_project(project_id):
 def handle_communications():
     try:
         if request.method == 'GET':
-            comms = load_json_file(COMMUNICATIONS_FILE, [])
-            customer_id = request.args.get('customer_id')
-            if customer_id:
-                comms = [c for c in comms if c.get('customer_id') == customer_id]
-            return jsonify({'success': True, 'communications': comms})
+            return crm_list_response('communications', 'communications',
+                                     {'customer_id': request.args.get('customer_id') or None},
+                                     search=request.args.get('search'))
         else:
             data = request.json
-            comms = load_json_file(COMMUNICATIONS_FILE, [])
-            comm = {
-                'id': str(uuid.uuid4()),
-                'customer_id': data.get('customer_id'),
-                'type': data.get('type', 'note'),
-                'subject': data.get('subject', ''),
-                'content': data.get('content', ''),
-                'created_at': datetime.now().isoformat()
-            }
-            comms.append(comm)
-            save_json_file(COMMUNICATIONS_FILE, comms)
+            comm = crm_new_record('communications', data)
+            crm_insert('communications', comm)
             return jsonify({'success': True, 'communication': comm})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -2274,22 +4927,11 @@ def handle_communications():
 def handle_calendar():
     try:
         if request.method == 'GET':
-            events = load_json_file(CALENDAR_FILE, [])
-            return jsonify({'success': True, 'events': events})
+            return crm_list_response('calendar', 'events')
         else:
             data = request.json
-            events = load_json_file(CALENDAR_FILE, [])
-            event = {
-                'id': str(uuid.uuid4()),
-                'title': data.get('title', ''),
-                'date': data.get('date', ''),
-                'time': data.get('time', ''),
-                'type': data.get('type', 'appointment'),
-                'status': data.get('status', 'scheduled'),
-                'created_at': datetime.now().isoformat()
-            }
-            events.append(event)
-            save_json_file(CALENDAR_FILE, events)
+            event = crm_new_record('calendar', data)
+            crm_insert('calendar', event)
             return jsonify({'success': True, 'event': event})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -2298,22 +4940,11 @@ def handle_calendar():
 def handle_technicians():
     try:
         if request.method == 'GET':
-            techs = load_json_file(TECHNICIANS_FILE, [])
-            return jsonify({'success': True, 'technicians': techs})
+            return crm_list_response('technicians', 'technicians')
         else:
             data = request.json
-            techs = load_json_file(TECHNICIANS_FILE, [])
-            tech = {
-                'id': str(uuid.uuid4()),
-                'name': data.get('name', ''),
-                'email': data.get('email', ''),
-                'phone': data.get('phone', ''),
-                'skills': data.get('skills', []),
-                'status': data.get('status', 'available'),
-                'created_at': datetime.now().isoformat()
-            }
-            techs.append(tech)
-            save_json_file(TECHNICIANS_FILE, techs)
+            tech = crm_new_record('technicians', data)
+            crm_insert('technicians', tech)
             return jsonify({'success': True, 'technician': tech})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -2322,23 +4953,11 @@ def handle_technicians():
 def handle_inventory():
     try:
         if request.method == 'GET':
-            inventory = load_json_file(INVENTORY_FILE, [])
-            return jsonify({'success': True, 'inventory': inventory})
+            return crm_list_response('inventory', 'inventory')
         else:
             data = request.json
-            inventory = load_json_file(INVENTORY_FILE, [])
-            item = {
-                'id': str(uuid.uuid4()),
-                'name': data.get('name', ''),
-                'sku': data.get('sku', ''),
-                'category': data.get('category', ''),
-                'quantity': data.get('quantity', 0),
-                'unit_cost': data.get('unit_cost', 0.0),
-                'reorder_level': data.get('reorder_level', 10),
-                'created_at': datetime.now().isoformat()
-            }
-            inventory.append(item)
-            save_json_file(INVENTORY_FILE, inventory)
+            item = crm_new_record('inventory', data)
+            crm_insert('inventory', item)
             return jsonify({'success': True, 'item': item})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -2347,25 +4966,114 @@ def handle_inventory():
 def handle_suppliers():
     try:
         if request.method == 'GET':
-            suppliers = load_json_file(SUPPLIERS_FILE, [])
-            return jsonify({'success': True, 'suppliers': suppliers})
+            return crm_list_response('suppliers', 'suppliers')
         else:
             data = request.json
-            suppliers = load_json_file(SUPPLIERS_FILE, [])
-            supplier = {
-                'id': str(uuid.uuid4()),
-                'name': data.get('name', ''),
-                'email': data.get('email', ''),
-                'phone': data.get('phone', ''),
-                'website': data.get('website', ''),
-                'created_at': datetime.now().isoformat()
-            }
-            suppliers.append(supplier)
-            save_json_file(SUPPLIERS_FILE, suppliers)
+            supplier = crm_new_record('suppliers', data)
+            crm_insert('suppliers', supplier)
             return jsonify({'success': True, 'supplier': supplier})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _ndjson_records(stream):
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, f'Invalid JSON: {e}'
+
+
+def _csv_records(collection, stream):
+    """CSV rows as records: numeric fields parsed, blank cells dropped, JSON cells decoded"""
+    numeric = crm_numeric_fields(collection)
+    reader = csv.DictReader(stream)
+    for row in reader:
+        record = {}
+        for key, value in row.items():
+            if key is None or value is None or value == '':
+                continue
+            if key in numeric:
+                # An exported int has no '.', so "3" comes back as 3 and "3.0" as 3.0
+                for parse in (int, float):
+                    try:
+                        value = parse(value)
+                        break
+                    except ValueError:
+                        pass
+            elif value[:1] in '[{':
+                try:
+                    value = json.loads(value)
+                except json.JSONDecodeError:
+                    pass
+            record[key] = value
+        yield reader.line_num, record
+
+
+def _crm_data_format(default=None):
+    fmt = request.args.get('format')
+    if not fmt:
+        mimetype = request.mimetype or ''
+        fmt = 'csv' if 'csv' in mimetype else 'ndjson' if ('ndjson' in mimetype or 'jsonl' in mimetype) else default
+    return fmt
+
+
+@app.route('/api/crm/import/<collection>', methods=['POST'])
+def import_crm_collection(collection):
+    """Bulk upsert from a streamed NDJSON (one object per line) or CSV request body"""
+    try:
+        if collection not in CRM_COLLECTIONS:
+            return jsonify({'success': False, 'error': f'Unknown collection: {collection}'}), 404
+        fmt = _crm_data_format()
+        if fmt not in ('ndjson', 'csv'):
+            return jsonify({'success': False, 'error': 'Send application/x-ndjson or text/csv (or ?format=)'}), 415
+
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='' if fmt == 'csv' else None)
+        records = _csv_records(collection, stream) if fmt == 'csv' else _ndjson_records(stream)
+        imported, skipped, errors = crm_import_records(collection, records)
+        print(f"📥 Imported {imported} {collection} ({skipped} skipped)")
+        return jsonify({'success': True, 'imported': imported, 'skipped': skipped, 'errors': errors})
+    except (UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'success': False, 'error': f'Unreadable {collection} data: {e}'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/crm/export/<collection>', methods=['GET'])
+def export_crm_collection(collection):
+    """Stream a whole collection as NDJSON (default) or CSV without loading it into memory"""
+    if collection not in CRM_COLLECTIONS:
+        return jsonify({'success': False, 'error': f'Unknown collection: {collection}'}), 404
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'success': False, 'error': 'format must be ndjson or csv'}), 400
+
+    def body():
+        # Rows are formatted into a buffer and sent in ~64 KB chunks
+        buffer = io.StringIO()
+        if fmt == 'csv':
+            writer = csv.DictWriter(buffer, fieldnames=crm_export_columns(collection), extrasaction='ignore')
+            writer.writeheader()
+        for record in crm_iter_records(collection):
+            if fmt == 'csv':
+                writer.writerow({key: json.dumps(value) if isinstance(value, (dict, list)) else value
+                                 for key, value in record.items()})
+            else:
+                buffer.write(json.dumps(record) + '\n')
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    stamp = datetime.now().strftime('%Y%m%d')
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(body(), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={collection}-{stamp}.{fmt}'
+    })
+
+
 @app.route('/api/crm/integrations', methods=['GET'])
 def get_integrations_crm():
     try:
@@ -2381,28 +5089,24 @@ def get_integrations_crm():
 @app.route('/api/crm/stats', methods=['GET'])
 def get_crm_stats():
     try:
-        customers = load_json_file(CUSTOMERS_FILE, [])
-        projects = load_json_file(PROJECTS_FILE, [])
-        inventory = load_json_file(INVENTORY_FILE, [])
-        
-        total_customers = len(customers)
-        active_customers = len([c for c in customers if c.get('status') == 'active'])
-        total_projects = len(projects)
-        active_projects = len([p for p in projects if p.get('status') in ['pending', 'in_progress']])
-        completed_projects = len([p for p in projects if p.get('status') == 'completed'])
-        total_revenue = sum(p.get('actual_amount', 0) for p in projects if p.get('status') == 'completed')
-        pending_revenue = sum(p.get('quote_amount', 0) for p in projects if p.get('status') in ['pending', 'in_progress'])
-        total_inventory_value = sum(i.get('quantity', 0) * i.get('unit_cost', 0) for i in inventory)
-        low_stock_items = len([i for i in inventory if i.get('quantity', 0) <= i.get('reorder_level', 10)])
-        
+        # Totals are maintained by triggers on every write (see CRM_STATS);
+        # today's events are a seek on the calendar date index
+        with closing(_connect_sqlite(CRM_DB_FILE)) as con:
+            stats = {row['key']: row['value'] for row in con.execute("SELECT key, value FROM crm_stats")}
+            today_events = con.execute("SELECT COUNT(*) FROM crm_calendar WHERE date = ?",
+                                       (datetime.now().date().isoformat(),)).fetchone()[0]
+        count = lambda key: stats.get(key, 0)
+        money = lambda key: stats.get(f'{key}_cents', 0) / 100
+
         return jsonify({
             'success': True,
             'stats': {
-                'customers': {'total': total_customers, 'active': active_customers},
-                'projects': {'total': total_projects, 'active': active_projects, 'completed': completed_projects},
-                'revenue': {'total': total_revenue, 'pending': pending_revenue},
-                'inventory': {'total_value': total_inventory_value, 'low_stock': low_stock_items},
-                'calendar': {'today_events': 0}
+                'customers': {'total': count('customers_total'), 'active': count('customers_active')},
+                'projects': {'total': count('projects_total'), 'active': count('projects_active'),
+                             'completed': count('projects_completed')},
+                'revenue': {'total': money('revenue_total'), 'pending': money('revenue_pending')},
+                'inventory': {'total_value': money('inventory_value'), 'low_stock': count('inventory_low_stock')},
+                'calendar': {'today_events': today_events}
             }
         })
     except Exception as e:
@@ -1,5 +1,6 @@
 # app_gpt2.py
-import os, sqlite3, json, uuid, datetime, io, base64
+import os, sqlite3, json, uuid, datetime, io, base64, queue, threading
+from contextlib import contextmanager
 from flask import Flask, request, jsonify, send_from_directory, render_template, url_for
 from werkzeug.utils import secure_filename
 
@@ -15,6 +16,10 @@ DATA_DIR = os.path.join(APP_DIR, "data")
 UPLOAD_DIR = os.path.join(DATA_DIR, "uploads")
 OUT_DIR = os.path.join(DATA_DIR, "outputs")
 DB_PATH = os.path.join(DATA_DIR, "crm.sqlite3")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))            # idle connections kept per worker
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "30"))   # seconds a writer waits for the lock
+DB_CACHE_KB = int(os.getenv("DB_CACHE_KB", "16384"))          # page cache per connection
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(OUT_DIR, exist_ok=True)
 
@@ -185,14 +190,43 @@ def api_upload_placement_knowledge():
     return jsonify({"success": True})
 
 # ---- CRM (SQLite) ----
-def db():
-    con = sqlite3.connect(DB_PATH)
+# Connections are pooled per worker process and tuned once when opened; the
+# database runs in WAL mode so readers never wait behind a writer. Each
+# connection also keeps its prepared statements cached between requests.
+_pool = queue.LifoQueue()
+_pool_pid = os.getpid()
+_pool_lock = threading.Lock()
+
+def _connect():
+    con = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT, check_same_thread=False, cached_statements=256)
     con.row_factory = sqlite3.Row
+    con.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}")
+    con.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints; safe with WAL
+    con.execute(f"PRAGMA cache_size=-{DB_CACHE_KB}")
+    con.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    con.execute("PRAGMA temp_store=MEMORY")
     return con
 
+@contextmanager
+def db():
+    """Borrow a pooled connection; commits on success, rolls back on error."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool_pid != os.getpid():  # forked worker: never reuse the parent's connections
+            _pool, _pool_pid = queue.LifoQueue(), os.getpid()
+        pool = _pool
+    try: con = pool.get_nowait()
+    except queue.Empty: con = _connect()
+    try:
+        with con: yield con  # rolled back on error, so the connection is clean to reuse
+    finally:
+        if pool.qsize() < DB_POOL_SIZE: pool.put(con)
+        else: con.close()
+
 def ensure_schema():
-    con = db(); cur = con.cursor()
-    cur.executescript("""
+    with db() as con:
+        con.execute("PRAGMA journal_mode=WAL")  # persistent, stored in the database file
+        con.executescript("""
     CREATE TABLE IF NOT EXISTS customers(
         id TEXT PRIMARY KEY, name TEXT, company TEXT, email TEXT, phone TEXT, address TEXT, notes TEXT,
         total_projects INTEGER DEFAULT 0, total_revenue REAL DEFAULT 0
@@ -217,42 +251,75 @@ def ensure_schema():
         id TEXT PRIMARY KEY, customer_id TEXT, type TEXT, subject TEXT, content TEXT, created_at TEXT, created_by TEXT
     );
     """)
-    con.commit(); con.close()
+    migrate()
+
+# Schema changes after the base tables, in order; PRAGMA user_version records
+# how many have been applied. Only ever append to this list.
+MIGRATIONS = [
+    [  # 1: secondary indexes for the list filters and stats
+        "CREATE INDEX IF NOT EXISTS idx_projects_status ON projects(status, quote_amount)",  # covers crm_stats
+        "CREATE INDEX IF NOT EXISTS idx_projects_customer ON projects(customer_id)",
+        "CREATE INDEX IF NOT EXISTS idx_communications_customer ON communications(customer_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_inventory_quantity ON inventory(quantity)",
+    ],
+]
+
+def migrate():
+    """Apply pending MIGRATIONS, each in its own transaction with its version bump."""
+    with db() as con:
+        for version, statements in enumerate(MIGRATIONS, start=1):
+            con.execute("BEGIN IMMEDIATE")  # another worker may be migrating too
+            if con.execute("PRAGMA user_version").fetchone()[0] >= version:
+                con.rollback(); continue
+            for sql in statements: con.execute(sql)
+            con.execute(f"PRAGMA user_version={version}")
+            con.commit()
 ensure_schema()
 
 def row_to_dict(r): return {k:r[k] for k in r.keys()}
 
 @app.route("/api/crm/stats")
 def crm_stats():
-    con = db(); cur = con.cursor()
+    # One statement: a single pass over the projects status index plus two index counts
+    with db() as con: r = con.execute("""
+        SELECT (SELECT count(*) FROM customers) customers,
+               p.total, p.active, p.revenue, p.pending,
+               (SELECT count(*) FROM inventory WHERE quantity<3) low_stock
+        FROM (SELECT count(*) total,
+                     COALESCE(sum(status='in_progress'),0) active,
+                     COALESCE(sum(quote_amount),0) revenue,
+                     COALESCE(sum(CASE WHEN status!='completed' THEN quote_amount END),0) pending
+              FROM projects) p
+    """).fetchone()
     stats = {
-        "customers": {"total": cur.execute("SELECT count(*) c FROM customers").fetchone()["c"]},
-        "projects": {"total": cur.execute("SELECT count(*) c FROM projects").fetchone()["c"],
-                     "active": cur.execute("SELECT count(*) c FROM projects WHERE status='in_progress'").fetchone()["c"]},
-        "revenue": {"total": float(cur.execute("SELECT COALESCE(sum(quote_amount),0) s FROM projects").fetchone()["s"]),
-                    "pending": float(cur.execute("SELECT COALESCE(sum(quote_amount),0) s FROM projects WHERE status!='completed'").fetchone()["s"])},
-        "inventory": {"low_stock": cur.execute("SELECT count(*) c FROM inventory WHERE quantity<3").fetchone()["c"]}
+        "customers": {"total": r["customers"]},
+        "projects": {"total": r["total"], "active": r["active"]},
+        "revenue": {"total": float(r["revenue"]), "pending": float(r["pending"])},
+        "inventory": {"low_stock": r["low_stock"]}
     }
-    con.close(); return jsonify({"success": True, "stats": stats})
+    return jsonify({"success": True, "stats": stats})
 
-def list_table(table):
-    con = db(); rows=[row_to_dict(r) for r in con.execute(f"SELECT * FROM {table}")]; con.close(); return rows
+def list_table(table, filters=()):
+    """All rows, narrowed by any of the `filters` columns given in the query string."""
+    where = {k: request.args[k] for k in filters if request.args.get(k)}
+    sql = f"SELECT * FROM {table}" + (" WHERE " + " AND ".join(f"{k}=?" for k in where) if where else "")
+    with db() as con: return [row_to_dict(r) for r in con.execute(sql, list(where.values()))]
 
 def save_row(table, values):
-    con=db(); cur=con.cursor()
-    if values.get("id"):
-        keys=[k for k in values.keys() if k!="id"]
-        cur.execute(f"UPDATE {table} SET "+",".join([f"{k}=?" for k in keys])+" WHERE id=?",
-                    [values[k] for k in keys]+[values["id"]])
-        rid=values["id"]
-    else:
-        rid=str(uuid.uuid4())[:8]; values["id"]=rid
-        keys=", ".join(values.keys()); qmarks=", ".join(["?"]*len(values))
-        cur.execute(f"INSERT INTO {table}({keys}) VALUES({qmarks})", list(values.values()))
-    con.commit(); con.close(); return rid
+    with db() as con:
+        if values.get("id"):
+            keys=[k for k in values.keys() if k!="id"]
+            con.execute(f"UPDATE {table} SET "+",".join([f"{k}=?" for k in keys])+" WHERE id=?",
+                        [values[k] for k in keys]+[values["id"]])
+            rid=values["id"]
+        else:
+            rid=str(uuid.uuid4())[:8]; values["id"]=rid
+            keys=", ".join(values.keys()); qmarks=", ".join(["?"]*len(values))
+            con.execute(f"INSERT INTO {table}({keys}) VALUES({qmarks})", list(values.values()))
+    return rid
 
 def delete_row(table, rid):
-    con=db(); con.execute(f"DELETE FROM {table} WHERE id=?", (rid,)); con.commit(); con.close()
+    with db() as con: con.execute(f"DELETE FROM {table} WHERE id=?", (rid,))
 
 @app.route("/api/crm/customers", methods=["GET","POST"])
 def customers_api():
@@ -271,7 +338,7 @@ def customers_item(rid):
 
 @app.route("/api/crm/projects", methods=["GET","POST"])
 def projects_api():
-    if request.method=="GET": return jsonify({"success": True, "projects": list_table("projects")})
+    if request.method=="GET": return jsonify({"success": True, "projects": list_table("projects", ("customer_id", "status"))})
     data=request.get_json(force=True)
     rid=save_row("projects",{
         "id": data.get("id",""), "customer_id": data.get("customer_id",""), "title": data.get("title",""),
@@ -323,7 +390,7 @@ def suppliers_api():
 
 @app.route("/api/crm/communications", methods=["GET","POST"])
 def comm_api():
-    if request.method=="GET": return jsonify({"success": True, "communications": list_table("communications")})
+    if request.method=="GET": return jsonify({"success": True, "communications": list_table("communications", ("customer_id",))})
     data=request.get_json(force=True)
     rid=save_row("communications",{
         "id": data.get("id",""), "customer_id": data.get("customer_id",""), "type": data.get("type","note"),
@@ -1,5 +1,5 @@
 # app_gpt2_phase2.py (FIXED)
-import os, json, uuid
+import os, json, uuid, math
 from flask import request, jsonify, send_from_directory
 from werkzeug.utils import secure_filename
 
@@ -52,6 +52,14 @@ def plan_understand():
 
     return jsonify(success=True, project_id=pid, floorplan=result, floorplan_url=f"/phase2/download/{os.path.basename(out_json)}")
 
+def _positive_number(value):
+    # float(value) if it is a finite number > 0, else None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) and value > 0 else None
+
 @app.post("/api/plan/route")
 def plan_route():
     data = request.get_json(force=True)
@@ -61,10 +69,32 @@ def plan_route():
     if not panels or not syms:
         return jsonify(success=False, error="Missing panels or symbols"), 400
 
+    max_load = data.get("max_load")
+    if max_load is not None:
+        max_load = _positive_number(max_load)
+        if max_load is None:
+            return jsonify(success=False, error="max_load must be a positive number"), 400
+    scale = 1.0 if floorplan.get("scale") is None else _positive_number(floorplan["scale"])
+    if scale is None:
+        return jsonify(success=False, error="scale must be a positive number"), 400
+
     src = panels[0]["point"]
-    targets = [s["port"] for s in syms if s.get("type","").startswith("light")]
-    circuits = route_circuit(src, targets, wire="14/2")
-    markup = {"circuits": circuits, "symbols": syms}
+    # Each light counts its load (default one point) against max_load
+    targets = []
+    for s in syms:
+        if not s.get("type","").startswith("light"):
+            continue
+        load = _positive_number(s.get("load", 1))
+        if load is None:
+            return jsonify(success=False, error=f"load of symbol {s.get('id')} must be a positive number"), 400
+        targets.append({**s["port"], "symbol_id": s.get("id"), "load": load})
+    circuits = route_circuit(src, targets, wire="14/2", floorplan=floorplan, max_load=max_load)
+    # Circuit lengths are in plan coordinates; scale converts them to `units` for costing
+    per_circuit = {c["id"]: round(c["length"] * scale, 2) for c in circuits}
+    markup = {"circuits": circuits, "symbols": syms,
+              "cable": {"units": floorplan.get("units"), "scale": scale,
+                        "per_circuit": per_circuit,
+                        "total": round(sum(per_circuit.values()), 2)}}
     svg = to_svg(markup)
     svg_name = f"{uuid.uuid4().hex[:8]}.svg"
     with open(os.path.join(OUT_DIR, svg_name), "w") as fh:
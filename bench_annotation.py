@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Annotation benchmark for Lock Zone AI Floor Plan Analyzer
+Compares the PyMuPDF incremental backend with the old reportlab/pypdf overlay
+merge on a synthetic multi-page plan set.
+
+Usage: python bench_annotation.py [--pages 30] [--marks 60] [--repeat 3]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+
+from app import DEFAULT_DATA, RENDER_ZOOM, create_annotated_pdf, create_annotated_pdf_overlay
+
+
+def build_plan_set(path, pages, walls_per_page):
+    """Write an A1 plan set with dense vector linework, like an architect's export"""
+    rng = random.Random(42)
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page(width=2384, height=1684)  # A1 landscape in points
+        shape = page.new_shape()
+        for _ in range(walls_per_page):
+            x, y = rng.uniform(50, 2300), rng.uniform(50, 1600)
+            if rng.random() < 0.5:
+                shape.draw_line((x, y), (x + rng.uniform(20, 400), y))
+            else:
+                shape.draw_line((x, y), (x, y + rng.uniform(20, 400)))
+        shape.finish(width=1.5, color=(0, 0, 0))
+        shape.insert_text((80, 80), f"LEVEL {page_num + 1}", fontsize=36)
+        shape.commit()
+    doc.save(path, deflate=True)
+    doc.close()
+
+
+def build_placements(pages, marks_per_page):
+    rng = random.Random(7)
+    types = list(DEFAULT_DATA['automation_types'])
+    placements = {auto_type: [] for auto_type in types}
+    for page_num in range(pages):
+        for _ in range(marks_per_page):
+            placements[rng.choice(types)].append({
+                'position': (rng.uniform(0, 2384 * RENDER_ZOOM), rng.uniform(0, 1684 * RENDER_ZOOM)),
+                'quantity': 1,
+                'page': page_num
+            })
+    return placements
+
+
+def time_backend(backend, source, placements, output, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        backend(source, placements, DEFAULT_DATA, output)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), os.path.getsize(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=30)
+    parser.add_argument('--marks', type=int, default=60, help='symbols per page')
+    parser.add_argument('--walls', type=int, default=5000, help='vector lines per page')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, 'plan_set.pdf')
+        print(f"🏗  Building {args.pages}-page plan set ({args.walls} lines/page)...")
+        build_plan_set(source, args.pages, args.walls)
+        placements = build_placements(args.pages, args.marks)
+        print(f"   Source size: {os.path.getsize(source) / 1e6:.1f} MB, "
+              f"{args.pages * args.marks} symbols")
+
+        results = {}
+        for name, backend in [('pymupdf (incremental)', create_annotated_pdf),
+                              ('reportlab + pypdf overlay', create_annotated_pdf_overlay)]:
+            output = os.path.join(workdir, f"{name.split()[0]}.pdf")
+            results[name] = time_backend(backend, source, placements, output, args.repeat)
+
+    print("\n📊 RESULTS (median of {} runs)".format(args.repeat))
+    print("=" * 50)
+    for name, (seconds, size) in results.items():
+        print(f"{name:<28} {seconds * 1000:9.1f} ms  {size / 1e6:7.1f} MB")
+    fast = results['pymupdf (incremental)'][0]
+    slow = results['reportlab + pypdf overlay'][0]
+    print(f"\nSpeed-up: {slow / fast:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
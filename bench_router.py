@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Router benchmark for the gpt2 wiring planner
+Routes panel-to-symbols circuits over a synthetic multi-room plan: straight
+legs vs grid A*, targets in input order vs optimised order, and split by load.
+
+Usage: python bench_router.py [--symbols 300] [--rooms 8x5] [--repeat 3]
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from agents.router_gpt2 import build_grid, route_circuit
+
+
+def build_floorplan(cols, rows, symbols, room_w=400, room_h=300):
+    """A cols x rows block of rectangular rooms with symbols scattered inside them"""
+    rng = random.Random(42)
+    rooms = []
+    for r in range(rows):
+        for c in range(cols):
+            x, y = c * room_w, r * room_h
+            rooms.append({'id': f'r{r}_{c}', 'name': f'Room {r}.{c}', 'polygon': [
+                {'x': x, 'y': y}, {'x': x + room_w, 'y': y},
+                {'x': x + room_w, 'y': y + room_h}, {'x': x, 'y': y + room_h}]})
+    syms = []
+    for i in range(symbols):
+        room = rng.choice(rooms)
+        x0, y0 = room['polygon'][0]['x'], room['polygon'][0]['y']
+        px, py = x0 + rng.uniform(20, room_w - 20), y0 + rng.uniform(20, room_h - 20)
+        syms.append({'id': f's{i}', 'type': 'light', 'label': f'Light {i}', 'room_id': room['id'],
+                     'bbox': {'x': px - 6, 'y': py - 6, 'w': 12, 'h': 12}, 'port': {'x': px, 'y': py}})
+    return {'units': 'mm', 'scale': 1.0, 'rooms': rooms,
+            'panels': [{'id': 'p1', 'type': 'panel', 'point': {'x': 30, 'y': 30}}], 'symbols': syms}
+
+
+def measure(fn, repeat):
+    timings, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--symbols', type=int, default=300)
+    parser.add_argument('--rooms', default='8x5', help='columns x rows of rooms')
+    parser.add_argument('--cell', type=float, default=None, help='grid cell size in plan units')
+    parser.add_argument('--max-load', type=float, default=12, help='points per circuit when splitting')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    cols, rows = (int(n) for n in args.rooms.lower().split('x'))
+    plan = build_floorplan(cols, rows, args.symbols)
+    src = plan['panels'][0]['point']
+    targets = [s['port'] for s in plan['symbols']]
+    print(f"🏗  {cols * rows} rooms, {args.symbols} symbols")
+
+    build_s, grid = measure(lambda: build_grid(plan, cell=args.cell), args.repeat)
+    runs = [
+        ('straight, input order', lambda: route_circuit(src, targets, optimize=False)),
+        ('A*, input order', lambda: route_circuit(src, targets, grid=grid, optimize=False)),
+        ('A*, ordered', lambda: route_circuit(src, targets, grid=grid)),
+        (f'A*, ordered, <= {args.max_load:g}/circuit',
+         lambda: route_circuit(src, targets, grid=grid, max_load=args.max_load)),
+    ]
+    results = [(name, *measure(fn, args.repeat)) for name, fn in runs]
+
+    print(f"   Grid: {grid.width} x {grid.height} cells of {grid.cell:.1f} units")
+    print("\n📊 RESULTS (median of {} runs)".format(args.repeat))
+    print("=" * 84)
+    print(f"{'grid build':<30} {build_s * 1000:9.1f} ms")
+    for name, seconds, circuits in results:
+        length = sum(c['length'] for c in circuits)
+        walls = sum(grid.walls_on([(p['x'], p['y']) for p in c['path']]) for c in circuits)
+        print(f"{name:<30} {seconds * 1000:9.1f} ms  {len(circuits):3d} circuits  "
+              f"cable {length:9.0f}  wall cells {walls:5d}")
+
+if __name__ == '__main__':
+    main()
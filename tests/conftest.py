@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py keeps its data folders relative to the working directory and creates
+# them on import, so import it from a scratch directory
+_workdir = tempfile.mkdtemp(prefix='integratdai-tests-')
+os.chdir(_workdir)
+
+# Tests drive the job queue by hand rather than racing background workers
+os.environ['JOB_WORKERS'] = '0'
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,130 @@
+import uuid
+from contextlib import closing
+
+
+def _customer(client, **fields):
+    response = client.post('/api/crm/customers', json=fields)
+    assert response.status_code in (200, 201), response.json
+    return response.json['customer']
+
+
+def test_search_matches_partial_words(client):
+    tag = uuid.uuid4().hex[:6]
+    customer = _customer(client, name=f'Alice Smith{tag}', email=f'alice{tag}@example.com')
+
+    for query in (f'ali smith{tag[:3]}', 'smi ali', f'alice smith{tag}'):
+        response = client.get('/api/crm/customers', query_string={'search': query})
+        ids = [c['id'] for c in response.json['customers']]
+        assert customer['id'] in ids, query
+
+
+def _all(app_module, collection):
+    return {record['id']: record for record in app_module.crm_iter_records(collection)}
+
+
+def test_csv_export_reimports_to_same_records(app_module, client):
+    for i in range(5):
+        _customer(client, name=f'Round Trip {i}', phone=f'0412 000 00{i}', notes='' if i % 2 else 'a, "quoted" note')
+    client.post('/api/crm/inventory', json={'name': 'Relay', 'sku': 'R-1', 'quantity': 7, 'unit_cost': 12.5})
+    client.post('/api/crm/technicians', json={'name': 'Tess', 'skills': ['knx', 'dali']})
+
+    for collection in ('customers', 'inventory', 'technicians'):
+        before = _all(app_module, collection)
+        exported = client.get(f'/api/crm/export/{collection}', query_string={'format': 'csv'}).data
+        for record_id in before:
+            app_module.crm_delete(collection, record_id)
+
+        response = client.post(f'/api/crm/import/{collection}', data=exported, content_type='text/csv')
+        assert response.json['imported'] == len(before), response.json
+        assert _all(app_module, collection) == before, collection
+
+
+def test_import_uses_post_defaults(app_module, client):
+    lines = b'{"id": "imp-tech", "name": "Ivy"}\n'
+    client.post('/api/crm/import/technicians', data=lines, content_type='application/x-ndjson')
+    posted = client.post('/api/crm/technicians', json={'name': 'Pat'}).json['technician']
+    imported = app_module.crm_get('technicians', 'imp-tech')
+    assert imported['status'] == posted['status'] == 'available'
+
+    client.post('/api/crm/import/inventory', data=b'{"id": "imp-item", "name": "Dimmer"}\n',
+                content_type='application/x-ndjson')
+    item = app_module.crm_get('inventory', 'imp-item')
+    assert (item['quantity'], item['reorder_level']) == (0, 10)
+
+
+def test_ids_lookup_returns_just_those_customers(client):
+    tag = uuid.uuid4().hex[:6]
+    wanted = [_customer(client, name=f'Lookup {tag} {i}', email=f'{i}@{tag}.example') for i in range(3)]
+    _customer(client, name=f'Lookup {tag} other')
+
+    ids = [wanted[0]['id'], wanted[2]['id'], 'no-such-id']
+    response = client.get('/api/crm/customers', query_string={'ids': ','.join(ids), 'fields': 'id,name'})
+    customers = response.json['customers']
+    assert sorted(c['id'] for c in customers) == sorted(ids[:2])
+    assert all(set(c) == {'id', 'name'} for c in customers)
+
+    response = client.get('/api/crm/customers', query_string={'ids': ','.join(ids), 'search': f'lookup {tag}'})
+    assert sorted(c['id'] for c in response.json['customers']) == sorted(ids[:2])
+
+
+def test_too_many_ids_is_rejected(app_module, client):
+    ids = ','.join(str(i) for i in range(app_module.CRM_MAX_PAGE_SIZE + 1))
+    assert client.get('/api/crm/projects', query_string={'ids': ids}).status_code == 400
+
+
+def test_name_sorted_lists_use_an_index(app_module):
+    with closing(app_module._connect_sqlite(app_module.CRM_DB_FILE)) as con:
+        for table in ('crm_technicians', 'crm_inventory'):
+            plan = ' '.join(row[3] for row in con.execute(
+                f"EXPLAIN QUERY PLAN SELECT data FROM {table} WHERE name > ? ORDER BY name, rowid LIMIT 51", ('m',)))
+            assert f'idx_{table}_name' in plan, plan
+
+
+def _fresh_stats(app_module):
+    with closing(app_module._connect_sqlite(app_module.CRM_DB_FILE)) as con:
+        return con.execute("""
+            SELECT
+              (SELECT COALESCE(SUM(actual_amount), 0) FROM crm_projects WHERE status = 'completed'),
+              (SELECT COALESCE(SUM(quote_amount), 0) FROM crm_projects WHERE status IN ('pending', 'in_progress')),
+              (SELECT COALESCE(SUM(quantity * unit_cost), 0) FROM crm_inventory)
+        """).fetchone()
+
+
+def _assert_stats_match(app_module, client):
+    stats = client.get('/api/crm/stats').json['stats']
+    revenue, pending, stock = _fresh_stats(app_module)
+    assert stats['revenue']['total'] == round(revenue, 2)
+    assert stats['revenue']['pending'] == round(pending, 2)
+    assert stats['inventory']['total_value'] == round(stock, 2)
+
+
+def test_stats_match_fresh_sums_after_edits(app_module, client):
+    projects = [client.post('/api/crm/projects', json={'title': f'Drift {i}', 'status': 'pending',
+                                                       'quote_amount': 0.1 * (i + 1)}).json['project']
+                for i in range(30)]
+    item = client.post('/api/crm/inventory', json={'name': 'Cable', 'quantity': 3, 'unit_cost': 0.7}).json['item']
+
+    for round_ in range(20):
+        for i, project in enumerate(projects):
+            status = 'completed' if (i + round_) % 3 == 0 else 'in_progress'
+            client.put(f"/api/crm/projects/{project['id']}",
+                       json={'status': status, 'actual_amount': 19.99 + 0.01 * round_, 'quote_amount': 0.1 * i + 0.3})
+        app_module.crm_update('inventory', item['id'], {'quantity': 3 + round_, 'unit_cost': 0.1 + 0.7})
+    for project in projects[::2]:
+        app_module.crm_delete('projects', project['id'])
+    _assert_stats_match(app_module, client)
+
+    with closing(app_module._connect_sqlite(app_module.CRM_DB_FILE)) as con:
+        values = [row['value'] for row in con.execute("SELECT value FROM crm_stats")]
+    assert all(isinstance(value, int) for value in values)
+
+
+def test_stats_table_from_older_installs_is_migrated(app_module, client):
+    client.post('/api/crm/projects', json={'title': 'Legacy', 'status': 'completed', 'actual_amount': 12.34})
+    with closing(app_module._connect_sqlite(app_module.CRM_DB_FILE)) as con:
+        with con:
+            con.execute("DROP TABLE crm_stats")
+            con.execute("CREATE TABLE crm_stats(key TEXT PRIMARY KEY, value REAL NOT NULL DEFAULT 0)")
+            con.execute("INSERT INTO crm_stats VALUES('revenue_total', 0.30000000000000004)")
+    app_module.init_crm_store()
+    _assert_stats_match(app_module, client)
@@ -0,0 +1,31 @@
+import os
+import time
+
+import fitz
+import pytest
+
+
+@pytest.fixture
+def project_id(app_module, tmp_path, monkeypatch):
+    # send_file resolves the relative cache paths against root_path, which in
+    # a deployment is also the working directory
+    monkeypatch.setattr(app_module.app, 'root_path', os.getcwd())
+    pdf_path = str(tmp_path / 'plan.pdf')
+    doc = fitz.open()
+    for _ in range(2):
+        doc.new_page(width=600, height=400)
+    doc.save(pdf_path)
+    doc.close()
+    project_id = str(time.time())
+    app_module.save_project({'timestamp': project_id, 'project_name': 'Pages', 'pdf_path': pdf_path,
+                             'placements': {}, 'page_count': 2})
+    return project_id
+
+
+@pytest.mark.parametrize('url', ['/api/floor-plan-image/{}', '/api/floor-plan-tiles/{}/info',
+                                 '/api/floor-plan-tiles/{}/0/0/0.png'])
+def test_page_outside_document_is_404(client, project_id, url):
+    url = url.format(project_id)
+    assert client.get(url, query_string={'page': 1}).status_code == 200
+    for page in (2, -1):
+        assert client.get(url, query_string={'page': page}).status_code == 404
@@ -0,0 +1,83 @@
+import threading
+import time
+from contextlib import closing
+
+
+def _job_row(app_module, job_id):
+    with closing(app_module._connect_sqlite(app_module.JOBS_DB_FILE)) as con:
+        return dict(con.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+
+def _expire(app_module, job_id):
+    """Age a running job's heartbeat past the stale limit"""
+    with closing(app_module._connect_sqlite(app_module.JOBS_DB_FILE)) as con:
+        with con:
+            con.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?",
+                        (time.time() - app_module.JOB_STALE_SECONDS - 1, job_id))
+
+
+def test_stale_worker_cannot_overwrite_retry(app_module, monkeypatch):
+    monkeypatch.setitem(app_module.JOB_HANDLERS, 'echo', lambda payload, progress: payload)
+    job_id = app_module.submit_job('echo', {'n': 1})
+
+    first = app_module._claim_next_job()
+    assert first['id'] == job_id
+    _expire(app_module, job_id)
+    second = app_module._claim_next_job()
+    assert second['id'] == job_id and second['claim'] != first['claim']
+    assert _job_row(app_module, job_id)['attempts'] == 2
+
+    # The slow first worker wakes up: its progress and result are dropped
+    assert not app_module.update_job_progress(job_id, first['claim'], 'saving', 0.6)
+    assert not app_module._finish_job(job_id, first['claim'], 'failed', error='boom')
+    assert _job_row(app_module, job_id)['status'] == 'running'
+
+    app_module._run_job(second)
+    row = _job_row(app_module, job_id)
+    assert row['status'] == 'completed' and row['result'] == '{"n": 1}' and row['error'] is None
+
+
+def test_stale_job_fails_after_max_attempts(app_module, monkeypatch):
+    monkeypatch.setitem(app_module.JOB_HANDLERS, 'echo', lambda payload, progress: payload)
+    job_id = app_module.submit_job('echo', {})
+    for _ in range(app_module.JOB_MAX_ATTEMPTS):
+        assert app_module._claim_next_job()['id'] == job_id
+        _expire(app_module, job_id)
+
+    assert app_module._claim_next_job() is None
+    row = _job_row(app_module, job_id)
+    assert row['status'] == 'failed' and row['error'] == 'Worker stopped responding'
+
+
+def test_exception_without_message_is_a_failure(app_module, monkeypatch):
+    def handler(payload, progress):
+        raise KeyError() if payload['silent'] else RuntimeError('')
+    monkeypatch.setitem(app_module.JOB_HANDLERS, 'broken', handler)
+
+    for silent in (True, False):
+        job_id = app_module.submit_job('broken', {'silent': silent})
+        app_module._run_job(app_module._claim_next_job())
+        job = app_module.get_job(job_id)
+        assert job['status'] == 'failed'
+        assert job['error'] == ('KeyError' if silent else 'RuntimeError')
+
+
+def test_heartbeat_runs_during_a_long_stage(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'JOB_HEARTBEAT_INTERVAL', 0.05)
+    beats = []
+
+    def handler(payload, progress):
+        progress('analyzing', 0.1)
+        start = _job_row(app_module, job_id)['heartbeat']
+        time.sleep(0.3)
+        beats.append(_job_row(app_module, job_id)['heartbeat'] - start)
+        return {}
+    monkeypatch.setitem(app_module.JOB_HANDLERS, 'slow', handler)
+
+    job_id = app_module.submit_job('slow', {})
+    app_module._run_job(app_module._claim_next_job())
+    assert beats[0] > 0.1
+
+    # The heartbeat thread stops with the job
+    time.sleep(0.1)
+    assert f'job-heartbeat-{job_id}' not in {t.name for t in threading.enumerate()}
@@ -0,0 +1,57 @@
+import pytest
+
+
+@pytest.fixture
+def phase2(app_module, tmp_path, monkeypatch):
+    import app_gpt2_phase2
+    monkeypatch.setattr(app_gpt2_phase2, 'OUT_DIR', str(tmp_path))
+    return app_gpt2_phase2.app.test_client()
+
+
+def test_max_load_is_validated(phase2):
+    assert phase2.post('/api/plan/route', json={'max_load': '1'}).status_code == 200
+    for bad in ('twelve', 0, -3, [2]):
+        response = phase2.post('/api/plan/route', json={'max_load': bad})
+        assert response.status_code == 400, bad
+
+
+def test_cable_lengths_use_plan_scale(phase2):
+    plan = phase2.post('/api/plan/route', json={}).json['markup']
+
+    import app_gpt2_phase2
+    scaled = app_gpt2_phase2._mock_floorplan()
+    scaled['scale'] = 2.5
+    markup = phase2.post('/api/plan/route', json={'floorplan': scaled}).json['markup']
+    assert markup['cable']['total'] == pytest.approx(plan['cable']['total'] * 2.5, abs=0.05)
+    assert markup['cable']['per_circuit']['ckt_1'] == pytest.approx(markup['circuits'][0]['length'] * 2.5, abs=0.01)
+
+
+def _lights(phase2_module, loads):
+    plan = phase2_module._mock_floorplan()
+    lights = [s for s in plan['symbols'] if s.get('type', '').startswith('light')]
+    for symbol, load in zip(lights, loads):
+        symbol['load'] = load
+    return plan, len(lights)
+
+
+def test_symbol_loads_are_coerced_and_validated(phase2):
+    import app_gpt2_phase2
+    plan, count = _lights(app_gpt2_phase2, ['2'] * 99)
+    response = phase2.post('/api/plan/route', json={'floorplan': plan, 'max_load': 3})
+    assert response.status_code == 200
+    circuits = response.json['markup']['circuits']
+    assert [c['load'] for c in circuits] == [2] * count
+
+    for bad in (None, 'heavy', 0, -1, 'nan'):
+        plan, _ = _lights(app_gpt2_phase2, [bad])
+        response = phase2.post('/api/plan/route', json={'floorplan': plan, 'max_load': 4})
+        assert response.status_code == 400, bad
+
+
+def test_scale_must_be_positive_and_finite(phase2):
+    import app_gpt2_phase2
+    for bad in (0, -2, 'inf', 'nan', 'big'):
+        plan = app_gpt2_phase2._mock_floorplan()
+        plan['scale'] = bad
+        response = phase2.post('/api/plan/route', json={'floorplan': plan})
+        assert response.status_code == 400, bad
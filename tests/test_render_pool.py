@@ -0,0 +1,41 @@
+import os
+
+import fitz
+
+
+def _pdf(path, pages):
+    doc = fitz.open()
+    for i in range(pages):
+        doc.new_page(width=300, height=200).insert_text((20, 40), f'Level {i}')
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+def test_pages_render_in_one_shared_pool(app_module, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'RENDER_PROCESSES', 2)
+    pdfs = [_pdf(tmp_path / f'plan{n}.pdf', 3) for n in range(2)]
+
+    pools = []
+    for pdf in pdfs:
+        pdf_hash = app_module.file_sha256(pdf)
+        app_module.render_pages_parallel(pdf, [0, 1, 2], zoom=1, pdf_hash=pdf_hash)
+        pools.append(app_module.get_render_pool())
+        for n in range(3):
+            assert os.path.exists(os.path.join(app_module.RENDER_CACHE_FOLDER, f'{pdf_hash}_p{n}_z1.png'))
+
+    assert pools[0] is pools[1]
+    assert pools[0]._mp_context.get_start_method() == 'forkserver'
+    # The pool was started once and its workers outlive each call
+    assert all(p.is_alive() for p in pools[0]._processes.values())
+
+
+def test_page_memos_are_bounded(app_module, tmp_path, monkeypatch):
+    memo = app_module.LRUMemo(2)
+    monkeypatch.setattr(app_module, '_page_count_memo', memo)
+    pdf = _pdf(tmp_path / 'plan.pdf', 2)
+    for key in ('a', 'b', 'a', 'c'):
+        assert app_module.get_page_count(pdf, pdf_hash=key) == 2
+
+    assert len(memo) == 2
+    assert memo.get('a') == 2 and memo.get('c') == 2 and memo.get('b') is None
@@ -0,0 +1,153 @@
+import json
+import time
+from contextlib import closing
+
+import pytest
+import requests
+
+
+def _reply(status, retry_after=None):
+    response = requests.Response()
+    response.status_code = status
+    response.url = 'https://simpro.test/api'
+    response._content = b'{}'
+    response._content_consumed = True
+    if retry_after is not None:
+        response.headers['Retry-After'] = retry_after
+    return response
+
+
+class FakeSession:
+    """Stands in for the shared HTTP session, answering with canned statuses"""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, kwargs['headers']['Authorization']))
+        return self.replies.pop(0)
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+
+
+@pytest.fixture
+def limiter(app_module, monkeypatch):
+    fake = CountingLimiter()
+    monkeypatch.setattr(app_module, 'simpro_rate_limiter', fake)
+    tokens = iter(range(100))
+    monkeypatch.setattr(app_module, 'get_simpro_token', lambda force_refresh=False: (
+        {'base_url': 'https://simpro.test', 'company_id': 0}, f'token-{next(tokens)}'))
+    monkeypatch.setattr(app_module, 'SIMPRO_BACKOFF', 0)
+    return fake
+
+
+def test_retries_wait_for_the_rate_limiter(app_module, monkeypatch, limiter):
+    http = FakeSession([_reply(429, '0'), _reply(503), _reply(200)])
+    monkeypatch.setattr(app_module, 'get_simpro_session', lambda: http)
+    assert app_module.simpro_send('/jobs/').status_code == 200
+    assert len(http.calls) == limiter.acquired == 3
+
+
+def test_posts_are_not_retried(app_module, monkeypatch, limiter):
+    http = FakeSession([_reply(429, '0'), _reply(200)])
+    monkeypatch.setattr(app_module, 'get_simpro_session', lambda: http)
+    with pytest.raises(requests.HTTPError):
+        app_module.simpro_send('/quotes/', method='POST', data={})
+    assert len(http.calls) == limiter.acquired == 1
+
+
+def test_unauthorised_refreshes_the_token_once(app_module, monkeypatch, limiter):
+    http = FakeSession([_reply(401), _reply(401)])
+    monkeypatch.setattr(app_module, 'get_simpro_session', lambda: http)
+    with pytest.raises(requests.HTTPError):
+        app_module.simpro_send('/jobs/')
+    assert [auth for _, auth in http.calls] == ['Bearer token-0', 'Bearer token-1']
+
+
+def test_retry_after_and_backoff(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'SIMPRO_BACKOFF', 0.5)
+    assert app_module.simpro_retry_delay(_reply(429, '7'), 0) == 7
+    assert app_module.simpro_retry_delay(_reply(429, 'Thu, 01 Jan 1970 00:00:00 GMT'), 0) == 0
+    assert app_module.simpro_retry_delay(_reply(503), 2) == 2
+
+
+def test_rate_limiter_spaces_requests(app_module):
+    bucket = app_module.SimproRateLimiter(20, burst=1)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.18
+
+
+def _mirror(app_module, resource, ids):
+    with closing(app_module._connect_sqlite(app_module.SIMPRO_MIRROR_DB)) as con:
+        with con:
+            con.execute("DELETE FROM simpro_records WHERE resource = ?", (resource,))
+            app_module._store_simpro_items(con, resource, [{'ID': i} for i in ids], time.time(), None)
+
+
+def test_mirror_is_read_in_keyset_batches(app_module):
+    ids = [12, 'B-2', 3, 'A-1', 40, 7, 'C-3', 1]
+    _mirror(app_module, 'stream-test', ids)
+    batches = list(app_module.iter_simpro_mirror('stream-test', batch_size=3))
+    assert [len(b) for b in batches] == [3, 3, 2]
+    assert [item['ID'] for b in batches for item in b] == ['A-1', 'B-2', 'C-3', 1, 3, 7, 12, 40]
+
+
+def test_all_streams_from_the_mirror_in_batches(app_module, client, monkeypatch):
+    _mirror(app_module, 'labor-rates', range(1, 26))
+    with closing(app_module._connect_sqlite(app_module.SIMPRO_MIRROR_DB)) as con:
+        with con:
+            con.execute("INSERT OR REPLACE INTO simpro_sync(resource, synced_at, full_synced_at) "
+                        "VALUES('labor-rates', ?, ?)", (time.time(), time.time()))
+
+    batches, iter_mirror = [], app_module.iter_simpro_mirror
+
+    def spy(resource, batch_size=None):
+        for batch in iter_mirror(resource, batch_size=10):
+            batches.append(len(batch))
+            yield batch
+    monkeypatch.setattr(app_module, 'iter_simpro_mirror', spy)
+
+    response = client.get('/api/simpro/labor-rates', query_string={'all': 1})
+    assert response.headers['X-Simpro-Source'] == 'mirror'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [item['ID'] for item in lines] == list(range(1, 26))
+    assert batches == [10, 10, 5]
+
+
+def test_session_is_shared_per_process(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, '_simpro_session', None)
+    http = app_module.get_simpro_session()
+    assert app_module.get_simpro_session() is http
+    adapter = http.get_adapter('https://simpro.test')
+    assert adapter._pool_maxsize == app_module.SIMPRO_POOL_SIZE
+    assert adapter.max_retries.status == 0
+
+
+def test_token_is_cached_and_renewed_before_expiry(app_module, monkeypatch):
+    app_module.write_json_atomic(app_module.SIMPRO_CONFIG_FILE, {
+        **app_module.SIMPRO_DEFAULT_CONFIG, 'base_url': 'https://simpro.test', 'client_id': 'id',
+        'client_secret': 'secret', 'company_id': 0})
+    monkeypatch.setattr(app_module, '_simpro_token', None)
+    issued = []
+
+    def request_token(config):
+        issued.append(config['client_id'])
+        lifetime = app_module.SIMPRO_TOKEN_MARGIN + (1 if len(issued) == 1 else 3600)
+        return f'token-{len(issued)}', None, time.time() + lifetime
+    monkeypatch.setattr(app_module, 'request_simpro_token', request_token)
+
+    assert app_module.get_simpro_token()[1] == 'token-1'
+    time.sleep(1.1)
+    # Inside the renewal margin: a new token is fetched, then served from memory
+    assert app_module.get_simpro_token()[1] == 'token-2'
+    assert app_module.get_simpro_token()[1] == 'token-2'
+    assert len(issued) == 2
@@ -0,0 +1,53 @@
+class FakeListEndpoint:
+    """A Simpro list endpoint: summary columns unless `columns` is passed, DateModified ge() filter"""
+
+    def __init__(self, count, honour_columns=True):
+        self.items = [{'ID': i, 'Name': f'Item {i}', 'DateModified': f'2024-01-01T{i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d}'}
+                      for i in range(1, count + 1)]
+        self.honour_columns = honour_columns
+        self.requests = []
+
+    def __call__(self, endpoint, method='GET', data=None, params=None):
+        params = params or {}
+        self.requests.append(params)
+        items = self.items
+        since = params.get('DateModified', '')
+        if since.startswith('ge('):
+            items = [item for item in items if item['DateModified'] >= since[3:-1]]
+        columns = params.get('columns', '').split(',') if self.honour_columns and params.get('columns') else ['ID', 'Name']
+        size, page = int(params.get('pageSize', 50)), int(params.get('page', 1))
+        chunk = [{k: v for k, v in item.items() if k in columns} for item in items[(page - 1) * size:page * size]]
+
+        class Reply:
+            headers = {'Result-Total': str(len(items))}
+
+            def json(self):
+                return chunk
+        return Reply()
+
+
+def _sync(app_module, resource):
+    assert app_module._claim_simpro_sync(resource, ignore_backoff=True)
+    return app_module.sync_simpro_resource(resource)
+
+
+def test_incremental_sync_requests_modified_column(app_module, monkeypatch):
+    fake = FakeListEndpoint(600)
+    monkeypatch.setattr(app_module, 'simpro_send', fake)
+    first = _sync(app_module, 'catalogs')
+    assert first['full'] and first['total'] == 600
+    assert 'DateModified' in fake.requests[0]['columns'].split(',')
+
+    fake.items[5]['DateModified'] = '2024-02-01T00:00:00'
+    second = _sync(app_module, 'catalogs')
+    assert not second['full']
+    # ge() re-reads the record at the previous high-water mark too
+    assert second['fetched'] == 2
+
+
+def test_sync_without_modified_field_falls_back_to_full(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'simpro_send', FakeListEndpoint(40, honour_columns=False))
+    assert _sync(app_module, 'jobs')['full']
+    state = app_module.get_simpro_sync_state('jobs')
+    assert state['high_water'] is None and 'DateModified missing' in state['error']
+    assert _sync(app_module, 'jobs')['full']
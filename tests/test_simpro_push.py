@@ -0,0 +1,69 @@
+import time
+import uuid
+from contextlib import closing
+
+import pytest
+
+
+class FakeSimpro:
+    """Records POSTs and hands out IDs, standing in for simpro_send"""
+
+    def __init__(self):
+        self.posts = []
+        self.on_post = None
+
+    def __call__(self, endpoint, method='GET', data=None, params=None):
+        self.posts.append((endpoint, data))
+        if self.on_post:
+            self.on_post(endpoint)
+        simpro_id = len(self.posts)
+
+        class Reply:
+            def json(self):
+                return {'ID': simpro_id}
+        return Reply()
+
+
+@pytest.fixture
+def simpro(app_module, monkeypatch):
+    fake = FakeSimpro()
+    monkeypatch.setattr(app_module, 'simpro_send', fake)
+    return fake
+
+
+def _project(app_module, count):
+    project_id = str(time.time())
+    app_module.save_project({'timestamp': project_id, 'project_name': 'Push test', 'tier': 'basic',
+                             'placements': {'lighting': [{'position': (0, 0)}] * count}})
+    return project_id
+
+
+def test_revised_project_is_pushed_again(app_module, simpro):
+    project_id = _project(app_module, 2)
+    quote = {'customer_id': 1, 'project_id': project_id}
+    first, = app_module.push_simpro_quotes([quote], '5')
+    again, = app_module.push_simpro_quotes([quote], '5')
+    assert (first['status'], again['status']) == ('created', 'duplicate')
+
+    project = app_module.get_project(project_id)
+    project['placements']['lighting'].append({'position': (1, 1)})
+    app_module.save_project(project)
+    revised, = app_module.push_simpro_quotes([quote], '5')
+    assert revised['status'] == 'created'
+    assert revised['idempotency_key'] != first['idempotency_key']
+
+
+def test_push_stops_when_claim_is_taken(app_module, simpro):
+    key = f'claim-{uuid.uuid4().hex}'
+
+    def steal_claim(endpoint):
+        if endpoint.endswith('/oneOffs/'):
+            with closing(app_module._connect_sqlite(app_module.SIMPRO_MIRROR_DB)) as con:
+                with con:
+                    con.execute("UPDATE simpro_quote_pushes SET claim = 'other' WHERE idempotency_key = ?", (key,))
+    simpro.on_post = steal_claim
+
+    costs = app_module.calculate_costs({'lighting': [1, 2], 'security_access': [1]}, app_module.load_data())
+    result, = app_module.push_simpro_quotes([{'customer_id': 1, 'costs': costs, 'idempotency_key': key}], '5')
+    assert result['status'] == 'in_progress'
+    assert sum(endpoint.endswith('/oneOffs/') for endpoint, _ in simpro.posts) == 1